@@ -0,0 +1,155 @@
+"""Допуск запросов на приём транзакций.
+
+AdmissionController решает сразу, без ожидания места в очереди: запрос
+отклоняется с 429, если очередь заполнена выше high_watermark или у
+источника (API source) кончились токены в его token bucket. Retry-After
+считается из текущего отставания: сколько при нынешнем темпе разбора
+воркерам нужно, чтобы очередь опустилась до resume_ratio от порога, либо
+когда в bucket'е источника накопятся нужные токены.
+
+Отклонённые запросы (load shed) считаются по причинам и по источникам.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+MAX_TRACKED_SOURCES = 10000
+
+
+class Decision(NamedTuple):
+    admitted: bool
+    reason: Optional[str] = None      # queue_full | rate_limited
+    retry_after: int = 0
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst в запасе."""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float) -> float:
+        """Списывает cost токенов; если их не хватает, возвращает секунды до пополнения."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        cost = min(cost, self.burst)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+def parse_client_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """'admin=500:1000,partner=50:100' -> {source: (rate, burst)}; burst по умолчанию равен rate."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        source, _, value = item.partition('=')
+        rate, _, burst = value.partition(':')
+        if not source or not rate:
+            raise ValueError(f"invalid client limit '{item}', expected source=rate[:burst]")
+        limits[source.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class AdmissionController:
+    """depth() — глубина очереди, drain_rate() — темп её разбора (транзакций/с).
+
+    client_rate/client_burst — лимит по умолчанию для любого источника
+    (0 — без лимита), client_limits — отдельные лимиты источников.
+    """
+
+    def __init__(self, capacity: int, depth: Callable[[], int], drain_rate: Callable[[], float],
+                 high_watermark: float = 0.9, resume_ratio: float = 0.8,
+                 min_retry_after: int = 1, max_retry_after: int = 60,
+                 client_rate: float = 0.0, client_burst: float = 0.0,
+                 client_limits: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.capacity = capacity
+        self.depth = depth
+        self.drain_rate = drain_rate
+        self.limit = max(1, int(capacity * high_watermark))
+        self.resume_level = int(self.limit * resume_ratio)
+        self.min_retry_after = min_retry_after
+        self.max_retry_after = max_retry_after
+        self.client_rate = client_rate
+        self.client_burst = client_burst or client_rate
+        self.client_limits = client_limits or {}
+        self.admitted_total = 0
+        self.shed_by_reason: Dict[str, int] = {}
+        self.shed_by_source: Dict[str, int] = {}
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def admit(self, source: str, cost: int = 1) -> Decision:
+        """Допуск запроса из source, ставящего в очередь до cost транзакций."""
+        depth = self.depth()
+        if depth >= self.limit:
+            decision = Decision(False, 'queue_full', self._backlog_retry_after(depth))
+        else:
+            wait = self._take_tokens(source, cost)
+            decision = Decision(True) if wait <= 0 else Decision(False, 'rate_limited', self._clamp(wait))
+        if decision.admitted:
+            with self._lock:
+                self.admitted_total += 1
+        else:
+            self.record_shed(source, decision.reason)
+        return decision
+
+    def charge(self, source: str, cost: int) -> float:
+        """Списывает cost токенов у уже допущенного потока; > 0 — сколько секунд ждать пополнения."""
+        return self._take_tokens(source, cost)
+
+    def retry_after(self) -> int:
+        """Retry-After для переполнения очереди, замеченного уже после допуска."""
+        return self._backlog_retry_after(self.depth())
+
+    def record_shed(self, source: Optional[str], reason: str, count: int = 1):
+        with self._lock:
+            self.shed_by_reason[reason] = self.shed_by_reason.get(reason, 0) + count
+            if source is not None and (source in self.shed_by_source or len(self.shed_by_source) < MAX_TRACKED_SOURCES):
+                self.shed_by_source[source] = self.shed_by_source.get(source, 0) + count
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "admitted_total": self.admitted_total,
+                "shed_total": sum(self.shed_by_reason.values()),
+                "shed_by_reason": dict(self.shed_by_reason),
+                "shed_by_source": dict(self.shed_by_source),
+                "queue_depth": self.depth(),
+                "queue_limit": self.limit,
+                "queue_capacity": self.capacity,
+                "drain_rate": round(self.drain_rate(), 2),
+                "client_rate": self.client_rate or None,
+                "client_limits": {source: {"rate": rate, "burst": burst}
+                                  for source, (rate, burst) in self.client_limits.items()},
+            }
+
+    def _take_tokens(self, source: str, cost: int) -> float:
+        rate, burst = self.client_limits.get(source, (self.client_rate, self.client_burst))
+        if rate <= 0:
+            return 0.0
+        with self._lock:
+            bucket = self._buckets.get(source)
+            if bucket is None:
+                bucket = self._buckets[source] = TokenBucket(rate, burst)
+                if len(self._buckets) > MAX_TRACKED_SOURCES:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(source)
+            return bucket.take(cost)
+
+    def _backlog_retry_after(self, depth: int) -> int:
+        rate = self.drain_rate()
+        if rate <= 0:
+            return self.max_retry_after
+        return self._clamp((depth - self.resume_level) / rate)
+
+    def _clamp(self, seconds: float) -> int:
+        return max(self.min_retry_after, min(self.max_retry_after, math.ceil(seconds)))
@@ -1,18 +1,24 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import json
 import csv
 import tempfile
 import os
 import io
-from queue import Queue
-import re
+import itertools
+import base64
+import binascii
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from queue import Full
 import sys
 from datetime import datetime
 from urllib.parse import urlparse, parse_qs
 import threading
 import uuid
 import logging
-from typing import Dict, List, Optional
+import functools
+from typing import Dict, List, Optional, Tuple
 import time
 import signal
 
@@ -20,6 +26,24 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
     
 from methods.threerules import threshold_rule, pattern_rule, composite_rule
 from notifications.notification import RedisHandler
+from transaction_store import TransactionStore
+from body_streams import BodyStream, ChunkedReader, LimitedReader
+from validation import TransactionValidator
+from scoring import (BatchScorer, BatchStats, FraudModel, init_process_scorer, is_number, load_rules,
+                     pattern_inputs_from, required_fields, score_in_process, validate_rules)
+from worker_pool import WorkerSupervisor
+from admission import AdmissionController, parse_client_limits
+from log_pipeline import LogPipeline
+from metrics import ApiMetrics
+from shard_queue import ShardedQueue
+from tracing import Tracer
+from import_jobs import ImportJobs
+from journal import Journal, JournalUnavailable
+from dedup import RotatingBloomFilter
+from pattern_state import PatternState, window_seconds
+from compression import (ENCODINGS, BodyTooLarge, CorruptBody, DecompressingReader, compress, compressor,
+                         negotiate)
+import json_codec
 
 class CorrelationFilter(logging.Filter):
     def filter(self, record):
@@ -29,179 +53,726 @@ class CorrelationFilter(logging.Filter):
             record.component = 'main'
         return True
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - [%(component)s] [%(correlation_id)s] %(message)s',
+# json — запись на строку с component/correlation_id, text — прежний формат
+LOG_FORMAT = os.getenv("API_LOG_FORMAT", "json")
+LOG_FILE = os.getenv("API_LOG_FILE", "transaction_service.log")
+LOG_QUEUE_SIZE = int(os.getenv("API_LOG_QUEUE_SIZE", "10000"))
+# INFO по транзакциям сверх этого числа в секунду прореживается до доли LOG_INFO_SAMPLE_RATIO
+LOG_INFO_RATE_LIMIT = int(os.getenv("API_LOG_INFO_RATE_LIMIT", "200"))
+LOG_INFO_SAMPLE_RATIO = float(os.getenv("API_LOG_INFO_SAMPLE_RATIO", "0.01"))
+log_pipeline = LogPipeline(
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler('transaction_service.log', encoding='utf-8')
-    ]
+        logging.FileHandler(LOG_FILE, encoding='utf-8')
+    ],
+    filters=[CorrelationFilter()],
+    json_format=LOG_FORMAT == 'json',
+    queue_size=LOG_QUEUE_SIZE,
+    info_rate_limit=LOG_INFO_RATE_LIMIT,
+    info_sample_ratio=LOG_INFO_SAMPLE_RATIO
 )
 logger = logging.getLogger()
-logger.addFilter(CorrelationFilter())
+log_pipeline.install(logger)
 
 redis = RedisHandler()
-WORKER_COUNT = 4
-MAX_QUEUE_SIZE = 1000
-transactions: Dict[str, Dict] = {}
-processing_queue = Queue(maxsize=MAX_QUEUE_SIZE)
-VALID_TRANSACTION_TYPES = {"withdrawal", "deposit", "transfer", "payment", "refund"}
-VALID_MERCHANT_CATEGORIES = {"utilities", "online", "other", "entertainment", "travel", "retail", "food", "transport"}
-VALID_DEVICES = {"mobile", "atm", "pos", "web", "terminal"}
-VALID_FRAUD_TYPES = {"card_theft", "account_takeover", "merchant_fraud", "money_laundering", "phishing", ""}
-VALID_PAYMENT_CHANNELS = {"card", "ACH", "wire_transfer", "UPI", "cash", "digital_wallet"}
-ID_PATTERN = re.compile(r"^[a-zA-Z0-9_-]{6,64}$")
-IP_PATTERN = re.compile(r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$")
-DEVICE_HASH_PATTERN = re.compile(r"^[A-F0-9]{8}$")
+WORKER_COUNT = int(os.getenv("API_WORKER_COUNT", "4"))
+MAX_QUEUE_SIZE = int(os.getenv("API_MAX_QUEUE_SIZE", "1000"))
+# очередь делится на шарды по sender_account: транзакции отправителя оцениваются по порядку,
+# воркеров работает не больше, чем шардов (см. shard_queue.py)
+QUEUE_SHARDS = int(os.getenv("API_QUEUE_SHARDS", "16"))
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "3000"))
+# http — http.server с потоком на соединение, asyncio — uvicorn (см. asgi_server.py)
+SERVER_MODE = os.getenv("API_SERVER_MODE", "http")
+# сколько секунд держать простаивающее keep-alive соединение в режиме http
+KEEPALIVE_TIMEOUT = float(os.getenv("API_KEEPALIVE_TIMEOUT", "15"))
+ASYNC_HANDLER_THREADS = int(os.getenv("API_ASYNC_HANDLER_THREADS", "32"))
+# остановка по SIGTERM: столько секунд воркеры дорабатывают очередь, новые POST получают 503 с Retry-After
+DRAIN_DEADLINE_SECONDS = float(os.getenv("API_DRAIN_DEADLINE_SECONDS", "25"))
+DRAIN_RETRY_AFTER = int(os.getenv("API_DRAIN_RETRY_AFTER", "5"))
+# без журнала недоработанные транзакции сохраняются сюда и снова ставятся в очередь при запуске
+DRAIN_SPILL_PATH = os.getenv("API_DRAIN_SPILL_PATH", "pending_transactions.ndjson")
+# сколько после дедлайна ждать, пока воркеры закончат текущие пачки
+DRAIN_WORKER_JOIN_SECONDS = 5
+STORE_MAX_SIZE = int(os.getenv("API_STORE_MAX_SIZE", "1000000"))
+STORE_TTL_SECONDS = float(os.getenv("API_STORE_TTL_SECONDS", str(24 * 3600)))
+# журнал предзаписи и снимки хранилища (см. journal.py); пусто — хранилище только в памяти
+JOURNAL_DIR = os.getenv("API_JOURNAL_DIR", "")
+# 1 — ответ о приёме транзакции уходит только после fsync журнала
+JOURNAL_DURABLE = os.getenv("API_JOURNAL_DURABLE", "1") == "1"
+JOURNAL_SNAPSHOT_INTERVAL = float(os.getenv("API_JOURNAL_SNAPSHOT_INTERVAL", "300"))
+JOURNAL_SNAPSHOT_MB = float(os.getenv("API_JOURNAL_SNAPSHOT_MB", "64"))
+# фильтр повторных transaction_id за окно дольше жизни записей в хранилище (см. dedup.py); 0 — только хранилище
+DEDUP_CAPACITY = int(os.getenv("API_DEDUP_CAPACITY", "5000000"))
+DEDUP_FP_RATE = float(os.getenv("API_DEDUP_FP_RATE", "1e-6"))
+DEDUP_WINDOW_HOURS = float(os.getenv("API_DEDUP_WINDOW_HOURS", str(7 * 24)))
+DEDUP_BUCKETS = int(os.getenv("API_DEDUP_BUCKETS", "7"))
+# состояние фильтра; по умолчанию рядом с журналом, без журнала не сохраняется
+DEDUP_STATE_PATH = os.getenv("API_DEDUP_STATE_PATH", os.path.join(JOURNAL_DIR, "dedup.filter") if JOURNAL_DIR else "")
+DEDUP_SAVE_INTERVAL = float(os.getenv("API_DEDUP_SAVE_INTERVAL", "60"))
+# история для /pattern без data (см. pattern_state.py): окно правила не длиннее retention; 0 — выключено
+PATTERN_STATE_RETENTION_HOURS = float(os.getenv("API_PATTERN_STATE_RETENTION_HOURS", "24"))
+PATTERN_STATE_MAX_PREDICATES = int(os.getenv("API_PATTERN_STATE_MAX_PREDICATES", "32"))
+# потолок памяти истории: отметок всего (по три на транзакцию) и в ряду одного ключа; 0 — без ограничения
+PATTERN_STATE_MAX_ENTRIES = int(os.getenv("API_PATTERN_STATE_MAX_ENTRIES", "3000000"))
+PATTERN_STATE_MAX_ENTRIES_PER_KEY = int(os.getenv("API_PATTERN_STATE_MAX_ENTRIES_PER_KEY", "10000"))
+transaction_store = TransactionStore(max_size=STORE_MAX_SIZE, ttl_seconds=STORE_TTL_SECONDS)
+# окно, за которое считается доля занятости воркера в api_worker_busy_ratio
+METRICS_WORKER_WINDOW = float(os.getenv("API_METRICS_WORKER_WINDOW", "10"))
+api_metrics = ApiMetrics(worker_window=METRICS_WORKER_WINDOW)
+# отрезки этапов приёма и оценки в кольцевом буфере (GET /debug/traces); 0 — трассировка выключена
+TRACE_BUFFER = int(os.getenv("API_TRACE_BUFFER", "100000"))
+# файл NDJSON, куда отрезки дописываются раз в API_TRACE_EXPORT_INTERVAL секунд; пусто — не писать
+TRACE_FILE = os.getenv("API_TRACE_FILE", "")
+TRACE_EXPORT_INTERVAL = float(os.getenv("API_TRACE_EXPORT_INTERVAL", "1"))
+# запросы, у которых трассируются parse/validate/enqueue/respond
+TRACED_PATHS = frozenset({'/transactions', '/transactions/import-json', '/transactions/ingest-ndjson'})
+tracer = Tracer(TRACE_BUFFER, TRACE_FILE, TRACE_EXPORT_INTERVAL)
+tracer.start_export()
 
+def _observe_queue_wait(seconds: float, tx: Dict):
+    api_metrics.queue_wait.observe(seconds)
+    tracer.record(tx.get('correlation_id'), 'queue_wait', time.perf_counter() - seconds, seconds)
+
+processing_queue = ShardedQueue(QUEUE_SHARDS, maxsize=MAX_QUEUE_SIZE, observe_wait=_observe_queue_wait)
+
+def _open_journal() -> Optional[Journal]:
+    if not JOURNAL_DIR:
+        return None
+    journal = Journal(JOURNAL_DIR, durable=JOURNAL_DURABLE, snapshot_interval=JOURNAL_SNAPSHOT_INTERVAL,
+                      snapshot_bytes=int(JOURNAL_SNAPSHOT_MB * 1024 * 1024))
+    recovery = journal.open(transaction_store)
+    logger.info(f"Recovered {recovery['records']} transactions from {JOURNAL_DIR} in {recovery['seconds']:.2f}s "
+                f"(snapshot {recovery['snapshot']}, {recovery['journal_entries']} journal entries)",
+                extra={'component': 'journal', 'correlation_id': 'system'})
+    return journal
+
+# восстановление до запуска пула процессов и воркеров
+journal = _open_journal()
+
+def _open_duplicate_filter() -> Optional[RotatingBloomFilter]:
+    if DEDUP_CAPACITY <= 0:
+        return None
+    if DEDUP_WINDOW_HOURS * 3600 < STORE_TTL_SECONDS:
+        logger.warning("API_DEDUP_WINDOW_HOURS is shorter than the store TTL: ids still in the store "
+                       "but outside the window will not be detected as duplicates",
+                       extra={'component': 'dedup', 'correlation_id': 'system'})
+    if DEDUP_CAPACITY < STORE_MAX_SIZE:
+        logger.warning("API_DEDUP_CAPACITY is smaller than API_STORE_MAX_SIZE: the filter rotates early and forgets "
+                       "ids before they are evicted from the store",
+                       extra={'component': 'dedup', 'correlation_id': 'system'})
+    duplicate_filter = RotatingBloomFilter(DEDUP_CAPACITY, DEDUP_FP_RATE, DEDUP_WINDOW_HOURS * 3600, DEDUP_BUCKETS)
+    if DEDUP_STATE_PATH:
+        try:
+            duplicate_filter.load(DEDUP_STATE_PATH)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load dedup filter from {DEDUP_STATE_PATH}, starting empty: {str(e)}",
+                           extra={'component': 'dedup', 'correlation_id': 'system'})
+        duplicate_filter.start_autosave(DEDUP_STATE_PATH, DEDUP_SAVE_INTERVAL)
+    # принятое после последнего сохранения фильтра уже восстановлено в хранилище из журнала
+    for (tx_id,) in transaction_store.select(('transaction_id',), received_from=duplicate_filter.saved_at,
+                                             limit=max(1, len(transaction_store))):
+        duplicate_filter.add(tx_id)
+    return duplicate_filter
+
+duplicate_filter = _open_duplicate_filter()
+
+def _open_pattern_state() -> Optional[PatternState]:
+    if PATTERN_STATE_RETENTION_HOURS <= 0:
+        return None
+    pattern_state = PatternState(PATTERN_STATE_RETENTION_HOURS * 3600, PATTERN_STATE_MAX_PREDICATES,
+                                 max_entries=PATTERN_STATE_MAX_ENTRIES,
+                                 max_entries_per_key=PATTERN_STATE_MAX_ENTRIES_PER_KEY)
+    # транзакции, восстановленные из журнала; select отдаёт от новых к старым
+    fields = ('timestamp', 'amount', 'sender_account', 'receiver_account')
+    rows = transaction_store.select(fields, received_from=time.time() - pattern_state.retention_seconds,
+                                    limit=max(1, len(transaction_store)))
+    for row in reversed(rows):
+        pattern_state.record(dict(zip(fields, row)))
+    return pattern_state
+
+pattern_state = _open_pattern_state()
+
+def _record_pattern_state(tx: Dict):
+    if pattern_state is not None:
+        pattern_state.record(tx)
+
+def _transaction_exists(tx_id: str) -> bool:
+    # queue_failed в очередь не попала, клиент получил 429 и повторяет с тем же id:
+    # повтор заменяет запись в хранилище (id из фильтра дубликатов не удалить)
+    status = transaction_store.status_of(tx_id)
+    if status == 'queue_failed':
+        return False
+    # хранилище проверяется точно; фильтр нужен только для уже вытесненных id,
+    # и его отрицательный ответ после переполнения не должен пропустить дубликат из хранилища
+    if status is not None or duplicate_filter is None:
+        return status is not None
+    return duplicate_filter.check(tx_id, transaction_store.__contains__)
+
+def _remember_transaction_id(tx_id: str):
+    # до store.add: параллельный запрос с тем же id уже увидит его в фильтре
+    if duplicate_filter is not None:
+        duplicate_filter.add(tx_id)
+
+transaction_validator = TransactionValidator(exists=_transaction_exists)
+CSV_EXPORT_COLUMNS = [
+    'transaction_id', 'timestamp', 'sender_account', 'receiver_account',
+    'amount', 'transaction_type', 'merchant_category', 'location',
+    'device_used', 'is_fraud', 'fraud_type', 'time_since_last_transaction',
+    'spending_deviation_score', 'velocity_score', 'geo_anomaly_score',
+    'payment_channel', 'ip_address', 'device_hash', 'correlation_id',
+    'status', 'received_at', 'processed_at'
+]
+# номер последнего изменения записи: колонка выгрузки since= и поле списка
+CHANGE_SEQ_FIELD = 'change_seq'
+CSV_EXPORT_BATCH_SIZE = 1000
+# ответы списка и экспорта сжимаются по Accept-Encoding, если тело не меньше порога
+COMPRESS_MIN_BYTES = int(os.getenv("API_COMPRESS_MIN_BYTES", "1024"))
+# предел распакованного тела для запросов, которые читаются целиком (NDJSON разбирается потоково)
+MAX_DECOMPRESSED_BYTES = int(float(os.getenv("API_MAX_DECOMPRESSED_MB", "256")) * 1024 * 1024)
+# поля строки GET /transactions без fields= и всё, что можно запросить через fields=
+LIST_FIELDS = (
+    'transaction_id', 'correlation_id', 'timestamp', 'sender_account', 'receiver_account',
+    'amount', 'transaction_type', 'merchant_category', 'location', 'device_used', 'is_fraud',
+    'status', 'received_at'
+)
+LIST_AVAILABLE_FIELDS = tuple(CSV_EXPORT_COLUMNS) + (
+    'queued_at', 'completed_at', 'error', 'queue_position', 'rule_results', 'triggered_rules',
+    'fraud_score', 'risk_level', 'alert', 'severity', CHANGE_SEQ_FIELD
+)
+NDJSON_BATCH_SIZE = 500
+NDJSON_MAX_LINE_BYTES = 1024 * 1024
+NDJSON_MAX_ERRORS = 100
+# import-json?async=1: пачки фонового задания, число одновременно идущих заданий, сколько ошибок
+# хранить и сколько секунд помнить завершённое задание
+IMPORT_JOB_BATCH_SIZE = int(os.getenv("API_IMPORT_JOB_BATCH_SIZE", "500"))
+IMPORT_JOB_WORKERS = int(os.getenv("API_IMPORT_JOB_WORKERS", "2"))
+IMPORT_JOB_MAX_ERRORS = int(os.getenv("API_IMPORT_JOB_MAX_ERRORS", "100"))
+IMPORT_JOB_RETENTION_SECONDS = float(os.getenv("API_IMPORT_JOB_RETENTION_SECONDS", "3600"))
+# микропачки воркеров: не больше SCORING_BATCH_SIZE и не дольше SCORING_MAX_WAIT_MS добора
+SCORING_BATCH_SIZE = int(os.getenv("API_SCORING_BATCH_SIZE", "64"))
+SCORING_MAX_WAIT_MS = float(os.getenv("API_SCORING_MAX_WAIT_MS", "20"))
+RULES_FILE = os.getenv("API_RULES_FILE", "")
+SCORING_MODEL_PATH = os.getenv("API_SCORING_MODEL_PATH", "")
+SCORING_STATE_PATH = os.getenv("API_SCORING_STATE_PATH", "")
+SCORING_SEND_ALERTS = os.getenv("API_SCORING_SEND_ALERTS", "0") == "1"
+PATTERN_HISTORY_LIMIT = int(os.getenv("API_PATTERN_HISTORY_LIMIT", "10000"))
+# не больше стольких транзакций в одном POST /rules/evaluate-batch
+RULES_BATCH_MAX = int(os.getenv("API_RULES_BATCH_MAX", "10000"))
+# пул воркеров растёт от API_WORKER_MIN до API_WORKER_MAX по глубине очереди (см. worker_pool.py)
+WORKER_MIN = int(os.getenv("API_WORKER_MIN", str(WORKER_COUNT)))
+WORKER_MAX = int(os.getenv("API_WORKER_MAX", str(max(WORKER_MIN, 4 * (os.cpu_count() or 1)))))
+AUTOSCALE_INTERVAL = float(os.getenv("API_AUTOSCALE_INTERVAL", "1"))
+AUTOSCALE_TARGET_DRAIN_SECONDS = float(os.getenv("API_AUTOSCALE_TARGET_DRAIN_SECONDS", "2"))
+# thread — оценка в потоках воркеров, process — в пуле из API_SCORING_PROCESSES процессов
+WORKER_BACKEND = os.getenv("API_WORKER_BACKEND", "thread")
+SCORING_PROCESSES = int(os.getenv("API_SCORING_PROCESSES", str(os.cpu_count() or 1)))
+# приём отклоняется с 429, когда очередь заполнена выше этой доли MAX_QUEUE_SIZE
+ADMISSION_HIGH_WATERMARK = float(os.getenv("API_ADMISSION_HIGH_WATERMARK", "0.9"))
+ADMISSION_MAX_RETRY_AFTER = int(os.getenv("API_ADMISSION_MAX_RETRY_AFTER", "60"))
+# token bucket на источник (заголовок X-API-Source, иначе IP): транзакций/с и запас; 0 — без лимита
+CLIENT_RATE_LIMIT = float(os.getenv("API_CLIENT_RATE_LIMIT", "0"))
+CLIENT_BURST = float(os.getenv("API_CLIENT_BURST", "0"))
+# отдельные лимиты источников: "admin=500:1000,partner=50:100"
+CLIENT_LIMITS = parse_client_limits(os.getenv("API_CLIENT_LIMITS", ""))
 class TransactionProcessor:
-    def __init__(self):
+    """Воркеры разбирают шарды processing_queue микропачками и оценивают их BatchScorer'ом."""
+
+    def __init__(self, scorer: BatchScorer, batch_size: int, max_wait_ms: float,
+                 executor: Optional[ProcessPoolExecutor] = None):
         self.running = True
+        self.scorer = scorer
+        self.executor = executor
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = BatchStats()
+
+    def next_batch(self) -> Tuple[Optional[int], List[Dict]]:
+        """Ждёт свободный шард с транзакциями до секунды, затем добирает пачку не дольше max_wait.
 
-    def process_transaction(self, tx_data: Dict):
-        tx_id = tx_data['transaction_id']
-        correlation_id = tx_data['correlation_id']
+        Шард остаётся за воркером, пока тот не вызовет processing_queue.release.
+        """
+        return processing_queue.take(self.batch_size, timeout=1, max_wait=self.max_wait)
+
+    def process_batch(self, batch: List[Dict]):
+        started = time.perf_counter()
+        transactions = [tx for tx in batch if transaction_store.transition(tx['transaction_id'], 'processing')]
         try:
-            logger.info(f"Starting transaction processing",
-                        extra={'component': 'worker', 'correlation_id': correlation_id})
-            transactions[tx_id]['status'] = 'processing'
-            transactions[tx_id]['processed_at'] = datetime.now().isoformat()
-            time.sleep(0.1)
-            transactions[tx_id]['status'] = 'processed'
-            transactions[tx_id]['completed_at'] = datetime.now().isoformat()
-            logger.info(f"Transaction processed successfully",
-                        extra={'component': 'worker', 'correlation_id': correlation_id})
+            results = self._score(transactions)
         except Exception as e:
-            logger.error(f"Transaction processing failed: {str(e)}",
-                         extra={'component': 'worker', 'correlation_id': correlation_id})
-            transactions[tx_id]['status'] = 'failed'
-            transactions[tx_id]['error'] = str(e)
+            self.stats.record_failure(len(transactions))
+            logger.error(f"Batch scoring failed for {len(transactions)} transactions: {str(e)}",
+                         extra={'component': 'worker', 'correlation_id': 'system'})
+            for tx in transactions:
+                transaction_store.transition(tx['transaction_id'], 'failed', error=str(e))
+            return
+        alerts = 0
+        for tx, result in zip(transactions, results):
+            transaction_store.transition(tx['transaction_id'], 'processed', **result)
+            if result['alert']:
+                alerts += 1
+                logger.warning(f"Fraud alert: risk={result['risk_level']}, rules={result['triggered_rules']}",
+                               extra={'component': 'worker', 'correlation_id': tx['correlation_id']})
+                if SCORING_SEND_ALERTS:
+                    self._send_alert(tx, result)
+        latency = time.perf_counter() - started
+        self.stats.record(len(transactions), latency, alerts)
+        for tx in transactions:
+            tracer.record(tx['correlation_id'], 'score', started, latency)
+        logger.info(f"Scored batch of {len(transactions)} transactions in {latency * 1000:.1f} ms, alerts: {alerts}",
+                    extra={'component': 'worker', 'correlation_id': 'system'})
+
+    def _score(self, transactions: List[Dict]) -> List[Dict]:
+        # история pattern-правил читается из хранилища здесь, в процесс уходят только данные
+        pattern_inputs = self.scorer.pattern_inputs(transactions)
+        executor = self.executor
+        if executor is not None:
+            try:
+                return executor.submit(score_in_process, transactions, pattern_inputs).result()
+            except BrokenProcessPool as e:
+                self.executor = None
+                logger.error(f"Scoring process pool is broken, falling back to worker threads: {str(e)}",
+                             extra={'component': 'worker', 'correlation_id': 'system'})
+        return self.scorer.score_batch(transactions, pattern_inputs)
 
-def worker_loop(processor: TransactionProcessor):
-    while processor.running:
+    def _send_alert(self, tx: Dict, result: Dict):
+        details = {
+            "transaction": tx,
+            "risk_level": result['risk_level'],
+            "triggered_rules": result['triggered_rules'],
+            "notification_time": datetime.now().astimezone().isoformat()
+        }
         try:
-            tx_data = processing_queue.get(timeout=1)
-            if tx_data is None:
-                break
-            processor.process_transaction(tx_data)
-            processing_queue.task_done()
-        except:
-            continue
+            redis.send_alert(tx['transaction_id'], json.dumps(details, default=str), result['severity'])
+        except Exception as e:
+            logger.error(f"Alert delivery failed: {str(e)}",
+                         extra={'component': 'notifications', 'correlation_id': tx['correlation_id']})
+
+def worker_loop(processor: TransactionProcessor, stop_event: threading.Event):
+    api_metrics.workers.register()
+    try:
+        while processor.running and not stop_event.is_set():
+            shard, batch = processor.next_batch()
+            if shard is None:
+                continue
+            try:
+                with api_metrics.workers.busy():
+                    processor.process_batch(batch)
+            except Exception as e:
+                logger.error(f"Worker failed to process batch: {str(e)}",
+                             extra={'component': 'worker', 'correlation_id': 'system'})
+            finally:
+                # шард возвращается только после оценки пачки — следующая транзакция отправителя после неё
+                processing_queue.release(shard)
+                for _ in batch:
+                    processing_queue.task_done()
+    finally:
+        api_metrics.workers.forget()
 
-processor = TransactionProcessor()
-workers = []
-for i in range(WORKER_COUNT):
-    t = threading.Thread(target=worker_loop, args=(processor,), daemon=True, name=f"Worker-{i + 1}")
-    t.start()
-    workers.append(t)
+def _pattern_history(sender: str, receiver: str, received_from: float) -> List[Tuple]:
+    return transaction_store.select(('timestamp', 'amount'), sender=sender, receiver=receiver,
+                                    received_from=received_from, limit=PATTERN_HISTORY_LIMIT)
 
-def validate_transaction(data: Dict) -> List[str]:
-    errors = []
-    required_fields = [
-        'transaction_id', 'correlation_id', 'timestamp',
-        'sender_account', 'receiver_account', 'amount',
-        'transaction_type'
-    ]
-    for field in required_fields:
-        if field not in data:
-            errors.append(f"Missing required field: {field}")
-    if errors:
-        return errors
-    tx_id = data['transaction_id']
-    if not ID_PATTERN.match(tx_id):
-        errors.append("transaction_id must be 6-64 alphanumeric characters")
-    elif tx_id in transactions:
-        errors.append(f"transaction_id '{tx_id}' already exists")
-    correlation_id = data['correlation_id']
-    if not ID_PATTERN.match(correlation_id):
-        errors.append("correlation_id must be 6-64 alphanumeric characters")
-    amount = data['amount']
-    if not isinstance(amount, (int, float)) or amount <= 0:
-        errors.append("amount must be a positive number")
-    sender = data['sender_account']
-    receiver = data['receiver_account']
-    if not ID_PATTERN.match(sender):
-        errors.append("sender_account has invalid format")
-    if not ID_PATTERN.match(receiver):
-        errors.append("receiver_account has invalid format")
-    tx_type = data['transaction_type']
-    if tx_type not in VALID_TRANSACTION_TYPES:
-        errors.append(f"transaction_type must be one of {VALID_TRANSACTION_TYPES}")
-    timestamp = data['timestamp']
+def _load_scoring_model() -> Optional[FraudModel]:
+    if not SCORING_MODEL_PATH:
+        return None
     try:
-        ts = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-        if ts > datetime.now().astimezone(ts.tzinfo):
-            errors.append("timestamp cannot be in the future")
+        return FraudModel(SCORING_MODEL_PATH, SCORING_STATE_PATH or None)
     except Exception as e:
-        errors.append(f"timestamp is invalid: {str(e)}")
-    if 'merchant_category' in data and data['merchant_category'] not in VALID_MERCHANT_CATEGORIES:
-        errors.append(f"merchant_category must be one of {VALID_MERCHANT_CATEGORIES}")
-    if 'device_used' in data and data['device_used'] not in VALID_DEVICES:
-        errors.append(f"device_used must be one of {VALID_DEVICES}")
-    if 'is_fraud' in data and not isinstance(data['is_fraud'], bool):
-        errors.append("is_fraud must be a boolean value")
-    if 'fraud_type' in data and data['fraud_type'] not in VALID_FRAUD_TYPES:
-        errors.append(f"fraud_type must be one of {VALID_FRAUD_TYPES}")
-    if 'time_since_last_transaction' in data and not isinstance(data['time_since_last_transaction'], (int, float)):
-        errors.append("time_since_last_transaction must be a number")
-    if 'spending_deviation_score' in data and not isinstance(data['spending_deviation_score'], (int, float)):
-        errors.append("spending_deviation_score must be a number")
-    if 'velocity_score' in data and not isinstance(data['velocity_score'], (int, float)):
-        errors.append("velocity_score must be a number")
-    if 'geo_anomaly_score' in data and not isinstance(data['geo_anomaly_score'], (int, float)):
-        errors.append("geo_anomaly_score must be a number")
-    if 'payment_channel' in data and data['payment_channel'] not in VALID_PAYMENT_CHANNELS:
-        errors.append(f"payment_channel must be one of {VALID_PAYMENT_CHANNELS}")
-    if 'ip_address' in data and data['ip_address'] and not IP_PATTERN.match(data['ip_address']):
-        errors.append("ip_address has invalid format")
-    if 'device_hash' in data and data['device_hash'] and not DEVICE_HASH_PATTERN.match(data['device_hash']):
-        errors.append("device_hash must be 8 hex characters")
-    return errors
+        logger.warning(f"Fraud model is disabled, failed to load {SCORING_MODEL_PATH}: {str(e)}",
+                       extra={'component': 'scoring', 'correlation_id': 'system'})
+        return None
+
+def _start_scoring_pool(scorer: BatchScorer) -> Optional[ProcessPoolExecutor]:
+    if WORKER_BACKEND != 'process':
+        return None
+    # fork, а не spawn: spawn заново выполнил бы api.py в каждом процессе. С fork пул
+    # создаёт все процессы при первом submit — он делается здесь, до запуска воркеров;
+    # уже работает только писатель логов, а процессы пула пишут логи мимо его очереди
+    pool = ProcessPoolExecutor(max_workers=SCORING_PROCESSES, mp_context=multiprocessing.get_context('fork'),
+                               initializer=init_process_scorer, initargs=(scorer.rules, scorer.model))
+    pool.submit(int).result()
+    return pool
+
+scorer = BatchScorer(load_rules(RULES_FILE or None), _pattern_history, _load_scoring_model())
+processor = TransactionProcessor(scorer, SCORING_BATCH_SIZE, SCORING_MAX_WAIT_MS, _start_scoring_pool(scorer))
+supervisor = WorkerSupervisor(lambda stop_event: worker_loop(processor, stop_event),
+                              depth=processing_queue.qsize, completed=processor.stats.completed,
+                              # лишний воркер сверх числа шардов ждал бы аренды впустую
+                              min_workers=min(WORKER_MIN, QUEUE_SHARDS), max_workers=min(WORKER_MAX, QUEUE_SHARDS),
+                              interval=AUTOSCALE_INTERVAL,
+                              target_drain_seconds=AUTOSCALE_TARGET_DRAIN_SECONDS)
+supervisor.start()
+admission = AdmissionController(MAX_QUEUE_SIZE, depth=processing_queue.qsize,
+                                drain_rate=lambda: supervisor.drain_rate,
+                                high_watermark=ADMISSION_HIGH_WATERMARK,
+                                max_retry_after=ADMISSION_MAX_RETRY_AFTER,
+                                client_rate=CLIENT_RATE_LIMIT, client_burst=CLIENT_BURST,
+                                client_limits=CLIENT_LIMITS)
+api_metrics.watch(queue_depth=processing_queue.qsize, queue_capacity=MAX_QUEUE_SIZE,
+                  worker_count=lambda: supervisor.size, status_counts=transaction_store.status_counts,
+                  transition_totals=transaction_store.transition_totals,
+                  shard_loads=lambda: processing_queue.snapshot()["by_shard"])
+# маршруты с постоянной меткой endpoint в api_request_duration_seconds; прочие пути — 'other'
+METRICS_ENDPOINTS = frozenset({
+    '/', '/metrics', '/transactions', '/transactions/count', '/transactions/export-csv',
+    '/transactions/import-json', '/transactions/ingest-ndjson', '/scoring/stats',
+    '/admission/stats', '/logging/stats', '/journal/stats', '/dedup/stats', '/pattern/stats', '/drain/stats',
+    '/queue/stats', '/debug/traces', '/notifications/create',
+    '/threshold', '/pattern', '/composite', '/rules/evaluate-batch',
+})
+
+def _requeue_recovered(items: List[Dict]):
+    """Принятые, но не оценённые до перезапуска транзакции снова встают в очередь."""
+    for item in items:
+        if transaction_store.transition(item['transaction_id'], 'queued'):
+            processing_queue.put(item)
+    logger.info(f"Re-enqueued {len(items)} recovered transactions",
+                extra={'component': 'journal', 'correlation_id': 'system'})
+
+def _load_spill() -> List[Dict]:
+    """Транзакции, сохранённые прошлой остановкой без журнала; файл удаляется после чтения."""
+    if not DRAIN_SPILL_PATH or not os.path.exists(DRAIN_SPILL_PATH):
+        return []
+    items = []
+    with open(DRAIN_SPILL_PATH, 'rb') as f:
+        for line in f:
+            if line.strip():
+                items.append(json_codec.loads(line))
+    for item in items:
+        _remember_transaction_id(item['transaction_id'])
+        transaction_store.add(item, 'received')
+        _record_pattern_state(item)
+    os.remove(DRAIN_SPILL_PATH)
+    logger.info(f"Loaded {len(items)} transactions left by the previous shutdown from {DRAIN_SPILL_PATH}",
+                extra={'component': 'shutdown', 'correlation_id': 'system'})
+    return items
+
+recovered = transaction_store.pending() if journal is not None else _load_spill()
+if recovered:
+    # put блокируется, пока воркеры не освободят место, — отдельным потоком
+    threading.Thread(target=_requeue_recovered, args=(recovered,), daemon=True, name="JournalRequeue").start()
+
+def journal_sync() -> bool:
+    """Ждёт fsync журнала перед ответом о приёме (если журнал включён); False — запись журнала не удалась."""
+    return journal is None or journal.sync()
+
+def validate_transaction(data: Dict) -> List[str]:
+    return transaction_validator.validate(data)
+
+def _parse_time_param(value: Optional[str]) -> Optional[float]:
+    """from/to для списка: epoch-секунды или ISO-дата (наивная — локальное время, как received_at)."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+def _parse_since(value: str) -> int:
+    """since= для выборки изменений: change_seq, после которого нужны изменения."""
+    since = int(value)
+    if since < 0:
+        raise ValueError("since must not be negative")
+    return since
+
+def _stale_since(since: int, high_water_mark: int) -> Optional[Dict]:
+    """Отметка больше текущей — хранилище начало нумерацию заново (перезапуск без журнала)."""
+    if since <= high_water_mark:
+        return None
+    return {
+        "error": "since is ahead of the store high-water mark; restart the export from since=0",
+        "since": since,
+        "high_water_mark": high_water_mark
+    }
+
+def _encode_cursor(cursor: Optional[Tuple[float, str]]) -> Optional[str]:
+    """Непрозрачный токен курсора списка: base64url от [received_at, transaction_id]."""
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json_codec.dumps(list(cursor))).rstrip(b'=').decode('ascii')
+
+def _decode_cursor(token: str) -> Tuple[float, str]:
+    try:
+        received_at, tx_id = json_codec.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return float(received_at), str(tx_id)
+    except (ValueError, TypeError, binascii.Error) as e:
+        raise ValueError("malformed cursor token") from e
+
+def import_transactions(items: List, correlation_id: str, start_index: int = 0) -> Tuple[int, List[Tuple[int, Dict]]]:
+    """Валидирует и ставит в очередь пачку транзакций.
+
+    Возвращает число добавленных и список (номер элемента, описание ошибки);
+    номера считаются от start_index.
+    """
+    added_count = 0
+    errors = []
+    records = []
+    validate_started = time.perf_counter()
+    for index, item in enumerate(items, start=start_index):
+        if not isinstance(item, dict):
+            errors.append((index, {'transaction': 'unknown', 'errors': ["transaction must be a JSON object"]}))
+            continue
+        if 'correlation_id' not in item:
+            item['correlation_id'] = f"{correlation_id}-{index}"
+        records.append((index, item))
+    # одна скомпилированная проверка и одно «сейчас» на всю пачку
+    batch_errors = transaction_validator.validate_batch([item for _, item in records])
+    enqueue_started = time.perf_counter()
+    tracer.record(correlation_id, 'validate', validate_started, enqueue_started - validate_started)
+    for (index, item), validation_errors in zip(records, batch_errors):
+        try:
+            if validation_errors:
+                errors.append((index, {
+                    'transaction': item.get('transaction_id', 'unknown'),
+                    'errors': validation_errors
+                }))
+                continue
+            _remember_transaction_id(item['transaction_id'])
+            transaction_store.add(item, 'queued')
+            try:
+                # место уже дождались в import_with_backpressure; put ждёт только гонку с другими запросами
+                processing_queue.put(item, timeout=1)
+            except Full:
+                transaction_store.transition(item['transaction_id'], 'queue_failed', error="Queue is full")
+                admission.record_shed(None, 'queue_full')
+                errors.append((index, {'transaction': item['transaction_id'], 'error': "processing queue full"}))
+                continue
+            # только принятые: отказ с queue_failed клиент повторит, и её посчитали бы дважды
+            _record_pattern_state(item)
+            added_count += 1
+        except Exception as e:
+            errors.append((index, {
+                'transaction': item.get('transaction_id', 'unknown'),
+                'error': str(e) or type(e).__name__
+            }))
+    if added_count and not journal_sync():
+        # транзакции уже в очереди, но подтверждать их приём как сохранённый нельзя
+        raise JournalUnavailable("transaction journal write failed")
+    tracer.record(correlation_id, 'enqueue', enqueue_started, time.perf_counter() - enqueue_started)
+    errors.sort(key=lambda error: error[0])
+    return added_count, errors
+
+def _wait_for_queue_room(count: int) -> bool:
+    """Ждёт места в очереди под часть импорта (синхронного, NDJSON, задания); False — сервис останавливается.
+
+    Порог тот же, что у допуска (ADMISSION_HIGH_WATERMARK): потоковый импорт
+    не забирает место, на котором синхронные запросы получили бы 429.
+    """
+    limit = MAX_QUEUE_SIZE * ADMISSION_HIGH_WATERMARK
+    while not draining.is_set():
+        depth = processing_queue.qsize()
+        # пачка больше порога проходит в пустую очередь, иначе ждала бы вечно
+        if depth == 0 or depth + count <= limit:
+            return True
+        time.sleep(0.05)
+    return False
+
+def _wait_for_tokens(source: str, cost: int) -> bool:
+    """Ждёт токенов источника под пачку NDJSON; False — сервис останавливается."""
+    while not draining.is_set():
+        wait = admission.charge(source, cost)
+        if wait <= 0:
+            return True
+        time.sleep(min(wait, 0.5))
+    return False
+
+def _shutdown_error(item) -> Dict:
+    return {'transaction': item.get('transaction_id', 'unknown') if isinstance(item, dict) else 'unknown',
+            'error': "service is shutting down"}
+
+def import_with_backpressure(items: List, correlation_id: str,
+                             start_index: int = 0) -> Tuple[int, List[Tuple[int, Dict]]]:
+    """import_transactions частями, которые помещаются в очередь, с ожиданием места перед каждой.
+
+    Часть не больше порога допуска: пачка крупнее свободного места ждёт, пока
+    воркеры его освободят, а не отбрасывается как queue_failed. Пока сервис
+    останавливается, транзакции получают ошибку "service is shutting down".
+    """
+    step = max(1, min(NDJSON_BATCH_SIZE, int(MAX_QUEUE_SIZE * ADMISSION_HIGH_WATERMARK)))
+    added_count, errors = 0, []
+    for offset in range(0, len(items), step):
+        part = items[offset:offset + step]
+        if not _wait_for_queue_room(len(part)):
+            errors.extend((start_index + offset + i, _shutdown_error(item)) for i, item in enumerate(part))
+            continue
+        added, part_errors = import_transactions(part, correlation_id, start_index + offset)
+        added_count += added
+        errors.extend(part_errors)
+    return added_count, errors
+
+import_jobs = ImportJobs(import_with_backpressure, _wait_for_queue_room, batch_size=IMPORT_JOB_BATCH_SIZE,
+                         workers=IMPORT_JOB_WORKERS, max_errors=IMPORT_JOB_MAX_ERRORS,
+                         retention_seconds=IMPORT_JOB_RETENTION_SECONDS)
+
+def _observed(handler):
+    """Задержка и статус ответа метода do_* попадают в api_request_duration_seconds."""
+    @functools.wraps(handler)
+    def wrapper(self):
+        started = time.perf_counter()
+        self._status = None
+        # correlation_id трассируемого запроса (TRACED_PATHS); keep-alive переиспользует обработчик
+        self._trace_id = None
+        try:
+            handler(self)
+        finally:
+            api_metrics.observe_request(self.command, self._endpoint(), self._status or 500,
+                                        time.perf_counter() - started)
+    return wrapper
 
 class FraudDetectionAPIHandler(BaseHTTPRequestHandler):
+    # keep-alive: у каждого ответа Content-Length или chunked-тело
+    protocol_version = 'HTTP/1.1'
+    # простаивающее keep-alive соединение закрывается через timeout секунд
+    timeout = KEEPALIVE_TIMEOUT
+    # заголовки и тело уходят отдельными записями: без TCP_NODELAY второй
+    # сегмент на живом соединении ждёт delayed ACK клиента (~40 мс)
+    disable_nagle_algorithm = True
+    _trace_id = None
+
     def _set_cors_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Content-Encoding')
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def _endpoint(self) -> str:
+        path = urlparse(self.path).path
+        if path in METRICS_ENDPOINTS:
+            return path
+        if path.startswith('/transactions/'):
+            return '/transactions/{id}'
+        if path.startswith('/jobs/'):
+            return '/jobs/{id}'
+        return 'other'
 
+    @_observed
     def do_OPTIONS(self):
         self.send_response(200)
         self._set_cors_headers()
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
-    def _send_json_response(self, status_code: int, data: Dict, correlation_id: str = None):
+    def _send_json_response(self, status_code: int, data: Dict, correlation_id: str = None,
+                            headers: Optional[Dict] = None, compressible: bool = False):
+        """data — свежий словарь ответа: correlation_id дописывается прямо в него.
+
+        compressible — тело от COMPRESS_MIN_BYTES сжимается кодировкой из Accept-Encoding.
+        """
+        with tracer.span(self._trace_id, 'respond'):
+            self._write_json_response(status_code, data, correlation_id, headers, compressible)
+
+    def _write_json_response(self, status_code: int, data: Dict, correlation_id: Optional[str],
+                             headers: Optional[Dict], compressible: bool):
+        if correlation_id:
+            data['correlation_id'] = correlation_id
+        body = json_codec.dumps(data)
+        headers = dict(headers or {})
+        if compressible:
+            headers['Vary'] = 'Accept-Encoding'
+            encoding = negotiate(self.headers.get('Accept-Encoding')) if len(body) >= COMPRESS_MIN_BYTES else None
+            if encoding is not None:
+                started = time.thread_time()
+                raw_size, body = len(body), compress(body, encoding)
+                api_metrics.observe_compression('response', encoding, raw_size, len(body),
+                                                time.thread_time() - started)
+                headers['Content-Encoding'] = encoding
         self.send_response(status_code)
         self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if self.close_connection:
+            # без заголовка keep-alive клиент отправит следующий запрос в уже закрытое соединение
+            self.send_header('Connection', 'close')
         self._set_cors_headers()
         self.end_headers()
-        response_data = data.copy()
-        if correlation_id:
-            response_data['correlation_id'] = correlation_id
-        self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+        self.wfile.write(body)
+
+    def _send_metrics(self):
+        body = api_metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', api_metrics.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
     def _log_request(self, method: str, path: str, correlation_id: str = None):
         logger.info(f"{method} {path}",
                     extra={'component': 'api', 'correlation_id': correlation_id or 'unknown'})
 
+    def log_message(self, format, *args):
+        # access-лог http.server писал в stderr синхронно; запросы и так логирует _log_request
+        logger.debug(format % args, extra={'component': 'http', 'correlation_id': 'system'})
+
+    def log_error(self, format, *args):
+        logger.warning(format % args, extra={'component': 'http', 'correlation_id': 'system'})
+
+    @_observed
     def do_GET(self):
         parsed_path = urlparse(self.path)
         correlation_id = str(uuid.uuid4())
         self._log_request('GET', self.path, correlation_id)
         try:
             if parsed_path.path == '/transactions/count':
+                status_counts = transaction_store.status_counts()
                 self._send_json_response(200, {
-                    "count": len(transactions),
+                    "count": len(transaction_store),
                     "queue_size": processing_queue.qsize(),
-                    "processed_count": len([t for t in transactions.values() if t.get('status') == 'processed']),
-                    "failed_count": len([t for t in transactions.values() if t.get('status') == 'failed'])
+                    "processed_count": status_counts.get('processed', 0),
+                    "failed_count": status_counts.get('failed', 0),
+                    "by_status": status_counts,
+                    "transitions_total": transaction_store.transition_totals(),
+                    "evicted_count": transaction_store.evicted_count,
+                    "pending_over_limit": transaction_store.pending_over_limit
                 }, correlation_id)
+            elif parsed_path.path == '/scoring/stats':
+                self._send_json_response(200, {
+                    "batch_size": processor.batch_size,
+                    "max_wait_ms": SCORING_MAX_WAIT_MS,
+                    "rules": [rule['name'] for rule in scorer.rules],
+                    "model_loaded": scorer.model is not None,
+                    "backend": 'process' if processor.executor is not None else 'thread',
+                    "workers": supervisor.snapshot(),
+                    "batches": processor.stats.snapshot()
+                }, correlation_id)
+            elif parsed_path.path == '/logging/stats':
+                self._send_json_response(200, log_pipeline.snapshot(), correlation_id)
+            elif parsed_path.path == '/admission/stats':
+                self._send_json_response(200, admission.snapshot(), correlation_id)
+            elif parsed_path.path == '/journal/stats':
+                self._send_json_response(200, journal.snapshot() if journal is not None else {"enabled": False},
+                                         correlation_id)
+            elif parsed_path.path == '/dedup/stats':
+                self._send_json_response(200, duplicate_filter.snapshot() if duplicate_filter is not None
+                                         else {"enabled": False}, correlation_id)
+            elif parsed_path.path == '/debug/traces':
+                self._get_traces(parsed_path.query, correlation_id)
+            elif parsed_path.path == '/queue/stats':
+                self._send_json_response(200, processing_queue.snapshot(), correlation_id)
+            elif parsed_path.path == '/drain/stats':
+                self._send_json_response(200, _drain_snapshot(), correlation_id)
+            elif parsed_path.path == '/pattern/stats':
+                self._send_json_response(200, pattern_state.snapshot() if pattern_state is not None
+                                         else {"enabled": False}, correlation_id)
+            elif parsed_path.path == '/metrics':
+                self._send_metrics()
             elif parsed_path.path == '/transactions/export-csv':
-                self._export_to_csv(correlation_id)
+                self._export_to_csv(parsed_path.query, correlation_id)
             elif parsed_path.path == '/transactions':
                 self._get_transactions_list(parsed_path.query, correlation_id)
             elif parsed_path.path.startswith('/transactions/'):
                 tx_id = parsed_path.path.split('/')[-1]
                 self._get_transaction_details(tx_id, correlation_id)
+            elif parsed_path.path.startswith('/jobs/'):
+                job = import_jobs.get(parsed_path.path.split('/')[-1])
+                if job is None:
+                    self._send_json_response(404, {"error": "Import job not found"}, correlation_id)
+                else:
+                    self._send_json_response(200, job.snapshot(), correlation_id)
             else:
                 info = {
                     "message": "Financial Transactions Fraud Detection API",
@@ -220,10 +791,27 @@ class FraudDetectionAPIHandler(BaseHTTPRequestHandler):
                     },
                     "endpoints": {
                         "add_transaction": "POST /transactions",
+                        "import_json": "POST /transactions/import-json",
+                        "import_json_async": "POST /transactions/import-json?async=1",
+                        "import_job": "GET /jobs/{id}",
+                        "ingest_ndjson": "POST /transactions/ingest-ndjson",
                         "get_transaction": "GET /transactions/{id}",
-                        "list_transactions": "GET /transactions",
-                        "export_csv": "GET /transactions/export-csv",
-                        "stats": "GET /transactions/count"
+                        "list_transactions": "GET /transactions?status=&sender=&receiver=&from=&to=&page=&limit=&cursor=&order=&fields=",
+                        "list_changes": "GET /transactions?since=<change_seq>&limit=&fields=&status=&sender=&receiver=",
+                        "export_csv": "GET /transactions/export-csv?status=&sender=&receiver=&from=&to=&columns=&gzip=1",
+                        "export_csv_changes": "GET /transactions/export-csv?since=<change_seq>&columns=&gzip=1",
+                        "evaluate_rules_batch": "POST /rules/evaluate-batch",
+                        "stats": "GET /transactions/count",
+                        "scoring_stats": "GET /scoring/stats",
+                        "admission_stats": "GET /admission/stats",
+                        "logging_stats": "GET /logging/stats",
+                        "journal_stats": "GET /journal/stats",
+                        "dedup_stats": "GET /dedup/stats",
+                        "pattern_state_stats": "GET /pattern/stats",
+                        "drain_stats": "GET /drain/stats",
+                        "queue_stats": "GET /queue/stats",
+                        "traces": "GET /debug/traces?correlation_id=...&stage=...&limit=20",
+                        "metrics": "GET /metrics"
                     }
                 }
                 self._send_json_response(200, info, correlation_id)
@@ -232,32 +820,84 @@ class FraudDetectionAPIHandler(BaseHTTPRequestHandler):
                          extra={'component': 'api', 'correlation_id': correlation_id})
             self._send_json_response(500, {"error": "Internal server error"}, correlation_id)
 
+    @_observed
     def do_POST(self):
         content_length = int(self.headers.get('Content-Length', 0))
         correlation_id = str(uuid.uuid4())
+        parsed_path = urlparse(self.path)
         self._log_request('POST', self.path, correlation_id)
+        if parsed_path.path in TRACED_PATHS:
+            self._trace_id = correlation_id
+        if draining.is_set():
+            # тело не читается, поэтому соединение закрывается; клиент повторит на другом экземпляре
+            self.close_connection = True
+            self._send_json_response(503, {
+                "error": "Service is shutting down",
+                "retry_after": DRAIN_RETRY_AFTER
+            }, correlation_id, headers={'Retry-After': str(DRAIN_RETRY_AFTER)})
+            return
+        encoding = self._content_encoding()
+        if encoding is not None and encoding not in ENCODINGS:
+            self.close_connection = True
+            self._send_json_response(415, {"error": f"Unsupported Content-Encoding: {encoding}"}, correlation_id,
+                                     headers={'Accept-Encoding': ', '.join(ENCODINGS)})
+            return
+        if parsed_path.path == '/transactions/ingest-ndjson':
+            # тело читается потоково внутри обработчика, в том числе chunked
+            if not self._admit(1, correlation_id):
+                return
+            try:
+                self._ingest_ndjson(correlation_id)
+            except JournalUnavailable:
+                self.close_connection = True
+                self._send_journal_unavailable(correlation_id)
+            except CorruptBody as e:
+                self.close_connection = True
+                self._send_json_response(400, {"error": str(e)}, correlation_id)
+            except Exception as e:
+                logger.error(f"NDJSON ingest failed: {str(e)}",
+                             extra={'component': 'import', 'correlation_id': correlation_id})
+                self.close_connection = True
+                self._send_json_response(500, {"error": "Internal server error"}, correlation_id)
+            return
         if content_length == 0:
             self._send_json_response(400, {"error": "Empty request body"}, correlation_id)
             return
         try:
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
-            if self.path == '/transactions':
-                self._add_transaction(data, correlation_id)
-            elif self.path == '/transactions/import-json':
-                self._import_json_data(data, correlation_id)
-            elif self.path == '/notifications/create':
+            parse_started = time.perf_counter()
+            if encoding is None:
+                post_data = self.rfile.read(content_length)
+            else:
+                try:
+                    post_data = self._read_compressed_body()
+                except (CorruptBody, BodyTooLarge) as e:
+                    self.close_connection = True
+                    self._send_json_response(413 if isinstance(e, BodyTooLarge) else 400, {"error": str(e)},
+                                             correlation_id)
+                    return
+            data = json_codec.loads(post_data)
+            tracer.record(self._trace_id, 'parse', parse_started, time.perf_counter() - parse_started)
+            if parsed_path.path == '/transactions':
+                if self._admit(1, correlation_id):
+                    self._add_transaction(data, correlation_id)
+            elif parsed_path.path == '/transactions/import-json':
+                self._import_json_data(data, correlation_id, parsed_path.query)
+            elif parsed_path.path == '/notifications/create':
                 self._send_notification(data, correlation_id)
-            elif self.path == '/threshold':
+            elif parsed_path.path == '/threshold':
                 self._check_threshold_rule(data=data, correlation_id=correlation_id)
-            elif self.path == '/pattern':
+            elif parsed_path.path == '/pattern':
                 self._check_pattern_rule(data=data, correlation_id=correlation_id)
-            elif self.path == '/composite':
+            elif parsed_path.path == '/composite':
                 self._check_composite_rule(data=data, correlation_id=correlation_id)
+            elif parsed_path.path == '/rules/evaluate-batch':
+                self._evaluate_rules_batch(data, correlation_id)
             else:
                 self._send_json_response(404, {"error": "Endpoint not found"}, correlation_id)
         except json.JSONDecodeError:
             self._send_json_response(400, {"error": "Invalid JSON format"}, correlation_id)
+        except JournalUnavailable:
+            self._send_journal_unavailable(correlation_id)
         except Exception as e:
             logger.error(f"POST request failed: {str(e)}",
                          extra={'component': 'api', 'correlation_id': correlation_id})
@@ -266,23 +906,25 @@ class FraudDetectionAPIHandler(BaseHTTPRequestHandler):
     def _add_transaction(self, data: Dict, correlation_id: str):
         if 'correlation_id' not in data:
             data['correlation_id'] = correlation_id
-        errors = validate_transaction(data)
+        with tracer.span(correlation_id, 'validate'):
+            errors = validate_transaction(data)
         if errors:
             logger.warning(f"Validation failed: {errors}",
                            extra={'component': 'validation', 'correlation_id': correlation_id})
             self._send_json_response(400, {"error": "Validation failed", "details": errors}, correlation_id)
             return
         tx_id = data['transaction_id']
-        transactions[tx_id] = {
-            **data,
-            'status': 'received',
-            'received_at': datetime.now().isoformat(),
-            'queue_position': processing_queue.qsize() + 1
-        }
+        enqueue_started = time.perf_counter()
+        _remember_transaction_id(tx_id)
+        transaction_store.add(data, 'received', queue_position=processing_queue.qsize() + 1)
         try:
-            processing_queue.put(data, timeout=5)
-            transactions[tx_id]['status'] = 'queued'
-            transactions[tx_id]['queued_at'] = datetime.now().isoformat()
+            processing_queue.put_nowait(data)
+            _record_pattern_state(data)
+            transaction_store.transition(tx_id, 'queued')
+            if not journal_sync():
+                self._send_journal_unavailable(correlation_id)
+                return
+            tracer.record(correlation_id, 'enqueue', enqueue_started, time.perf_counter() - enqueue_started)
             logger.info(f"Transaction queued successfully",
                         extra={'component': 'queue', 'correlation_id': correlation_id})
             self._send_json_response(202, {
@@ -290,180 +932,461 @@ class FraudDetectionAPIHandler(BaseHTTPRequestHandler):
                 "transaction_id": tx_id,
                 "queue_position": processing_queue.qsize()
             }, correlation_id)
-        except Exception as e:
-            transactions[tx_id]['status'] = 'queue_failed'
-            transactions[tx_id]['error'] = str(e)
-            logger.error(f"Failed to queue transaction: {str(e)}",
-                         extra={'component': 'queue', 'correlation_id': correlation_id})
-            self._send_json_response(503, {
-                "error": "Service temporarily unavailable",
-                "details": "Queue is full"
-            }, correlation_id)
+        except Full:
+            # очередь заполнилась между допуском и put
+            transaction_store.transition(tx_id, 'queue_failed', error="Queue is full")
+            admission.record_shed(self._client_source(), 'queue_full')
+            self._send_too_many_requests('queue_full', admission.retry_after(), correlation_id)
 
-    def _import_json_data(self, json_data: Dict, correlation_id: str):
-        added_count = 0
-        failed_count = 0
-        errors = []
+    def _import_json_data(self, json_data: Dict, correlation_id: str, query_string: str = ''):
         if isinstance(json_data, list):
             transactions_list = json_data
         elif isinstance(json_data, dict) and 'transactions' in json_data:
             transactions_list = json_data['transactions']
         else:
             transactions_list = [json_data]
-        for item in transactions_list:
-            try:
-                if 'correlation_id' not in item:
-                    item['correlation_id'] = f"{correlation_id}-{added_count}"
-                validation_errors = validate_transaction(item)
-                if validation_errors:
-                    failed_count += 1
-                    errors.append({
-                        'transaction': item.get('transaction_id', 'unknown'),
-                        'errors': validation_errors
-                    })
-                    continue
-                tx_id = item['transaction_id']
-                transactions[tx_id] = {
-                    **item,
-                    'status': 'queued',
-                    'received_at': datetime.now().isoformat(),
-                    'queued_at': datetime.now().isoformat()
-                }
-                processing_queue.put(item, timeout=1)
-                added_count += 1
-            except Exception as e:
-                failed_count += 1
-                errors.append({
-                    'transaction': item.get('transaction_id', 'unknown'),
-                    'error': str(e)
-                })
+        if parse_qs(query_string).get('async', ['0'])[0] in ('1', 'true'):
+            # задание само ждёт места в очереди, но токены списываются за все транзакции сразу
+            if not self._admit(len(transactions_list), correlation_id):
+                return
+            job = import_jobs.submit(transactions_list, correlation_id)
+            logger.info(f"Import job {job.id} accepted: {job.total} transactions",
+                        extra={'component': 'import', 'correlation_id': correlation_id})
+            self._send_json_response(202, {
+                "message": "Import accepted for background processing",
+                "job_id": job.id,
+                "total": job.total,
+                "status_url": f"/jobs/{job.id}"
+            }, correlation_id, headers={'Location': f"/jobs/{job.id}"})
+            return
+        if not self._admit(len(transactions_list), correlation_id):
+            return
+        added_count, errors = import_with_backpressure(transactions_list, correlation_id)
+        failed_count = len(errors)
         result = {
             "message": f"Import completed: {added_count} added, {failed_count} failed",
             "added_count": added_count,
             "failed_count": failed_count
         }
         if errors:
-            result["errors"] = errors[:10]
+            result["errors"] = [error for _, error in errors[:10]]
+        self._send_json_response(207, result, correlation_id)
+
+    def _client_source(self) -> str:
+        """Ключ лимитов: X-API-Source (api_source в админке), иначе IP клиента."""
+        return self.headers.get('X-API-Source') or self.client_address[0]
+
+    def _admit(self, cost: int, correlation_id: str) -> bool:
+        """Допуск до постановки в очередь; при отказе сразу отвечает 429."""
+        source = self._client_source()
+        decision = admission.admit(source, cost)
+        if decision.admitted:
+            return True
+        logger.warning(f"Request from {source} rejected: {decision.reason}, retry after {decision.retry_after}s",
+                       extra={'component': 'admission', 'correlation_id': correlation_id})
+        # непрочитанное тело нельзя оставлять в соединении
+        self.close_connection = True
+        self._send_too_many_requests(decision.reason, decision.retry_after, correlation_id)
+        return False
+
+    def _send_journal_unavailable(self, correlation_id: str):
+        # транзакции уже в очереди и будут оценены, но durable-подтверждения нет
+        logger.error("Transaction journal write failed, acceptance not acknowledged",
+                     extra={'component': 'journal', 'correlation_id': correlation_id})
+        self._send_json_response(503, {"error": "Transaction journal is unavailable"}, correlation_id)
+
+    def _send_too_many_requests(self, reason: str, retry_after: int, correlation_id: str):
+        self._send_json_response(429, {
+            "error": "Too many requests",
+            "reason": reason,
+            "retry_after": retry_after
+        }, correlation_id, headers={'Retry-After': str(retry_after)})
+
+    def _body_stream(self) -> BodyStream:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            return ChunkedReader(self.rfile)
+        return LimitedReader(self.rfile, int(self.headers.get('Content-Length', 0)))
+
+    def _content_encoding(self) -> Optional[str]:
+        """Content-Encoding тела запроса; None — без сжатия."""
+        encoding = self.headers.get('Content-Encoding', '').strip().lower()
+        return encoding if encoding not in ('', 'identity') else None
+
+    def _request_stream(self, max_bytes: int = -1) -> BodyStream:
+        """Тело запроса с уже снятым Content-Encoding."""
+        stream = self._body_stream()
+        encoding = self._content_encoding()
+        return DecompressingReader(stream, encoding, max_bytes) if encoding is not None else stream
+
+    def _observe_request_body(self, stream: BodyStream):
+        if isinstance(stream, DecompressingReader):
+            api_metrics.observe_compression('request', stream.encoding, stream.raw_bytes, stream.wire_bytes,
+                                            stream.cpu_seconds)
+
+    def _read_compressed_body(self) -> bytes:
+        stream = self._request_stream(MAX_DECOMPRESSED_BYTES)
+        data = stream.read()
+        self._observe_request_body(stream)
+        return data
+
+    def _ingest_ndjson(self, correlation_id: str):
+        """NDJSON (объект на строку) читается из сокета построчно и ставится в очередь пачками."""
+        stream = self._request_stream()
+        lines_count = added_count = failed_count = 0
+        errors = []
+        batch, batch_lines = [], []
+
+        def add_error(line_no: int, error: Dict):
+            nonlocal failed_count
+            failed_count += 1
+            if len(errors) < NDJSON_MAX_ERRORS:
+                errors.append({'line': line_no, **error})
+
+        source = self._client_source()
+        # один токен уже списан при допуске потока
+        prepaid = 1
+        parse_started = time.perf_counter()
+
+        def flush():
+            nonlocal added_count, parse_started, prepaid
+            # parse — чтение и разбор строк пачки, дальше validate/enqueue из import_transactions
+            tracer.record(correlation_id, 'parse', parse_started, time.perf_counter() - parse_started)
+            # токены источника и место в очереди ждём перед каждой пачкой,
+            # и пока ждём, следующие строки из сокета не читаются
+            cost, prepaid = max(0, len(batch) - prepaid), max(0, prepaid - len(batch))
+            if _wait_for_tokens(source, cost):
+                added, batch_errors = import_with_backpressure(batch, correlation_id, start_index=batch_lines[0])
+            else:
+                added, batch_errors = 0, [(line_no, _shutdown_error(item)) for line_no, item in zip(batch_lines, batch)]
+            added_count += added
+            for index, error in batch_errors:
+                add_error(index, error)
+            batch.clear()
+            batch_lines.clear()
+            parse_started = time.perf_counter()
+
+        while True:
+            raw = stream.readline(NDJSON_MAX_LINE_BYTES + 1)
+            if not raw:
+                break
+            lines_count += 1
+            if len(raw) > NDJSON_MAX_LINE_BYTES:
+                while raw and not raw.endswith(b'\n'):
+                    raw = stream.readline(NDJSON_MAX_LINE_BYTES)
+                add_error(lines_count, {'transaction': 'unknown',
+                                        'error': f"line exceeds {NDJSON_MAX_LINE_BYTES} bytes"})
+                continue
+            line = raw.strip()
+            if not line:
+                continue
+            try:
+                item = json_codec.loads(line)
+            except json.JSONDecodeError:
+                add_error(lines_count, {'transaction': 'unknown', 'error': "Invalid JSON format"})
+                continue
+            batch.append(item)
+            batch_lines.append(lines_count)
+            if len(batch) >= NDJSON_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+        self._observe_request_body(stream)
+
+        result = {
+            "message": f"Ingest completed: {added_count} added, {failed_count} failed",
+            "lines": lines_count,
+            "added_count": added_count,
+            "failed_count": failed_count
+        }
+        if errors:
+            result["errors"] = errors
+            result["errors_truncated"] = failed_count > len(errors)
+        logger.info(f"NDJSON ingest completed: {added_count} added, {failed_count} failed",
+                    extra={'component': 'import', 'correlation_id': correlation_id})
         self._send_json_response(207, result, correlation_id)
 
-    def _export_to_csv(self, transactions: list[dict], correlation_id: str):
-        if not transactions:
-            self._send_json_response(404, {"error": "No transactions available"}, correlation_id)
+    def _begin_stream(self, status_code: int, content_type: str, headers: Optional[Dict] = None):
+        """Ответ неизвестной длины: chunked для HTTP/1.1, до закрытия соединения для HTTP/1.0."""
+        self._chunked = self.request_version == 'HTTP/1.1'
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self._chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            # HTTP/1.0-клиент узнает конец тела только по закрытию соединения
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self._set_cors_headers()
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes):
+        if not data:
             return
+        if self._chunked:
+            self.wfile.write(b'%X\r\n%s\r\n' % (len(data), data))
+        else:
+            self.wfile.write(data)
+
+    def _end_stream(self):
+        if self._chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _export_to_csv(self, query_string: str, correlation_id: str):
+        """Выгрузка CSV: вся или, с since=<change_seq>, только изменённое после отметки.
 
+        X-High-Water-Mark в ответе — отметка, до которой выгрузка полна: её
+        передают в since= следующей выгрузки. Удалённые и вытесненные записи
+        в дельту не попадают.
+        """
+        query_params = parse_qs(query_string)
+        since = None
+        if query_params.get('since'):
+            try:
+                since = _parse_since(query_params['since'][0])
+            except ValueError:
+                self._send_json_response(400, {"error": "since must be a non-negative integer"}, correlation_id)
+                return
+        available = CSV_EXPORT_COLUMNS + [CHANGE_SEQ_FIELD]
+        columns = CSV_EXPORT_COLUMNS if since is None else available
+        if query_params.get('columns'):
+            columns = [c for c in query_params['columns'][0].split(',') if c]
+            unknown = [c for c in columns if c not in available]
+            if unknown or not columns:
+                self._send_json_response(400, {
+                    "error": f"Unknown columns: {', '.join(unknown) or '(empty)'}",
+                    "available": available
+                }, correlation_id)
+                return
         try:
-            output = io.StringIO()
-            writer = csv.writer(output)
-
-            headers = [
-                'transaction_id', 'timestamp', 'sender_account', 'receiver_account',
-                'amount', 'transaction_type', 'merchant_category', 'location',
-                'device_used', 'is_fraud', 'fraud_type', 'time_since_last_transaction',
-                'spending_deviation_score', 'velocity_score', 'geo_anomaly_score',
-                'payment_channel', 'ip_address', 'device_hash', 'correlation_id',
-                'status', 'received_at', 'processed_at'
-            ]
-            writer.writerow(headers)
-
-            # Заполняем строки CSV
-            for tx in transactions:
-                writer.writerow([
-                    tx.get('transaction_id', ''),
-                    tx.get('timestamp', ''),
-                    tx.get('sender_account', ''),
-                    tx.get('receiver_account', ''),
-                    tx.get('amount', ''),
-                    tx.get('transaction_type', ''),
-                    tx.get('merchant_category', ''),
-                    tx.get('location', ''),
-                    tx.get('device_used', ''),
-                    tx.get('is_fraud', ''),
-                    tx.get('fraud_type', ''),
-                    tx.get('time_since_last_transaction', ''),
-                    tx.get('spending_deviation_score', ''),
-                    tx.get('velocity_score', ''),
-                    tx.get('geo_anomaly_score', ''),
-                    tx.get('payment_channel', ''),
-                    tx.get('ip_address', ''),
-                    tx.get('device_hash', ''),
-                    tx.get('correlation_id', ''),
-                    tx.get('status', ''),
-                    tx.get('received_at', ''),
-                    tx.get('processed_at', '')
-                ])
-
-            csv_data = output.getvalue().encode('utf-8')
-            output.close()
-
-            # Отправка CSV клиенту
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/csv; charset=utf-8')
-            self.send_header(
-                'Content-Disposition',
-                f'attachment; filename="transactions_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-            )
-            self.send_header('Content-Length', str(len(csv_data)))
-            self._set_cors_headers()
-            self.end_headers()
-            self.wfile.write(csv_data)
+            received_from = _parse_time_param(query_params.get('from', [None])[0])
+            received_to = _parse_time_param(query_params.get('to', [None])[0])
+        except ValueError as e:
+            self._send_json_response(400, {"error": f"Invalid time range: {str(e)}"}, correlation_id)
+            return
+        use_gzip = query_params.get('gzip', ['0'])[0] in ('1', 'true')
+        # gzip=1 — файл .gz для скачивания, иначе сжатие по Accept-Encoding прозрачно для клиента
+        encoding = 'gzip' if use_gzip else negotiate(self.headers.get('Accept-Encoding'))
 
-            logger.info(f"CSV export completed: {len(transactions)} transactions",
-                        extra={'component': 'export', 'correlation_id': correlation_id})
+        # отметка берётся до обхода: изменения во время выгрузки достанутся следующей
+        high_water_mark = transaction_store.change_seq
+        filters = {
+            'status': query_params.get('status', [None])[0] or None,
+            'sender': query_params.get('sender', [None])[0] or None,
+            'receiver': query_params.get('receiver', [None])[0] or None,
+            'received_from': received_from,
+            'received_to': received_to,
+            'batch_size': CSV_EXPORT_BATCH_SIZE
+        }
+        if since is None:
+            batches = transaction_store.iter_batches(**filters)
+        else:
+            stale = _stale_since(since, high_water_mark)
+            if stale is not None:
+                self._send_json_response(410, stale, correlation_id)
+                return
+            batches = transaction_store.iter_changes(since, high_water_mark, **filters)
+        first_batch = next(batches, None)
+        if not first_batch:
+            if since is None:
+                self._send_json_response(404, {"error": "No transactions available"}, correlation_id)
+                return
+            # пустая дельта — нормальный ответ: только заголовок CSV и та же отметка
+            first_batch = []
 
-        except Exception as e:
-            logger.error(f"CSV export failed: {str(e)}",
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for tx in first_batch:
+            writer.writerow([tx.get(column, '') for column in columns])
+        exported = len(first_batch)
+        rest = batches
+        if encoding is not None and not use_gzip and buffer.tell() < COMPRESS_MIN_BYTES:
+            # маленькую выгрузку целиком в одну пачку сжимать невыгодно
+            second_batch = next(batches, None)
+            if second_batch is None:
+                encoding = None
+            else:
+                rest = itertools.chain([second_batch], batches)
+
+        filename = f'transactions_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        headers = {'Content-Disposition': f'attachment; filename="{filename}.gz"' if use_gzip
+                   else f'attachment; filename="{filename}"',
+                   'X-High-Water-Mark': str(high_water_mark)}
+        if not use_gzip:
+            headers['Vary'] = 'Accept-Encoding'
+            if encoding is not None:
+                headers['Content-Encoding'] = encoding
+        self._begin_stream(200, 'application/gzip' if use_gzip else 'text/csv; charset=utf-8', headers)
+        codec = compressor(encoding) if encoding is not None else None
+        raw_size = wire_size = 0
+        codec_seconds = 0.0
+
+        def flush(final: bool = False):
+            nonlocal raw_size, wire_size, codec_seconds
+            data = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            if codec is not None:
+                started = time.thread_time()
+                raw_size += len(data)
+                data = codec.compress(data) + (codec.flush() if final else b'')
+                wire_size += len(data)
+                codec_seconds += time.thread_time() - started
+            self._write_chunk(data)
+
+        try:
+            flush()
+            for batch in rest:
+                for tx in batch:
+                    writer.writerow([tx.get(column, '') for column in columns])
+                exported += len(batch)
+                flush()
+            flush(final=True)
+            self._end_stream()
+            if codec is not None:
+                api_metrics.observe_compression('response', encoding, raw_size, wire_size, codec_seconds)
+            logger.info(f"CSV export completed: {exported} transactions"
+                        + (f" changed in ({since}, {high_water_mark}]" if since is not None else ""),
                         extra={'component': 'export', 'correlation_id': correlation_id})
-            self._send_json_response(500, {"error": "Export failed"}, correlation_id)
+        except Exception as e:
+            # заголовки уже отправлены — остаётся только оборвать соединение
+            self.close_connection = True
+            logger.error(f"CSV export failed after {exported} transactions: {str(e)}",
+                         extra={'component': 'export', 'correlation_id': correlation_id})
+
+    def _get_traces(self, query_string: str, correlation_id: str):
+        """Трассы из кольцевого буфера: по correlation_id запроса или транзакции, по этапу."""
+        query_params = parse_qs(query_string)
+        try:
+            limit = min(1000, max(1, int(query_params.get('limit', [20])[0])))
+        except ValueError:
+            self._send_json_response(400, {"error": "limit must be an integer"}, correlation_id)
+            return
+        result = tracer.query(correlation_id=query_params.get('correlation_id', [None])[0],
+                              stage=query_params.get('stage', [None])[0], limit=limit)
+        result["tracer"] = tracer.snapshot()
+        self._send_json_response(200, result, correlation_id, compressible=True)
 
     def _get_transactions_list(self, query_string: str, correlation_id: str):
+        """Список транзакций: страницы по номеру (page=) или по курсору (cursor=).
+
+        Курсорный режим включается параметром cursor (пустой — первая страница)
+        и не считает total; next_cursor отдаётся в обоих режимах, так что
+        глубокую выборку можно начать с page=1 и продолжить курсором.
+
+        since=<change_seq> (важнее cursor и page) — записи, изменённые после
+        отметки, по возрастанию change_seq; high_water_mark ответа — since
+        следующего запроса, пока has_more.
+        """
         try:
-            query_params = parse_qs(query_string)
-            page = int(query_params.get('page', [1])[0])
-            limit = int(query_params.get('limit', [50])[0])
-            status_filter = query_params.get('status', [None])[0]
-            start_idx = (page - 1) * limit
-            end_idx = start_idx + limit
-            filtered_txs = list(transactions.values())
-            if status_filter:
-                filtered_txs = [tx for tx in filtered_txs if tx.get('status') == status_filter]
-            filtered_txs.sort(key=lambda x: x.get('received_at', ''), reverse=True)
-            paginated_txs = filtered_txs[start_idx:end_idx]
-            result_txs = []
-            for tx in paginated_txs:
-                result_txs.append({
-                    'transaction_id': tx.get('transaction_id'),
-                    'correlation_id': tx.get('correlation_id'),
-                    'timestamp': tx.get('timestamp'),
-                    'sender_account': tx.get('sender_account'),
-                    'receiver_account': tx.get('receiver_account'),
-                    'amount': tx.get('amount'),
-                    'transaction_type': tx.get('transaction_type'),
-                    'merchant_category': tx.get('merchant_category'),
-                    'location': tx.get('location'),
-                    'device_used': tx.get('device_used'),
-                    'is_fraud': tx.get('is_fraud'),
-                    'status': tx.get('status'),
-                    'received_at': tx.get('received_at')
-                })
+            query_params = parse_qs(query_string, keep_blank_values=True)
+            page = max(1, int(query_params.get('page', [1])[0] or 1))
+            limit = max(1, int(query_params.get('limit', [50])[0] or 50))
+            fields = LIST_FIELDS
+            if query_params.get('fields', [''])[0]:
+                fields = tuple(f for f in query_params['fields'][0].split(',') if f)
+                unknown = [f for f in fields if f not in LIST_AVAILABLE_FIELDS]
+                if unknown or not fields:
+                    self._send_json_response(400, {
+                        "error": f"Unknown fields: {', '.join(unknown) or '(empty)'}",
+                        "available": LIST_AVAILABLE_FIELDS
+                    }, correlation_id)
+                    return
+            order = query_params.get('order', ['desc'])[0] or 'desc'
+            if order not in ('asc', 'desc'):
+                self._send_json_response(400, {"error": "order must be asc or desc"}, correlation_id)
+                return
+            try:
+                received_from = _parse_time_param(query_params.get('from', [None])[0])
+                received_to = _parse_time_param(query_params.get('to', [None])[0])
+            except ValueError as e:
+                self._send_json_response(400, {"error": f"Invalid time range: {str(e)}"}, correlation_id)
+                return
+            filters = {
+                'status': query_params.get('status', [None])[0] or None,
+                'sender': query_params.get('sender', [None])[0] or None,
+                'receiver': query_params.get('receiver', [None])[0] or None,
+                'received_from': received_from,
+                'received_to': received_to,
+            }
+
+            if query_params.get('since', [''])[0]:
+                try:
+                    since = _parse_since(query_params['since'][0])
+                except ValueError:
+                    self._send_json_response(400, {"error": "since must be a non-negative integer"}, correlation_id)
+                    return
+                # отметка до выборки: изменённое во время неё получит номер больше
+                high_water_mark = transaction_store.change_seq
+                stale = _stale_since(since, high_water_mark)
+                if stale is not None:
+                    self._send_json_response(410, stale, correlation_id)
+                    return
+                if CHANGE_SEQ_FIELD not in fields:
+                    fields += (CHANGE_SEQ_FIELD,)
+                result_txs, resume = transaction_store.changes(fields, since, high_water_mark, limit=limit, **filters)
+                self._send_json_response(200, {
+                    "transactions": result_txs,
+                    "changes": {
+                        "since": since,
+                        "limit": limit,
+                        "high_water_mark": high_water_mark if resume is None else resume,
+                        "has_more": resume is not None
+                    }
+                }, correlation_id, compressible=True)
+                return
+
+            if 'cursor' in query_params:
+                token = query_params['cursor'][0]
+                try:
+                    after = _decode_cursor(token) if token else None
+                except ValueError:
+                    self._send_json_response(400, {"error": "Invalid cursor"}, correlation_id)
+                    return
+                result_txs, next_cursor = transaction_store.page(
+                    fields, after=after, limit=limit, descending=order == 'desc', **filters
+                )
+                self._send_json_response(200, {
+                    "transactions": result_txs,
+                    "pagination": {
+                        "limit": limit,
+                        "order": order,
+                        "next_cursor": _encode_cursor(next_cursor)
+                    }
+                }, correlation_id, compressible=True)
+                return
+
+            if order != 'desc':
+                self._send_json_response(400, {"error": "order=asc requires cursor pagination"}, correlation_id)
+                return
+            paginated_txs, total = transaction_store.query(offset=(page - 1) * limit, limit=limit, **filters)
+            result_txs = [{name: tx.get(name) for name in fields} for tx in paginated_txs]
+            next_cursor = None
+            if paginated_txs and page * limit < total:
+                next_cursor = transaction_store.cursor_of(paginated_txs[-1]['transaction_id'])
             self._send_json_response(200, {
                 "transactions": result_txs,
                 "pagination": {
                     "page": page,
                     "limit": limit,
-                    "total": len(filtered_txs),
-                    "pages": (len(filtered_txs) + limit - 1) // limit
+                    "total": total,
+                    "pages": (total + limit - 1) // limit,
+                    "next_cursor": _encode_cursor(next_cursor)
                 }
-            }, correlation_id)
+            }, correlation_id, compressible=True)
         except Exception as e:
             logger.error(f"Failed to get transactions list: {str(e)}",
                          extra={'component': 'api', 'correlation_id': correlation_id})
             self._send_json_response(500, {"error": "Failed to retrieve transactions"}, correlation_id)
 
     def _get_transaction_details(self, tx_id: str, correlation_id: str):
-        if tx_id not in transactions:
+        tx_data = transaction_store.get(tx_id)
+        if tx_data is None:
             self._send_json_response(404, {"error": "Transaction not found"}, correlation_id)
             return
-        tx_data = transactions[tx_id]
         self._send_json_response(200, {"transaction": tx_data}, correlation_id)
 
     def _send_notification(self, data: dict, correlation_id: str):
@@ -518,21 +1441,38 @@ class FraudDetectionAPIHandler(BaseHTTPRequestHandler):
                 if field not in data:
                     self._send_json_response(400, {"error": f"Missing field: {field}"})
                     return
-            bool = threshold_rule(data['amount'], data['operation'], data['number'])
+            with api_metrics.time_rule('threshold'):
+                bool = threshold_rule(data['amount'], data['operation'], data['number'])
             self._send_json_response(200, {"message": "Threshold checking", "result": bool})
         except Exception as e:
             self._send_json_response(400, {"error": str(e)})
 
     #ФОРМАТ ПРАВИЛА: кому,сколько, операция, сумма операции , временное окно, тип времени(минута, часы, дни), кол-во операций, данные
+    #без data вместо неё sender: история берётся из pattern_state, scope — pair (по умолчанию), sender или receiver
     def _check_pattern_rule(self, data: Dict, correlation_id: str):
         try:
-            required_fields = ['id', 'receiver', 'amount', "pattern_operation","pattern_amount","time_window","time_type","operation_quantity","data"]
+            required_fields = ['id', 'receiver', 'amount', "pattern_operation","pattern_amount","time_window","time_type","operation_quantity"]
+            required_fields.append("data" if "data" in data or pattern_state is None else "sender")
             for field in required_fields:
                 if field not in data:
                     self._send_json_response(400, {"error": f"Missing field: {field}"})
                     return
-            bool = pattern_rule(data['receiver'], data['amount'], data["pattern_operation"],data["pattern_amount"],data["time_window"],data["time_type"],data["operation_quantity"],data["data"])
-            self._send_json_response(200, {"message": "Threshold checking", "result": bool})
+            if "data" in data:
+                with api_metrics.time_rule('pattern'):
+                    bool = pattern_rule(data['receiver'], data['amount'], data["pattern_operation"],data["pattern_amount"],data["time_window"],data["time_type"],data["operation_quantity"],data["data"])
+                self._send_json_response(200, {"message": "Threshold checking", "result": bool})
+                return
+            scope = data.get("scope", "pair")
+            keys = dict(zip(('pair', 'sender', 'receiver'), PatternState.keys(data['sender'], data['receiver'])))
+            if scope not in keys:
+                self._send_json_response(400, {"error": "scope must be pair, sender or receiver"})
+                return
+            with api_metrics.time_rule('pattern'):
+                matched = pattern_state.count(keys[scope], data["pattern_operation"], float(data["pattern_amount"]),
+                                              window_seconds(data["time_window"], data["time_type"]))
+            self._send_json_response(200, {"message": "Threshold checking",
+                                           "result": matched >= float(data["operation_quantity"]),
+                                           "matched": matched})
         except Exception as e:
             self._send_json_response(400, {"error": str(e)})
 
@@ -544,31 +1484,202 @@ class FraudDetectionAPIHandler(BaseHTTPRequestHandler):
                 if field not in data:
                     self._send_json_response(400, {"error": f"Missing field: {field}"})
                     return
-            bool = composite_rule(data["boolev"],data["amount"],data["operation_time"])
+            with api_metrics.time_rule('composite'):
+                bool = composite_rule(data["boolev"],data["amount"],data["operation_time"])
             self._send_json_response(200, {"message": "Threshold checking", "result": bool})
         except Exception as e:
             self._send_json_response(400, {"error": str(e)})
 
+    def _evaluate_rules_batch(self, data: Dict, correlation_id: str):
+        """Матрица результатов: строка на транзакцию, столбец на правило.
+
+        rules — правила в формате модели Rules (без них — активные правила
+        воркеров), history — недавние транзакции для pattern-правил (без неё
+        история берётся из хранилища, как у воркеров). Каждое правило
+        считается одним проходом по всей пачке (BatchScorer.rule_columns).
+        """
+        if not isinstance(data, dict) or not isinstance(data.get('transactions'), list):
+            self._send_json_response(400, {"error": "Body must be an object with a transactions list"}, correlation_id)
+            return
+        transactions = data['transactions']
+        if len(transactions) > RULES_BATCH_MAX:
+            self._send_json_response(400, {"error": f"Too many transactions: {len(transactions)} > {RULES_BATCH_MAX}"},
+                                     correlation_id)
+            return
+        history = data.get('history')
+        if history is not None and not (isinstance(history, list) and all(isinstance(h, dict) for h in history)):
+            self._send_json_response(400, {"error": "history must be a list of objects"}, correlation_id)
+            return
+        try:
+            rules = validate_rules(data['rules']) if 'rules' in data else scorer.rules
+        except ValueError as e:
+            self._send_json_response(400, {"error": f"Invalid rules: {str(e)}"}, correlation_id)
+            return
+        needed = required_fields(rules)
+        errors = []
+        for index, tx in enumerate(transactions):
+            missing = [field for field in needed if not isinstance(tx, dict) or field not in tx]
+            if missing:
+                errors.append({"index": index, "error": f"Missing fields: {', '.join(missing)}"})
+            elif not is_number(tx['amount']):
+                errors.append({"index": index, "error": "amount must be a number"})
+        if errors:
+            self._send_json_response(400, {"error": "Invalid transactions", "details": errors[:NDJSON_MAX_ERRORS]},
+                                     correlation_id)
+            return
+
+        batch_scorer = BatchScorer(rules, _pattern_history)
+        with api_metrics.time_rule('batch'):
+            pattern_inputs = pattern_inputs_from(rules, history) if history is not None else None
+            columns = batch_scorer.rule_columns(transactions, pattern_inputs)
+        self._send_json_response(200, {
+            "rules": [rule['name'] for rule in rules],
+            "transaction_ids": [tx.get('transaction_id') for tx in transactions],
+            "results": [list(row) for row in zip(*columns)] if columns else [[] for _ in transactions]
+        }, correlation_id)
+
+
+# выставляется первым сигналом остановки; drain_report — ход и итог остановки для /drain/stats
+draining = threading.Event()
+drain_forced = threading.Event()
+drain_report: Dict = {"state": "running"}
+# останавливает цикл сервера; задаётся при запуске в __main__
+stop_server = None
+
+def _drain_snapshot() -> Dict:
+    report = dict(drain_report)
+    if report["state"] == "draining":
+        report["elapsed_seconds"] = round(time.monotonic() - report.pop("_started"), 3)
+        report["queue_depth"] = processing_queue.qsize()
+        report["drained"] = processor.stats.completed() - report.pop("_completed")
+    return {k: v for k, v in report.items() if not k.startswith('_')}
+
+def _persist_pending(pending: List[Dict]) -> Optional[str]:
+    """Куда сохранены недоработанные транзакции: журнал их и так содержит, без него — файл NDJSON.
+
+    Журнал здесь не закрывается: обработчики ещё могут быть внутри append/sync,
+    его закрывает finish_shutdown() после остановки сервера.
+    """
+    if journal is not None:
+        if not journal.sync():
+            logger.error("Journal is not synced at drain, pending transactions may be lost",
+                         extra={'component': 'shutdown', 'correlation_id': 'system'})
+        return f"journal:{JOURNAL_DIR}"
+    if not pending or not DRAIN_SPILL_PATH:
+        return None
+    tmp_path = DRAIN_SPILL_PATH + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for item in pending:
+            f.write(json_codec.dumps(item) + b'\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, DRAIN_SPILL_PATH)
+    return f"file:{DRAIN_SPILL_PATH}"
+
+def drain_and_stop():
+    """Остановка без потери очереди.
+
+    Новые POST уже получают 503 (draining выставлен). Воркеры дорабатывают
+    processing_queue до DRAIN_DEADLINE_SECONDS (или до повторного сигнала),
+    затем останавливаются после текущих пачек. Всё, что осталось не
+    оценённым, сохраняется (журнал или DRAIN_SPILL_PATH) и при следующем
+    запуске снова встаёт в очередь; итог — drained/abandoned в логе.
+    """
+    try:
+        _drain()
+    except Exception as e:
+        logger.error(f"Drain failed: {str(e)}", extra={'component': 'shutdown', 'correlation_id': 'system'})
+    finally:
+        # трассировка, журнал и логи закрываются в finish_shutdown(), когда обработчиков уже нет
+        if stop_server is not None:
+            stop_server()
+
+def _drain():
+    started = time.monotonic()
+    completed = processor.stats.completed()
+    drain_report.update({"state": "draining", "queue_depth_at_start": processing_queue.qsize(),
+                         "deadline_seconds": DRAIN_DEADLINE_SECONDS, "_started": started, "_completed": completed})
+    logger.info(f"Draining {processing_queue.qsize()} queued transactions, deadline {DRAIN_DEADLINE_SECONDS:g}s",
+                extra={'component': 'shutdown', 'correlation_id': 'system'})
+    deadline = started + DRAIN_DEADLINE_SECONDS
+    with processing_queue.all_tasks_done:
+        while processing_queue.unfinished_tasks and not drain_forced.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # повторный сигнал не будит условие — ждём короткими отрезками
+            processing_queue.all_tasks_done.wait(min(remaining, 0.5))
+
+    processor.running = False
+    supervisor.stop()
+    still_running = supervisor.join(DRAIN_WORKER_JOIN_SECONDS)
+    if processor.executor is not None:
+        processor.executor.shutdown(wait=False, cancel_futures=True)
+    pending = transaction_store.pending()
+    try:
+        persisted = _persist_pending(pending)
+    except OSError as e:
+        persisted = None
+        logger.error(f"Failed to persist {len(pending)} pending transactions: {str(e)}",
+                     extra={'component': 'shutdown', 'correlation_id': 'system'})
+    if duplicate_filter is not None and DEDUP_STATE_PATH:
+        duplicate_filter.stop()
+        duplicate_filter.save(DEDUP_STATE_PATH)
+    drain_report.update({
+        "state": "stopped",
+        "seconds": round(time.monotonic() - started, 3),
+        "drained": processor.stats.completed() - completed,
+        "abandoned": len(pending),
+        "workers_still_running": still_running,
+        "persisted_to": persisted,
+    })
+    logger.info(f"Drain finished in {drain_report['seconds']}s: {drain_report['drained']} drained, "
+                f"{len(pending)} abandoned" + (f" (persisted to {persisted})" if pending and persisted else ""),
+                extra={'component': 'shutdown', 'correlation_id': 'system'})
+
+def finish_shutdown():
+    """Последний шаг остановки: сервер и воркеры уже не пишут в журнал.
+
+    Конвейер логов останавливается последним — ошибки закрытия журнала
+    (кадры, добавленные после остановки) ещё попадают в лог.
+    """
+    tracer.stop()
+    if journal is not None:
+        journal.close()
+    log_pipeline.stop()
 
 def shutdown(signum, frame):
+    """SIGTERM/SIGINT: остановка с дренажом в отдельном потоке; повторный сигнал — не ждать очередь."""
+    if draining.is_set():
+        drain_forced.set()
+        return
+    draining.set()
     logger.info("Shutting down...", extra={'component': 'shutdown', 'correlation_id': 'system'})
-    processor.running = False
-    time.sleep(2)
-    sys.exit(0)
+    threading.Thread(target=drain_and_stop, name="Drain").start()
 
 if __name__ == '__main__':
     signal.signal(signal.SIGINT, shutdown)
     signal.signal(signal.SIGTERM, shutdown)
-    server = HTTPServer(('0.0.0.0', 3000), FraudDetectionAPIHandler)
     listener_thread = threading.Thread(target=redis.listener, daemon=True, name="RedisListener")
     listener_thread.start()
-    print("Fraud Detection API Server running on http://0.0.0.0:3000")
-    print(f"Worker threads: {WORKER_COUNT}, Max queue size: {MAX_QUEUE_SIZE}")
+    print(f"Fraud Detection API Server running on http://{API_HOST}:{API_PORT} (mode: {SERVER_MODE})")
+    print(f"Worker threads: {WORKER_MIN}-{WORKER_MAX} ({WORKER_BACKEND} backend), Max queue size: {MAX_QUEUE_SIZE}")
     print("Supported transaction fields:")
     print("Required: transaction_id, timestamp, sender_account, receiver_account, amount, transaction_type")
     print("Optional: merchant_category, location, device_used, is_fraud, fraud_type, time_since_last_transaction, spending_deviation_score, velocity_score, geo_anomaly_score, payment_channel, ip_address, device_hash")
     logger.info("Server started successfully", extra={'component': 'server', 'correlation_id': 'system'})
-    try:
+    if SERVER_MODE == 'asyncio':
+        from asgi_server import create_asgi_app, create_server
+        app = create_asgi_app(FraudDetectionAPIHandler, max_threads=ASYNC_HANDLER_THREADS)
+        # uvicorn перехватывает SIGINT/SIGTERM на время работы и передаёт их в shutdown()
+        server = create_server(app, API_HOST, API_PORT, shutdown)
+        stop_server = lambda: setattr(server, 'should_exit', True)
+        server.run()
+    else:
+        server = ThreadingHTTPServer((API_HOST, API_PORT), FraudDetectionAPIHandler)
+        # shutdown() ждёт выхода из serve_forever, поэтому вызывается из потока дренажа
+        stop_server = server.shutdown
         server.serve_forever()
-    except KeyboardInterrupt:
-        shutdown(None, None)
+        server.server_close()
+    finish_shutdown()
+    sys.exit(0)
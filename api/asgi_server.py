@@ -0,0 +1,213 @@
+"""ASGI-режим сервера API (API_SERVER_MODE=asyncio).
+
+Соединения, разбор HTTP и keep-alive обслуживает event loop uvicorn, а сами
+маршруты исполняются тем же FraudDetectionAPIHandler, что и в режиме
+http.server: для каждого запроса создаётся «обменник» — наследник обработчика
+без сокета, у которого rfile/wfile подменены на каналы ASGI. Тело запроса
+подаётся в rfile по мере прихода от клиента, ответ уходит клиенту по мере
+записи в wfile, так что потоковые маршруты не буферизуют данные. Блокирующий код
+маршрутов (валидация, put в processing_queue, экспорт) уходит в пул потоков,
+поэтому медленный /pattern или экспорт не задерживает остальные запросы.
+
+create_server() отдаёт SIGINT/SIGTERM обработчику сервиса, а не останавливает
+uvicorn сразу: во время остановки API продолжает отвечать (503 на новую
+работу), и uvicorn закрывается, когда сервис выставит server.should_exit.
+"""
+import asyncio
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from typing import Callable
+
+from body_streams import BodyStream
+
+RESPONSE_QUEUE_SIZE = 16
+REQUEST_QUEUE_SIZE = 16
+
+
+class _RequestBody(BodyStream):
+    """rfile для обменника: куски тела из receive() через ограниченную очередь."""
+
+    def __init__(self):
+        super().__init__()
+        self.queue: queue.Queue = queue.Queue(maxsize=REQUEST_QUEUE_SIZE)
+        self.closed = False
+
+    def _next_piece(self) -> bytes:
+        piece = self.queue.get()
+        if piece is None:
+            raise ConnectionResetError("client disconnected")
+        return piece
+
+    def feed(self, piece) -> bool:
+        """Блокирующая подача куска; False, если обработчик уже не читает тело."""
+        while not self.closed:
+            try:
+                self.queue.put(piece, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+class _ResponseChannel:
+    """wfile для обменника: пишет куски ответа в asyncio.Queue event loop'а."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=RESPONSE_QUEUE_SIZE)
+        self.aborted = False
+
+    def _put(self, item):
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+
+    def start(self, status: int, headers: list):
+        if self.aborted:
+            raise BrokenPipeError("client disconnected")
+        self._put(('start', status, headers))
+
+    def write(self, data: bytes):
+        if self.aborted:
+            raise BrokenPipeError("client disconnected")
+        if data:
+            self._put(('body', bytes(data), None))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._put(('end', None, None))
+
+
+def create_asgi_app(handler_cls, max_threads: int = 32):
+    """Собирает ASGI-приложение поверх класса обработчика BaseHTTPRequestHandler."""
+    executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="AsgiHandler")
+
+    class AsgiExchange(handler_cls):
+        def __init__(self, scope: dict, body: _RequestBody, channel: _ResponseChannel):
+            # BaseRequestHandler.__init__ сразу читает сокет, поэтому не вызываем его
+            self.command = scope['method']
+            query = scope.get('query_string', b'').decode('latin-1')
+            self.path = scope['path'] + (f'?{query}' if query else '')
+            self.request_version = f"HTTP/{scope.get('http_version', '1.1')}"
+            self.client_address = scope.get('client') or ('', 0)
+            self.headers = Message()
+            for name, value in scope.get('headers', []):
+                self.headers[name.decode('latin-1')] = value.decode('latin-1')
+            self.rfile = body
+            self.wfile = channel
+            self.close_connection = False
+            self._channel = channel
+            self._status = 200
+            self._response_headers = []
+
+        def send_response(self, code, message=None):
+            self._status = code
+            self._response_headers = []
+
+        def send_header(self, keyword, value):
+            # chunked-кодирование и соединение — забота uvicorn
+            if keyword.lower() in ('transfer-encoding', 'connection'):
+                return
+            self._response_headers.append((keyword.lower().encode('latin-1'), str(value).encode('latin-1')))
+
+        def end_headers(self):
+            self._channel.start(self._status, self._response_headers)
+
+        def _body_stream(self):
+            # uvicorn уже снял chunked-кодирование и следит за Content-Length
+            return self.rfile
+
+        def _write_chunk(self, data: bytes):
+            if data:
+                self.wfile.write(data)
+
+        def _end_stream(self):
+            pass
+
+        def log_message(self, format, *args):
+            pass
+
+    def run_exchange(scope: dict, body: _RequestBody, channel: _ResponseChannel):
+        try:
+            exchange = AsgiExchange(scope, body, channel)
+            method = getattr(exchange, f"do_{scope['method']}", None)
+            if method is None:
+                exchange.send_error(501, f"Unsupported method ({scope['method']!r})")
+            else:
+                method()
+        finally:
+            body.closed = True
+            channel.close()
+
+    async def pump_body(receive, body: _RequestBody):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                pieces, final = [None], True
+            else:
+                pieces = [message['body']] if message.get('body') else []
+                final = not message.get('more_body', False)
+                if final:
+                    pieces.append(b'')
+            for piece in pieces:
+                try:
+                    body.queue.put_nowait(piece)
+                except queue.Full:
+                    if not await asyncio.to_thread(body.feed, piece):
+                        return
+            if final:
+                return
+
+    async def app(scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        loop = asyncio.get_running_loop()
+        body = _RequestBody()
+        channel = _ResponseChannel(loop)
+        pump = asyncio.create_task(pump_body(receive, body))
+        future = loop.run_in_executor(executor, run_exchange, scope, body, channel)
+        started = finished = False
+        try:
+            while True:
+                kind, payload, headers = await channel.queue.get()
+                if kind == 'start':
+                    await send({'type': 'http.response.start', 'status': payload, 'headers': headers})
+                    started = True
+                elif kind == 'body':
+                    await send({'type': 'http.response.body', 'body': payload, 'more_body': True})
+                else:
+                    finished = True
+                    break
+        finally:
+            if not finished:
+                # клиент ушёл: останавливаем запись и дожидаемся конца обработчика
+                channel.aborted = True
+                while (await channel.queue.get())[0] != 'end':
+                    pass
+        pump.cancel()
+        try:
+            await future
+        except Exception:
+            if started:
+                raise
+        if not started:
+            await send({'type': 'http.response.start', 'status': 500,
+                        'headers': [(b'content-type', b'application/json; charset=utf-8')]})
+            await send({'type': 'http.response.body', 'body': b'{"error": "Internal server error"}'})
+            return
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    return app
+
+
+def create_server(app, host: str, port: int, on_signal: Callable[[int, object], None]):
+    """uvicorn.Server, который передаёт сигналы остановки в on_signal(signum, frame)."""
+    import uvicorn
+
+    class _Server(uvicorn.Server):
+        def handle_exit(self, sig, frame):
+            on_signal(sig, frame)
+
+    return _Server(uvicorn.Config(app, host=host, port=port, lifespan='off', log_level='warning'))
@@ -0,0 +1,108 @@
+"""Байты на проводе и процессорное время сжатия тел API.
+
+Тела собираются так же, как их отдаёт или принимает API: массив для
+POST /transactions/import-json, NDJSON для /transactions/ingest-ndjson,
+CSV-выгрузка и страница GET /transactions. Каждое тело сжимается и
+распаковывается всеми доступными кодировками (zstd — если установлен
+zstandard) на нескольких уровнях; печатаются доля от исходного размера и
+миллисекунды процессора на мегабайт несжатых данных в каждую сторону.
+
+    python api/benchmarks/bench_compression.py --records 20000
+
+Для работающего сервиса те же величины копятся в /metrics:
+api_compressed_body_bytes_total и api_compression_cpu_seconds_total.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from compression import ZSTD_LEVEL, GZIP_LEVEL, zstandard  # noqa: E402
+
+CSV_COLUMNS = ['transaction_id', 'timestamp', 'sender_account', 'receiver_account', 'amount',
+               'transaction_type', 'merchant_category', 'location', 'device_used', 'is_fraud',
+               'payment_channel', 'ip_address', 'device_hash', 'correlation_id', 'status', 'received_at']
+
+
+def make_transaction(rng: random.Random, i: int) -> dict:
+    return {
+        "transaction_id": f"TXC{i:09d}", "correlation_id": f"CORC{i:09d}",
+        "timestamp": f"2025-01-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:00+00:00",
+        "sender_account": f"ACC{rng.randrange(50000):06d}", "receiver_account": f"ACC{rng.randrange(50000):06d}",
+        "amount": round(rng.uniform(1, 20000), 2),
+        "transaction_type": rng.choice(["transfer", "payment", "withdrawal", "deposit"]),
+        "merchant_category": rng.choice(["retail", "travel", "grocery", "online", "entertainment"]),
+        "location": rng.choice(["Moscow", "Kazan", "Sochi", "Novosibirsk", "Omsk"]),
+        "device_used": rng.choice(["mobile", "web", "atm", "pos"]), "is_fraud": False,
+        "payment_channel": rng.choice(["card", "ACH", "wire_transfer", "UPI"]),
+        "ip_address": f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}",
+        "device_hash": f"D{rng.getrandbits(32):08x}",
+        "status": "processed", "received_at": "2025-01-01T10:00:00.123456",
+    }
+
+
+def make_bodies(records: int) -> dict:
+    rng = random.Random(42)
+    txs = [make_transaction(rng, i) for i in range(records)]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for tx in txs:
+        writer.writerow([tx.get(c, '') for c in CSV_COLUMNS])
+    return {
+        "import-json": json.dumps(txs).encode('utf-8'),
+        "ndjson": b''.join(json.dumps(tx).encode('utf-8') + b'\n' for tx in txs),
+        "export-csv": buffer.getvalue().encode('utf-8'),
+        "list page (500)": json.dumps({"transactions": txs[:500], "pagination": {}}).encode('utf-8'),
+    }
+
+
+def codecs() -> list:
+    result = []
+    for level in sorted({1, GZIP_LEVEL, 9}):
+        result.append((f"gzip-{level}",
+                       lambda data, level=level: (lambda c: c.compress(data) + c.flush())(
+                           zlib.compressobj(level, zlib.DEFLATED, 31)),
+                       lambda data: zlib.decompress(data, 47)))
+    if zstandard is not None:
+        for level in sorted({1, ZSTD_LEVEL, 9}):
+            result.append((f"zstd-{level}", zstandard.ZstdCompressor(level=level).compress,
+                           lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)))
+    return result
+
+
+def cpu_time(fn, data, repeat: int):
+    started = time.process_time()
+    for _ in range(repeat):
+        out = fn(data)
+    return (time.process_time() - started) / repeat, out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure API body compression ratio and CPU cost")
+    ap.add_argument("--records", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+    if zstandard is None:
+        print("zstandard is not installed: measuring gzip only")
+
+    print(f"{'body':<17}{'codec':<9}{'raw MB':>8}{'wire MB':>9}{'ratio':>8}{'comp ms/MB':>12}{'decomp ms/MB':>14}")
+    for name, body in make_bodies(args.records).items():
+        mb = len(body) / 1e6
+        for codec, compress, decompress in codecs():
+            comp_seconds, packed = cpu_time(compress, body, args.repeat)
+            decomp_seconds, unpacked = cpu_time(decompress, packed, args.repeat)
+            assert unpacked == body
+            print(f"{name:<17}{codec:<9}{mb:>8.2f}{len(packed) / 1e6:>9.3f}{len(packed) / len(body):>8.3f}"
+                  f"{comp_seconds * 1000 / mb:>12.1f}{decomp_seconds * 1000 / mb:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Стоимость журнала хранилища: запись изменений и время восстановления.
+
+Хранилище заполняется N транзакциями (приём и три смены статуса, как у
+воркера), сначала без журнала, затем с журналом — разница и есть накладные
+расходы записи. Потом время восстановления в новом хранилище: только из
+журнала и из снимка после compact().
+
+    python api/benchmarks/bench_journal.py --records 1000000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from journal import Journal  # noqa: E402
+from transaction_store import TransactionStore  # noqa: E402
+
+RESULT = {
+    'rule_results': {'large_amount': False, 'repeated_transfers': False, 'night_large_amount': False},
+    'triggered_rules': [], 'fraud_score': None, 'risk_level': 'low', 'alert': False, 'severity': None,
+}
+
+
+def make_transaction(i: int) -> dict:
+    return {
+        "transaction_id": f"TXB{i:09d}", "correlation_id": f"CORB{i:09d}",
+        "timestamp": "2025-01-01T10:00:00+00:00", "sender_account": f"ACC{i % 5000:06d}",
+        "receiver_account": f"ACC{i % 3000 + 100000:06d}", "amount": 10.0 + i % 1000,
+        "transaction_type": "transfer", "merchant_category": "retail", "location": "Moscow",
+        "device_used": "mobile", "payment_channel": "card",
+    }
+
+
+def fill(store: TransactionStore, records: int) -> float:
+    started = time.perf_counter()
+    for i in range(records):
+        tx = make_transaction(i)
+        store.add(tx, 'queued')
+        store.transition(tx['transaction_id'], 'processing')
+        store.transition(tx['transaction_id'], 'processed', **RESULT)
+    return time.perf_counter() - started
+
+
+def recover(directory: str, records: int) -> dict:
+    store = TransactionStore(max_size=records + 1)
+    journal = Journal(directory, durable=False)
+    stats = journal.open(store)
+    journal.close()
+    assert len(store) == records, (len(store), records)
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark transaction store journaling and recovery")
+    ap.add_argument("--records", type=int, default=200000)
+    ap.add_argument("--dir", default=None, help="journal directory (a temporary one by default)")
+    args = ap.parse_args()
+    directory = args.dir or tempfile.mkdtemp(prefix="bench_journal_")
+    try:
+        plain = fill(TransactionStore(max_size=args.records + 1), args.records)
+
+        store = TransactionStore(max_size=args.records + 1)
+        journal = Journal(directory, durable=False, snapshot_bytes=1 << 62, snapshot_interval=float('inf'))
+        journal.open(store)
+        journaled = fill(store, args.records)
+        started = time.perf_counter()
+        journal.close()
+        drain = time.perf_counter() - started
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"fill without journal: {plain:.2f}s ({args.records / plain:,.0f} tx/s)")
+        print(f"fill with journal:    {journaled:.2f}s ({args.records / journaled:,.0f} tx/s), "
+              f"writer drained {drain:.2f}s later, journal {size / 1e6:.1f} MB")
+
+        stats = recover(directory, args.records)
+        print(f"recover from journal: {stats['seconds']:.2f}s ({stats['journal_entries']:,} entries)")
+
+        journal = Journal(directory, durable=False)
+        journal.open(TransactionStore(max_size=args.records + 1))
+        snapshot = journal.compact()
+        journal.close()
+        stats = recover(directory, args.records)
+        print(f"snapshot write:       {snapshot['seconds']:.2f}s ({snapshot['bytes'] / 1e6:.1f} MB)")
+        print(f"recover from snapshot: {stats['seconds']:.2f}s ({stats['snapshot_records']:,} records)")
+    finally:
+        if args.dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
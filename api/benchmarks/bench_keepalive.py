@@ -0,0 +1,114 @@
+"""Задержка запросов к API с keep-alive и без него.
+
+Поднимается процесс api/api.py (по умолчанию в обоих режимах сервера), затем
+N клиентов шлют по одному запросу на правило, как это делает админка:
+POST /threshold с телом размером с payload transaction_importer. В варианте
+«close» каждый запрос открывает новое TCP-соединение, в варианте «keep-alive»
+клиент переиспользует одно соединение. Печатаются RPS и p50/p99 задержки.
+
+    python api/benchmarks/bench_keepalive.py --clients 8 --requests 500
+
+api.py при импорте подключается к Redis (REDIS_URL), поэтому он должен быть
+доступен так же, как при обычном запуске сервиса.
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from bench_server_modes import API_SCRIPT, wait_ready
+
+PAYLOAD = json.dumps({"id": "TXKEEPALIVE01", "amount": 12500.0, "operation": ">", "number": 10000.0}).encode('utf-8')
+HEADERS = {'Content-Type': 'application/json'}
+
+
+def run_client(port: int, requests: int, keep_alive: bool, latencies: list, errors: list):
+    conn = None
+    for _ in range(requests):
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            conn.request('POST', '/threshold', body=PAYLOAD, headers=HEADERS)
+            response = conn.getresponse()
+            response.read()
+            if not keep_alive or response.will_close:
+                conn.close()
+                conn = None
+        except OSError as e:
+            errors.append(type(e).__name__)
+            if conn is not None:
+                conn.close()
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - started)
+    if conn is not None:
+        conn.close()
+
+
+def run_load(port: int, clients: int, requests: int, keep_alive: bool) -> dict:
+    per_client = [([], []) for _ in range(clients)]
+    threads = [threading.Thread(target=run_client, args=(port, requests, keep_alive, lat, err))
+               for lat, err in per_client]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    latencies = sorted(x for lat, _ in per_client for x in lat)
+    errors = sum(len(err) for _, err in per_client)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": pick(0.50),
+        "p99_ms": pick(0.99),
+    }
+
+
+def bench_mode(mode: str, port: int, args) -> dict:
+    env = {**os.environ, "API_SERVER_MODE": mode, "API_PORT": str(port)}
+    server = subprocess.Popen([sys.executable, API_SCRIPT], env=env, cwd=args.workdir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        # прогрев: первые запросы платят за импорт и запуск потоков
+        run_load(port, args.clients, 20, keep_alive=True)
+        return {
+            "close": run_load(port, args.clients, args.requests, keep_alive=False),
+            "keep-alive": run_load(port, args.clients, args.requests, keep_alive=True),
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark API request latency with and without HTTP keep-alive")
+    ap.add_argument("--modes", nargs="+", default=["http", "asyncio"])
+    ap.add_argument("--port", type=int, default=3150)
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=500, help="requests per client")
+    ap.add_argument("--workdir", default=os.getcwd(), help="cwd for the server (transaction_service.log lands here)")
+    args = ap.parse_args()
+
+    results = {}
+    for offset, mode in enumerate(args.modes):
+        results[mode] = bench_mode(mode, args.port + offset, args)
+
+    print(f"{'mode':<10}{'connection':<12}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for mode, by_connection in results.items():
+        for connection, r in by_connection.items():
+            print(f"{mode:<10}{connection:<12}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10.1f}"
+                  f"{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
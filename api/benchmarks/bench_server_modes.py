@@ -0,0 +1,172 @@
+"""Сравнение режимов сервера API: http.server против asyncio (uvicorn).
+
+Для каждого режима поднимается отдельный процесс api/api.py, затем N клиентов
+непрерывно шлют POST /transactions, а «медленные» клиенты параллельно гоняют
+/pattern с большим списком data. Печатаются устойчивый RPS и p50/p99 задержки
+приёма транзакций.
+
+    python api/benchmarks/bench_server_modes.py --clients 32 --duration 10
+
+api.py при импорте подключается к Redis (REDIS_URL), поэтому он должен быть
+доступен так же, как при обычном запуске сервиса.
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+API_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'api.py'))
+
+
+def make_transaction() -> dict:
+    suffix = uuid.uuid4().hex[:16]
+    return {
+        "transaction_id": f"TXB{suffix}",
+        "correlation_id": f"CORB{suffix}",
+        "timestamp": (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat(),
+        "sender_account": "ACC123456",
+        "receiver_account": "ACC987654",
+        "amount": 250.5,
+        "transaction_type": "transfer",
+    }
+
+
+def make_pattern_payload(size: int) -> dict:
+    now = datetime.now()
+    return {
+        "id": "TXPATTERN",
+        "receiver": "ACC987654",
+        "amount": 100,
+        "pattern_operation": ">",
+        "pattern_amount": 50,
+        "time_window": 60,
+        "time_type": "minutes",
+        "operation_quantity": 3,
+        "data": [
+            {"timestamp": (now - timedelta(seconds=i)).isoformat(),
+             "amount": 100 + i, "receiver_account": "ACC987654"}
+            for i in range(size)
+        ],
+    }
+
+
+def post(port: int, path: str, payload: dict, timeout: float = 30.0) -> int:
+    body = json.dumps(payload).encode('utf-8')
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def wait_ready(port: int, timeout: float = 15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/transactions/count')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def run_load(port: int, clients: int, slow_clients: int, pattern_size: int, duration: float) -> dict:
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def fast_client():
+        local_latencies, local_statuses = [], {}
+        while time.time() < stop_at:
+            started = time.perf_counter()
+            try:
+                status = post(port, '/transactions', make_transaction())
+            except OSError:
+                status = 'error'
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    def slow_client():
+        payload = make_pattern_payload(pattern_size)
+        while time.time() < stop_at:
+            try:
+                post(port, '/pattern', payload)
+            except OSError:
+                pass
+
+    threads = [threading.Thread(target=fast_client) for _ in range(clients)]
+    threads += [threading.Thread(target=slow_client) for _ in range(slow_clients)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": pick(0.50),
+        "p99_ms": pick(0.99),
+        "statuses": statuses,
+    }
+
+
+def bench_mode(mode: str, port: int, args) -> dict:
+    env = {
+        **os.environ,
+        "API_SERVER_MODE": mode,
+        "API_PORT": str(port),
+        "API_MAX_QUEUE_SIZE": str(args.queue_size),
+    }
+    server = subprocess.Popen([sys.executable, API_SCRIPT], env=env, cwd=args.workdir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        return run_load(port, args.clients, args.slow_clients, args.pattern_size, args.duration)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark http.server vs asyncio server modes of the transaction API")
+    ap.add_argument("--modes", nargs="+", default=["http", "asyncio"])
+    ap.add_argument("--port", type=int, default=3100)
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--slow-clients", type=int, default=1)
+    ap.add_argument("--pattern-size", type=int, default=20000, help="records in /pattern data payload")
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--queue-size", type=int, default=1_000_000)
+    ap.add_argument("--workdir", default=os.getcwd(), help="cwd for the server (transaction_service.log lands here)")
+    args = ap.parse_args()
+
+    results = {}
+    for offset, mode in enumerate(args.modes):
+        results[mode] = bench_mode(mode, args.port + offset, args)
+
+    print(f"{'mode':<10}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}  statuses")
+    for mode, r in results.items():
+        print(f"{mode:<10}{r['requests']:>10}{r['rps']:>10.1f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}  {r['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
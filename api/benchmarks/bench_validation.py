@@ -0,0 +1,181 @@
+"""Микробенчмарк валидации транзакций: прежняя цепочка if против TransactionValidator.
+
+Записи генерируются по образцу trans.json (те же поля, часть — с ошибками),
+оригинальные записи trans.json тоже входят в выборку. Перед замером
+проверяется, что тексты ошибок совпадают запись в запись.
+
+    python api/benchmarks/bench_validation.py --records 50000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from validation import (  # noqa: E402
+    DEVICE_HASH_PATTERN, ID_PATTERN, IP_PATTERN, VALID_DEVICES, VALID_FRAUD_TYPES,
+    VALID_MERCHANT_CATEGORIES, VALID_PAYMENT_CHANNELS, VALID_TRANSACTION_TYPES,
+    TransactionValidator,
+)
+
+TRANS_JSON = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'trans.json'))
+
+
+def legacy_validate(data: Dict, existing) -> List[str]:
+    """validate_transaction до перехода на схему — эталон для сравнения."""
+    errors = []
+    required_fields = [
+        'transaction_id', 'correlation_id', 'timestamp',
+        'sender_account', 'receiver_account', 'amount',
+        'transaction_type'
+    ]
+    for field in required_fields:
+        if field not in data:
+            errors.append(f"Missing required field: {field}")
+    if errors:
+        return errors
+    tx_id = data['transaction_id']
+    if not ID_PATTERN.match(tx_id):
+        errors.append("transaction_id must be 6-64 alphanumeric characters")
+    elif tx_id in existing:
+        errors.append(f"transaction_id '{tx_id}' already exists")
+    correlation_id = data['correlation_id']
+    if not ID_PATTERN.match(correlation_id):
+        errors.append("correlation_id must be 6-64 alphanumeric characters")
+    amount = data['amount']
+    if not isinstance(amount, (int, float)) or amount <= 0:
+        errors.append("amount must be a positive number")
+    sender = data['sender_account']
+    receiver = data['receiver_account']
+    if not ID_PATTERN.match(sender):
+        errors.append("sender_account has invalid format")
+    if not ID_PATTERN.match(receiver):
+        errors.append("receiver_account has invalid format")
+    tx_type = data['transaction_type']
+    if tx_type not in VALID_TRANSACTION_TYPES:
+        errors.append(f"transaction_type must be one of {VALID_TRANSACTION_TYPES}")
+    timestamp = data['timestamp']
+    try:
+        ts = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        if ts > datetime.now().astimezone(ts.tzinfo):
+            errors.append("timestamp cannot be in the future")
+    except Exception as e:
+        errors.append(f"timestamp is invalid: {str(e)}")
+    if 'merchant_category' in data and data['merchant_category'] not in VALID_MERCHANT_CATEGORIES:
+        errors.append(f"merchant_category must be one of {VALID_MERCHANT_CATEGORIES}")
+    if 'device_used' in data and data['device_used'] not in VALID_DEVICES:
+        errors.append(f"device_used must be one of {VALID_DEVICES}")
+    if 'is_fraud' in data and not isinstance(data['is_fraud'], bool):
+        errors.append("is_fraud must be a boolean value")
+    if 'fraud_type' in data and data['fraud_type'] not in VALID_FRAUD_TYPES:
+        errors.append(f"fraud_type must be one of {VALID_FRAUD_TYPES}")
+    if 'time_since_last_transaction' in data and not isinstance(data['time_since_last_transaction'], (int, float)):
+        errors.append("time_since_last_transaction must be a number")
+    if 'spending_deviation_score' in data and not isinstance(data['spending_deviation_score'], (int, float)):
+        errors.append("spending_deviation_score must be a number")
+    if 'velocity_score' in data and not isinstance(data['velocity_score'], (int, float)):
+        errors.append("velocity_score must be a number")
+    if 'geo_anomaly_score' in data and not isinstance(data['geo_anomaly_score'], (int, float)):
+        errors.append("geo_anomaly_score must be a number")
+    if 'payment_channel' in data and data['payment_channel'] not in VALID_PAYMENT_CHANNELS:
+        errors.append(f"payment_channel must be one of {VALID_PAYMENT_CHANNELS}")
+    if 'ip_address' in data and data['ip_address'] and not IP_PATTERN.match(data['ip_address']):
+        errors.append("ip_address has invalid format")
+    if 'device_hash' in data and data['device_hash'] and not DEVICE_HASH_PATTERN.match(data['device_hash']):
+        errors.append("device_hash must be 8 hex characters")
+    return errors
+
+
+def make_records(n: int, invalid_ratio: float, seed: int = 42) -> List[Dict]:
+    rnd = random.Random(seed)
+    with open(TRANS_JSON, encoding='utf-8') as f:
+        originals = json.load(f)
+    now = datetime.now(timezone.utc)
+    records = []
+    for i in range(n):
+        record = {
+            "transaction_id": f"TXN{i:08d}",
+            "correlation_id": f"CORR{i:08d}",
+            "timestamp": (now - timedelta(seconds=rnd.randrange(1, 86400))).isoformat().replace('+00:00', 'Z'),
+            "sender_account": f"ACC{rnd.randrange(10**6):06d}",
+            "receiver_account": f"ACC{rnd.randrange(10**6):06d}",
+            "amount": round(rnd.uniform(1, 10000), 2),
+            "transaction_type": rnd.choice(sorted(VALID_TRANSACTION_TYPES)),
+            "merchant_category": rnd.choice(sorted(VALID_MERCHANT_CATEGORIES)),
+            "location": "New York, USA",
+            "device_used": rnd.choice(sorted(VALID_DEVICES)),
+            "is_fraud": rnd.random() < 0.05,
+            "fraud_type": "",
+            "time_since_last_transaction": rnd.uniform(0, 7200),
+            "spending_deviation_score": rnd.uniform(0, 5),
+            "velocity_score": rnd.uniform(0, 5),
+            "geo_anomaly_score": rnd.uniform(0, 5),
+            "payment_channel": rnd.choice(sorted(VALID_PAYMENT_CHANNELS)),
+            "ip_address": f"192.168.{rnd.randrange(256)}.{rnd.randrange(256)}",
+            "device_hash": f"{rnd.randrange(16 ** 8):08X}",
+        }
+        if rnd.random() < invalid_ratio:
+            broken = rnd.choice([
+                lambda r: r.update(transaction_type="TRANSFER"),
+                lambda r: r.update(amount="2500.50"),
+                lambda r: r.pop("sender_account"),
+                lambda r: r.update(timestamp="2025-10-23T12:34:56"),
+                lambda r: r.update(timestamp=(now + timedelta(days=1)).isoformat()),
+                lambda r: r.update(timestamp="not-a-date"),
+                lambda r: r.update(device_hash="hash_device_001", ip_address="10.0.0"),
+                lambda r: r.update(transaction_id=f"TXN{max(0, i - 1):08d}"),
+                lambda r: r.update(correlation_id="bad id"),
+            ])
+            broken(record)
+        records.append(record)
+    records[:len(originals)] = [dict(o) for o in originals]
+    return records
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark legacy vs schema-compiled transaction validation")
+    ap.add_argument("--records", type=int, default=50_000)
+    ap.add_argument("--invalid-ratio", type=float, default=0.1)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    records = make_records(args.records, args.invalid_ratio)
+    existing = {f"TXN{i:08d}" for i in range(0, args.records, 997)}
+    validator = TransactionValidator(exists=existing.__contains__)
+
+    expected = [legacy_validate(r, existing) for r in records]
+    assert [validator.validate(r) for r in records] == expected, "per-record messages differ"
+    # в пачке дубликат ещё и с более ранней валидной записью той же пачки
+    batch_expected, seen = [], set(existing)
+    for r in records:
+        errors = legacy_validate(r, seen)
+        if not errors:
+            seen.add(r['transaction_id'])
+        batch_expected.append(errors)
+    assert validator.validate_batch(records) == batch_expected, "batch messages differ"
+
+    def measure(fn) -> float:
+        best = float('inf')
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - started)
+        return len(records) / best
+
+    results = {
+        "legacy (per record)": measure(lambda: [legacy_validate(r, existing) for r in records]),
+        "compiled (per record)": measure(lambda: [validator.validate(r) for r in records]),
+        "compiled (batch)": measure(lambda: validator.validate_batch(records)),
+    }
+    print(f"{len(records)} records, {args.invalid_ratio:.0%} invalid; messages identical")
+    for name, rate in results.items():
+        print(f"{name:<24}{rate:>12,.0f} records/s")
+
+
+if __name__ == "__main__":
+    main()
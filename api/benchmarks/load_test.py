@@ -0,0 +1,379 @@
+"""Нагрузочный тест и воспроизведение трафика для API транзакций.
+
+Скрипт сам поднимает api/api.py во временном каталоге и подаёт нагрузку на
+POST /transactions или POST /transactions/import-json (пачками по --batch):
+
+- с фиксированным темпом (--rate запросов/с, открытая модель): запрос
+  назначается на момент start + i/rate, задержка считается от назначенного
+  момента, так что отставание клиента не прячет задержку сервера;
+- с фиксированной параллельностью (--concurrency клиентов без --rate,
+  закрытая модель): каждый клиент шлёт следующий запрос сразу после ответа.
+
+Транзакции генерируются (--senders отправителей) или берутся по кругу из
+--replay: JSON-массив вроде trans.json либо JSONL, где строка — транзакция
+или записанный запрос {"path": ..., "body": ...}. transaction_id и
+correlation_id при воспроизведении делаются уникальными, иначе со второго
+круга все транзакции были бы повторами.
+
+Redis для теста не нужен: перед каталогом api в PYTHONPATH сервера
+кладётся заглушка notifications.notification.RedisHandler. Итог —
+JSON на stdout (и в --output): пропускная способность, доли ошибок,
+429 и 503, перцентили задержки и счётчики сервера после прогона.
+
+    python api/benchmarks/load_test.py --rate 500 --duration 20
+    python api/benchmarks/load_test.py --concurrency 16 --endpoint import-json --batch 100
+    python api/benchmarks/load_test.py --replay trans.json --rate 200 --output summary.json
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from bench_server_modes import API_SCRIPT, wait_ready
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from validation import (VALID_DEVICES, VALID_MERCHANT_CATEGORIES, VALID_PAYMENT_CHANNELS,  # noqa: E402
+                        VALID_TRANSACTION_TYPES)
+
+ENDPOINTS = {'transactions': '/transactions', 'import-json': '/transactions/import-json'}
+PERCENTILES = (50, 90, 95, 99, 99.9)
+HEADERS = {'Content-Type': 'application/json'}
+CHOICES = {
+    'transaction_type': sorted(VALID_TRANSACTION_TYPES),
+    'merchant_category': sorted(VALID_MERCHANT_CATEGORIES),
+    'device_used': sorted(VALID_DEVICES),
+    'payment_channel': sorted(VALID_PAYMENT_CHANNELS),
+}
+
+REDIS_STUB = '''"""Заглушка load_test.py: алерты считаются, но никуда не отправляются."""
+
+
+class RedisHandler:
+    def __init__(self):
+        self.sent = 0
+
+    def listener(self):
+        pass
+
+    def send_alert(self, id, details, severity):
+        self.sent += 1
+'''
+
+
+class TransactionSource:
+    """Тела запросов: сгенерированные транзакции или записи из --replay по кругу."""
+
+    def __init__(self, endpoint: str, batch: int, senders: int, replay: list = None, seed: int = 42):
+        self.endpoint = endpoint
+        self.batch = batch
+        self.senders = senders
+        self.records = replay
+        self.run = uuid.uuid4().hex[:8]
+        self._seq = itertools.count()
+        self._cursor = itertools.count()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next_request(self):
+        """(путь, тело в байтах, число транзакций в нём)."""
+        with self._lock:
+            record = self._next_record()
+            if record is not None and 'path' in record and 'body' in record:
+                body = record['body']
+                body = [self._fresh(item) for item in body] if isinstance(body, list) else self._fresh(body)
+                return record['path'], json.dumps(body).encode('utf-8'), len(body) if isinstance(body, list) else 1
+            first = self._fresh(record) if record is not None else self._generated()
+            if self.endpoint == 'import-json':
+                items = [first] + [self._transaction() for _ in range(self.batch - 1)]
+                return ENDPOINTS['import-json'], json.dumps(items).encode('utf-8'), len(items)
+            return ENDPOINTS['transactions'], json.dumps(first).encode('utf-8'), 1
+
+    def _next_record(self):
+        if self.records is None:
+            return None
+        return self.records[next(self._cursor) % len(self.records)]
+
+    def _transaction(self) -> dict:
+        record = self._next_record()
+        if record is None:
+            return self._generated()
+        # записанный запрос внутри пачки транзакций — берётся его тело
+        return self._fresh(record['body'] if isinstance(record.get('body'), dict) else record)
+
+    def _unique_id(self, prefix: str) -> str:
+        # ID_PATTERN валидации: 6-64 символа [a-zA-Z0-9_-]
+        return f"{prefix[:40]}L{self.run}{next(self._seq):012d}"
+
+    def _generated(self) -> dict:
+        rng = self._rng
+        suffix = self._unique_id('TXL')
+        return {
+            "transaction_id": suffix,
+            "correlation_id": 'COR' + suffix[3:],
+            "timestamp": (datetime.now(timezone.utc) - timedelta(seconds=rng.randrange(1, 3600))).isoformat(),
+            "sender_account": f"ACC{rng.randrange(self.senders):06d}",
+            "receiver_account": f"ACC{rng.randrange(100000, 100000 + self.senders):06d}",
+            "amount": round(rng.uniform(1, 20000), 2),
+            # значения из тех же множеств, что проверяет валидация, — иначе ответы 400
+            "transaction_type": rng.choice(CHOICES['transaction_type']),
+            "merchant_category": rng.choice(CHOICES['merchant_category']),
+            "device_used": rng.choice(CHOICES['device_used']),
+            "payment_channel": rng.choice(CHOICES['payment_channel']),
+        }
+
+    def _fresh(self, transaction):
+        if not isinstance(transaction, dict) or 'transaction_id' not in transaction:
+            return transaction
+        transaction = dict(transaction)
+        transaction['transaction_id'] = self._unique_id(str(transaction['transaction_id']))
+        if 'correlation_id' in transaction:
+            transaction['correlation_id'] = self._unique_id(str(transaction['correlation_id']))
+        return transaction
+
+
+def load_replay(path: str) -> list:
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            data = json.load(f)
+            records = data.get('transactions', [data]) if isinstance(data, dict) else data
+    records = [r for r in records if isinstance(r, dict)]
+    if not records:
+        raise SystemExit(f"{path}: no transactions or recorded requests to replay")
+    return records
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.transactions = 0
+        self.connection_errors = 0
+        self._lock = threading.Lock()
+
+    def merge(self, latencies: list, statuses: dict, transactions: int, connection_errors: int):
+        with self._lock:
+            self.latencies.extend(latencies)
+            for status, count in statuses.items():
+                self.statuses[status] = self.statuses.get(status, 0) + count
+            self.transactions += transactions
+            self.connection_errors += connection_errors
+
+
+def run_client(port: int, source: TransactionSource, results: Results, stop_at: float,
+               slots=None, start: float = 0.0, rate: float = 0.0, max_requests: int = 0):
+    """Один клиент с keep-alive соединением; slots — общий счётчик назначенных моментов при --rate."""
+    latencies, statuses = [], {}
+    transactions = errors = 0
+    conn = None
+    sent = 0
+    while True:
+        if slots is not None:
+            slot = next(slots)
+            if max_requests and slot >= max_requests:
+                break
+            scheduled = start + slot / rate
+            if scheduled >= stop_at:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            if time.perf_counter() >= stop_at or (max_requests and sent >= max_requests):
+                break
+            scheduled = time.perf_counter()
+        sent += 1
+        path, body, count = source.next_request()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            conn.request('POST', path, body=body, headers=HEADERS)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            if response.will_close:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            status = 'connection_error'
+            errors += 1
+            if conn is not None:
+                conn.close()
+                conn = None
+        latencies.append(time.perf_counter() - scheduled)
+        statuses[status] = statuses.get(status, 0) + 1
+        if status in (200, 201, 202, 207):
+            transactions += count
+    if conn is not None:
+        conn.close()
+    results.merge(latencies, statuses, transactions, errors)
+
+
+def get_json(port: int, path: str) -> dict:
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request('GET', path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def wait_processed(port: int, timeout: float) -> float:
+    """Сколько секунд после конца нагрузки сервер дорабатывал очередь (или timeout)."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if get_json(port, '/transactions/count').get('queue_size', 0) == 0:
+            break
+        time.sleep(0.1)
+    return round(time.perf_counter() - started, 3)
+
+
+def percentiles(latencies: list) -> dict:
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    n = len(latencies)
+    result = {f"p{q:g}": round(latencies[min(n - 1, int(q / 100 * n))] * 1000, 3) for q in PERCENTILES}
+    result["max"] = round(latencies[-1] * 1000, 3)
+    result["mean"] = round(sum(latencies) / n * 1000, 3)
+    return result
+
+
+def start_server(args, workdir: str) -> subprocess.Popen:
+    stub_dir = os.path.join(workdir, 'stubs', 'notifications')
+    os.makedirs(stub_dir)
+    open(os.path.join(stub_dir, '__init__.py'), 'w').close()
+    with open(os.path.join(stub_dir, 'notification.py'), 'w') as f:
+        f.write(REDIS_STUB)
+    env = {
+        **os.environ,
+        # api.py добавляет корень репозитория в конец sys.path, заглушка находится раньше
+        "PYTHONPATH": os.pathsep.join(filter(None, [os.path.join(workdir, 'stubs'), os.environ.get("PYTHONPATH")])),
+        "API_SERVER_MODE": args.mode,
+        "API_HOST": "127.0.0.1",
+        "API_PORT": str(args.port),
+        "API_MAX_QUEUE_SIZE": str(args.queue_size),
+    }
+    for item in args.env:
+        name, _, value = item.partition('=')
+        env[name] = value
+    log = open(os.path.join(workdir, 'server.out'), 'wb')
+    server = subprocess.Popen([sys.executable, API_SCRIPT], env=env, cwd=workdir,
+                              stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_ready(args.port, timeout=30)
+    except RuntimeError:
+        server.kill()
+        log.close()
+        with open(os.path.join(workdir, 'server.out'), 'rb') as f:
+            sys.stderr.write(f.read().decode('utf-8', 'replace')[-4000:])
+        raise
+    return server
+
+
+def run(args) -> dict:
+    replay = load_replay(args.replay) if args.replay else None
+    source = TransactionSource(args.endpoint, args.batch, args.senders, replay)
+    with tempfile.TemporaryDirectory(prefix='api-load-') as workdir:
+        server = start_server(args, workdir)
+        try:
+            if args.warmup > 0:
+                warm = Results()
+                run_client(args.port, source, warm, time.perf_counter() + args.warmup)
+            results = Results()
+            start = time.perf_counter()
+            stop_at = start + args.duration
+            slots = itertools.count() if args.rate else None
+            threads = [threading.Thread(target=run_client,
+                                        args=(args.port, source, results, stop_at, slots, start, args.rate,
+                                              args.requests), daemon=True)
+                       for _ in range(args.concurrency)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+            drain_seconds = wait_processed(args.port, args.drain_timeout)
+            server_counts = get_json(args.port, '/transactions/count')
+            server_queue = get_json(args.port, '/queue/stats')
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    requests = len(results.latencies)
+    rate_of = lambda *codes: round(sum(results.statuses.get(c, 0) for c in codes) / requests, 5) if requests else 0.0
+    errors = sum(count for status, count in results.statuses.items()
+                 if status == 'connection_error' or int(status) >= 400)
+    return {
+        "config": {
+            "mode": args.mode, "endpoint": ENDPOINTS[args.endpoint],
+            "batch": args.batch if args.endpoint == 'import-json' else 1,
+            "rate": args.rate or None, "concurrency": args.concurrency, "duration": args.duration,
+            "replay": args.replay, "senders": args.senders, "queue_size": args.queue_size,
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "requests": requests,
+        "transactions_accepted": results.transactions,
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "accepted_tps": round(results.transactions / elapsed, 2) if elapsed else 0.0,
+        "statuses": {str(status): count for status, count in sorted(results.statuses.items(), key=str)},
+        "error_rate": round(errors / requests, 5) if requests else 0.0,
+        "rate_429": rate_of(429),
+        "rate_503": rate_of(503),
+        "connection_errors": results.connection_errors,
+        "latency_ms": percentiles(results.latencies),
+        "server": {
+            "drain_seconds": drain_seconds,
+            "processed": server_counts.get('processed_count'),
+            "failed": server_counts.get('failed_count'),
+            "by_status": server_counts.get('by_status'),
+            "queue_enqueued_skew": server_queue.get('enqueued_skew'),
+        },
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load-test or replay traffic against a locally started transaction API")
+    ap.add_argument("--mode", choices=["http", "asyncio"], default="http")
+    ap.add_argument("--port", type=int, default=3300)
+    ap.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="transactions")
+    ap.add_argument("--batch", type=int, default=100, help="transactions per import-json request")
+    ap.add_argument("--rate", type=float, default=0.0, help="target requests/s (open loop); 0 — closed loop")
+    ap.add_argument("--concurrency", type=int, default=16, help="client threads")
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 — by duration)")
+    ap.add_argument("--warmup", type=float, default=1.0, help="seconds of single-client traffic before measuring")
+    ap.add_argument("--senders", type=int, default=1000, help="distinct generated sender accounts")
+    ap.add_argument("--replay", help="trans.json-style array or JSONL of transactions / {path, body} requests")
+    ap.add_argument("--queue-size", type=int, default=100000)
+    ap.add_argument("--drain-timeout", type=float, default=30.0, help="wait for the queue to empty after the run")
+    ap.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra server environment")
+    ap.add_argument("--output", help="also write the JSON summary to this file")
+    args = ap.parse_args()
+    if args.rate < 0 or args.concurrency < 1 or args.batch < 1:
+        ap.error("--rate must be >= 0, --concurrency and --batch >= 1")
+
+    summary = run(args)
+    text = json.dumps(summary, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Потоковое чтение тела HTTP-запроса.
+
+BodyStream даёт read()/readline() поверх источника кусков, не читая тело
+целиком: LimitedReader ограничивает сокет Content-Length, ChunkedReader
+снимает Transfer-Encoding: chunked. Так большие NDJSON-выгрузки разбираются
+построчно с ограниченным расходом памяти.
+"""
+from typing import BinaryIO
+
+PIECE_SIZE = 64 * 1024
+
+
+class BodyStream:
+    """read()/readline() поверх _next_piece(); пустые байты — конец тела."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pos = 0
+        self._eof = False
+
+    def _next_piece(self) -> bytes:
+        raise NotImplementedError
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        piece = self._next_piece()
+        if not piece:
+            self._eof = True
+            return False
+        if self._pos > len(self._buffer) // 2:
+            del self._buffer[:self._pos]
+            self._pos = 0
+        self._buffer += piece
+        return True
+
+    def read(self, n: int = -1) -> bytes:
+        while (n < 0 or len(self._buffer) - self._pos < n) and self._fill():
+            pass
+        end = len(self._buffer) if n < 0 else min(len(self._buffer), self._pos + n)
+        data = bytes(self._buffer[self._pos:end])
+        self._pos = end
+        return data
+
+    def readline(self, limit: int = -1) -> bytes:
+        # смещение от self._pos: _fill() может сдвинуть буфер
+        searched = 0
+        while True:
+            newline = self._buffer.find(b'\n', self._pos + searched)
+            if newline >= 0:
+                end = newline + 1
+                break
+            if 0 <= limit <= len(self._buffer) - self._pos:
+                end = len(self._buffer)
+                break
+            searched = len(self._buffer) - self._pos
+            if not self._fill():
+                end = len(self._buffer)
+                break
+        if limit >= 0:
+            end = min(end, self._pos + limit)
+        line = bytes(self._buffer[self._pos:end])
+        self._pos = end
+        return line
+
+
+class LimitedReader(BodyStream):
+    """Не более length байт из сокета (тело с Content-Length)."""
+
+    def __init__(self, raw: BinaryIO, length: int):
+        super().__init__()
+        self._raw = raw
+        self._remaining = length
+
+    def _next_piece(self) -> bytes:
+        if self._remaining <= 0:
+            return b''
+        piece = self._raw.read1(min(PIECE_SIZE, self._remaining))
+        if not piece:
+            raise ConnectionResetError("request body truncated")
+        self._remaining -= len(piece)
+        return piece
+
+
+class ChunkedReader(BodyStream):
+    """Тело с Transfer-Encoding: chunked."""
+
+    def __init__(self, raw: BinaryIO):
+        super().__init__()
+        self._raw = raw
+        self._chunk_left = 0
+        self._done = False
+
+    def _next_piece(self) -> bytes:
+        if self._done:
+            return b''
+        if self._chunk_left == 0:
+            size_line = self._raw.readline(1024)
+            if not size_line:
+                raise ConnectionResetError("request body truncated")
+            self._chunk_left = int(size_line.split(b';', 1)[0].strip(), 16)
+            if self._chunk_left == 0:
+                # трейлеры до пустой строки
+                while self._raw.readline(1024) not in (b'\r\n', b'\n', b''):
+                    pass
+                self._done = True
+                return b''
+        piece = self._raw.read1(min(PIECE_SIZE, self._chunk_left))
+        if not piece:
+            raise ConnectionResetError("request body truncated")
+        self._chunk_left -= len(piece)
+        if self._chunk_left == 0:
+            self._raw.readline(2)
+        return piece
@@ -0,0 +1,157 @@
+"""Сжатие тел запросов и ответов API.
+
+Запрос с Content-Encoding: gzip (или zstd, если установлен zstandard)
+распаковывается потоково: DecompressingReader — такой же BodyStream, как
+LimitedReader/ChunkedReader, и читает сжатые куски из них по мере разбора,
+так что NDJSON-загрузка не держит в памяти ни сжатое, ни распакованное тело
+целиком. max_bytes ограничивает распакованный размер (защита от «бомб»).
+
+Ответ сжимается кодировкой, выбранной negotiate() по Accept-Encoding клиента;
+compressor() даёт объект с compress()/flush(), одинаковый для gzip и zstd.
+Процессорное время сжатия и распаковки меряется time.thread_time(): запросы
+обслуживаются параллельно, и время процесса смешало бы их между собой.
+"""
+import time
+import zlib
+from typing import Optional
+
+from body_streams import PIECE_SIZE, BodyStream
+
+try:
+    import zstandard
+except ImportError:  # необязательная зависимость
+    zstandard = None
+
+# в порядке предпочтения при равных q: zstd быстрее и жмёт не хуже
+ENCODINGS = (('zstd',) if zstandard is not None else ()) + ('gzip',)
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+class CorruptBody(ValueError):
+    pass
+
+
+class _Counted:
+    """Источник для zstd stream_reader, считающий прочитанные сжатые байты."""
+
+    def __init__(self, source: BodyStream):
+        self.source = source
+        self.bytes = 0
+
+    def read(self, n: int = -1) -> bytes:
+        data = self.source.read(n)
+        self.bytes += len(data)
+        return data
+
+
+class DecompressingReader(BodyStream):
+    """Распакованное тело поверх потока сжатых кусков source.
+
+    wire_bytes/raw_bytes — сколько прочитано сжатого и отдано распакованного,
+    cpu_seconds — время распаковки в потоке обработчика.
+    """
+
+    def __init__(self, source: BodyStream, encoding: str, max_bytes: int = -1):
+        super().__init__()
+        encoding = encoding.strip().lower()
+        if encoding not in ENCODINGS:
+            raise UnsupportedEncoding(f"unsupported Content-Encoding: {encoding}")
+        self.encoding = encoding
+        self.raw_bytes = 0
+        self.cpu_seconds = 0.0
+        self._source = _Counted(source)
+        self._max_bytes = max_bytes
+        self._pending = b''
+        if encoding == 'gzip':
+            # 16 + MAX_WBITS — заголовок и контрольная сумма gzip
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._reader = zstandard.ZstdDecompressor().stream_reader(self._source, read_size=PIECE_SIZE)
+
+    @property
+    def wire_bytes(self) -> int:
+        return self._source.bytes
+
+    def _next_piece(self) -> bytes:
+        started = time.thread_time()
+        try:
+            piece = self._next_gzip() if self.encoding == 'gzip' else self._next_zstd()
+        except zlib.error as e:
+            raise CorruptBody(f"invalid gzip body: {str(e)}") from None
+        finally:
+            self.cpu_seconds += time.thread_time() - started
+        self.raw_bytes += len(piece)
+        if 0 <= self._max_bytes < self.raw_bytes:
+            raise BodyTooLarge(f"decompressed body exceeds {self._max_bytes} bytes")
+        return piece
+
+    def _next_gzip(self) -> bytes:
+        while True:
+            decompressor = self._decompressor
+            data = decompressor.unconsumed_tail or self._pending or self._source.read(PIECE_SIZE)
+            self._pending = b''
+            if not data:
+                if not decompressor.eof:
+                    raise zlib.error("gzip body is truncated")
+                return b''
+            # max_length: один кусок ответа не больше PIECE_SIZE, как бы ни было сжато
+            piece = decompressor.decompress(data, PIECE_SIZE)
+            if decompressor.eof and decompressor.unused_data:
+                # следующий gzip-член (например, склеенные cat'ом файлы)
+                self._pending = decompressor.unused_data
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if piece:
+                return piece
+
+    def _next_zstd(self) -> bytes:
+        try:
+            return self._reader.read(PIECE_SIZE)
+        except zstandard.ZstdError as e:
+            raise CorruptBody(f"invalid zstd body: {str(e)}") from None
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Кодировка ответа по Accept-Encoding; None — отдавать без сжатия."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compressor(encoding: str):
+    """Потоковый компрессор: compress(данные) -> байты, flush() завершает поток."""
+    if encoding == 'gzip':
+        # wbits=31 — формат gzip, а не «голый» zlib
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise UnsupportedEncoding(f"unsupported encoding: {encoding}")
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    c = compressor(encoding)
+    return c.compress(data) + c.flush()
@@ -0,0 +1,227 @@
+"""Фильтр повторных transaction_id, переживающий вытеснение и перезапуск.
+
+Хранилище помнит id, пока запись не вытеснена по TTL или max_size, и
+(без журнала) до перезапуска. RotatingBloomFilter помнит все принятые id за
+window секунд в фиксированном объёме памяти: окно разбито на buckets
+фильтров Блума, новые id пишутся в самый свежий, а самый старый целиком
+выбрасывается при ротации. Ротация — по времени или досрочно, когда в
+свежий фильтр записано его расчётное число id, так что доля ложных
+срабатываний не превышает fp_rate и при всплеске нагрузки (окно тогда
+короче).
+
+Фильтры блочные: все k бит одного id лежат в одном 512-битном блоке, и
+проверка фильтра — одно чтение блока и одна маска вместо k обращений.
+Отрицательный ответ фильтра окончателен. Положительный проверяется точно по
+хранилищу; если записи там уже нет (вытеснена или принята до перезапуска),
+решает фильтр — новый id будет принят за повтор с вероятностью fp_rate.
+
+Состояние сохраняется в файл: заголовок JSON и биты фильтров.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import struct
+import threading
+import time
+from collections import deque
+from functools import reduce
+from operator import or_
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger()
+
+BLOCK_BYTES = 64
+BLOCK_BITS = BLOCK_BYTES * 8
+# блочный фильтр при том же числе бит ошибается чаще обычного — бит берётся с запасом
+BLOCK_OVERHEAD = 1.4
+STATE_VERSION = 1
+# 64-байтный blake2b: 8 байт на номер блока, по 2 байта на позицию бита
+MAX_HASHES = (64 - 8) // 2
+_POSITION = BLOCK_BITS - 1
+_BITS = [1 << i for i in range(BLOCK_BITS)]
+
+
+class RotatingBloomFilter:
+    """capacity id за window секунд в buckets фильтрах с общей долей ложных срабатываний fp_rate."""
+
+    def __init__(self, capacity: int, fp_rate: float, window_seconds: float, buckets: int = 7,
+                 clock: Callable[[], float] = time.time):
+        if capacity < 1 or not 0 < fp_rate < 1 or window_seconds <= 0 or buckets < 1:
+            raise ValueError("dedup filter needs capacity >= 1, 0 < fp_rate < 1, window > 0, buckets >= 1")
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.window_seconds = window_seconds
+        self.bucket_count = buckets
+        self.bucket_seconds = window_seconds / buckets
+        self.clock = clock
+        self.bucket_capacity = math.ceil(capacity / buckets)
+        # ложное срабатывание любого из фильтров окна — ошибка, поэтому fp_rate делится между ними
+        bits = -self.bucket_capacity * math.log(fp_rate / buckets) / math.log(2) ** 2 * BLOCK_OVERHEAD
+        self.blocks = max(1, math.ceil(bits / BLOCK_BITS))
+        self.hashes = min(MAX_HASHES, max(1, round(self.blocks * BLOCK_BITS / self.bucket_capacity
+                                                   * math.log(2) / BLOCK_OVERHEAD)))
+        self._positions = struct.Struct(f'<{self.hashes}H')
+        # [начало, записано id, биты], от старого к свежему
+        self._buckets: deque = deque()
+        self.saved_at: Optional[float] = None
+        self.negatives = 0
+        self.confirmed = 0
+        self.unconfirmed = 0
+        self.early_rotations = 0
+        self._lock = threading.Lock()
+        self._saver = None
+        self._stop = threading.Event()
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.bucket_count * self.blocks * BLOCK_BYTES
+
+    def add(self, key: str):
+        offset, positions = self._locate(key)
+        mask = reduce(or_, map(_BITS.__getitem__, positions))
+        with self._lock:
+            bucket = self._current(self.clock())
+            bits = bucket[2]
+            block = int.from_bytes(bits[offset:offset + BLOCK_BYTES], 'little') | mask
+            bits[offset:offset + BLOCK_BYTES] = block.to_bytes(BLOCK_BYTES, 'little')
+            bucket[1] += 1
+
+    def might_contain(self, key: str) -> bool:
+        offset, positions = self._locate(key)
+        with self._lock:
+            self._expire(self.clock())
+            for _, _, bits in reversed(self._buckets):
+                block = int.from_bytes(bits[offset:offset + BLOCK_BYTES], 'little')
+                # у нового id обычно уже первый-второй бит нулевой
+                for position in positions:
+                    if not block >> position & 1:
+                        break
+                else:
+                    return True
+        return False
+
+    def check(self, key: str, exact: Callable[[str], bool]) -> bool:
+        """Был ли key: отрицательный ответ фильтра окончателен, положительный проверяется exact()."""
+        if not self.might_contain(key):
+            self.negatives += 1
+            return False
+        if exact(key):
+            self.confirmed += 1
+        else:
+            self.unconfirmed += 1
+        return True
+
+    def save(self, path: str):
+        """Атомарная запись состояния: временный файл, fsync, rename."""
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            header = {
+                "version": STATE_VERSION,
+                "blocks": self.blocks,
+                "hashes": self.hashes,
+                "bucket_capacity": self.bucket_capacity,
+                "bucket_seconds": self.bucket_seconds,
+                "saved_at": now,
+                "buckets": [[started, count] for started, count, _ in self._buckets],
+            }
+            payload = [json.dumps(header).encode('utf-8') + b'\n'] + [bytes(bits) for _, _, bits in self._buckets]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for chunk in payload:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.saved_at = now
+
+    def load(self, path: str) -> bool:
+        """Состояние из файла; False, если файла нет или он от фильтра с другими параметрами."""
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            if (header.get("version"), header.get("blocks"), header.get("hashes"), header.get("bucket_seconds")) != (
+                    STATE_VERSION, self.blocks, self.hashes, self.bucket_seconds):
+                logger.warning(f"Dedup filter state {path} was built with other parameters, starting empty",
+                               extra={'component': 'dedup', 'correlation_id': 'system'})
+                return False
+            size = self.blocks * BLOCK_BYTES
+            buckets = deque()
+            for started, count in header["buckets"]:
+                bits = bytearray(f.read(size))
+                if len(bits) != size:
+                    raise ValueError(f"dedup filter state {path} is truncated")
+                buckets.append([started, count, bits])
+        with self._lock:
+            self._buckets = buckets
+            self.saved_at = header["saved_at"]
+            self._expire(self.clock())
+        return True
+
+    def start_autosave(self, path: str, interval: float):
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.save(path)
+                except OSError as e:
+                    logger.error(f"Failed to save dedup filter to {path}: {str(e)}",
+                                 extra={'component': 'dedup', 'correlation_id': 'system'})
+        self._saver = threading.Thread(target=run, daemon=True, name="DedupSaver")
+        self._saver.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            buckets = [{"started": round(started, 3), "count": count} for started, count, _ in self._buckets]
+        return {
+            "capacity": self.capacity,
+            "fp_rate": self.fp_rate,
+            "window_seconds": self.window_seconds,
+            "bucket_capacity": self.bucket_capacity,
+            "hashes": self.hashes,
+            "memory_bytes": self.memory_bytes,
+            "buckets": buckets,
+            "early_rotations": self.early_rotations,
+            "negatives": self.negatives,
+            "confirmed_in_store": self.confirmed,
+            "unconfirmed": self.unconfirmed,
+            "saved_at": self.saved_at,
+        }
+
+    def _locate(self, key: str):
+        """Смещение блока и позиции k бит внутри него.
+
+        Номер блока — первые 8 байт хеша, позиции бит — следующие 16-битные
+        куски по модулю 512. Двойное хеширование h1 + i*h2 здесь не годится:
+        по модулю 512 маски разных id почти совпадают, и ложных срабатываний
+        на порядки больше.
+        """
+        digest = hashlib.blake2b(key.encode('utf-8')).digest()
+        offset = int.from_bytes(digest[:8], 'little') % self.blocks * BLOCK_BYTES
+        return offset, [position & _POSITION for position in self._positions.unpack_from(digest, 8)]
+
+    def _current(self, now: float) -> list:
+        self._expire(now)
+        if self._buckets:
+            bucket = self._buckets[-1]
+            if now - bucket[0] < self.bucket_seconds and bucket[1] < self.bucket_capacity:
+                return bucket
+            if bucket[1] >= self.bucket_capacity:
+                self.early_rotations += 1
+        bucket = [now, 0, bytearray(self.blocks * BLOCK_BYTES)]
+        self._buckets.append(bucket)
+        while len(self._buckets) > self.bucket_count:
+            self._buckets.popleft()
+        return bucket
+
+    def _expire(self, now: float):
+        # фильтр покрывает время до начала следующего; свежий живёт, пока не сменится
+        while len(self._buckets) > 1 and self._buckets[1][0] <= now - self.window_seconds:
+            self._buckets.popleft()
+        if self._buckets and self._buckets[-1][0] <= now - self.window_seconds - self.bucket_seconds:
+            self._buckets.clear()
@@ -0,0 +1,145 @@
+"""Фоновые задания импорта (POST /transactions/import-json?async=1).
+
+Синхронный импорт держит соединение, пока не проверена и не поставлена в
+очередь последняя транзакция, а то, что не влезло в очередь, получает
+queue_failed. Задание отвечает сразу, а транзакции разбирает в фоне
+пачками по batch_size: перед каждой пачкой wait_for_room ждёт, пока в
+очереди освободится место, так что большой импорт подстраивается под темп
+воркеров, а не отбрасывается. Ход задания — GET /jobs/{id}: счётчики,
+темп и первые max_errors ошибок.
+
+Завершённые задания хранятся retention_seconds и не больше max_jobs
+штук, после перезапуска их нет.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger()
+
+# queued -> running -> completed | interrupted (остановка сервиса) | failed
+FINISHED = frozenset({'completed', 'interrupted', 'failed'})
+
+
+class ImportJob:
+    def __init__(self, total: int, correlation_id: str):
+        self.id = uuid.uuid4().hex
+        self.correlation_id = correlation_id
+        self.total = total
+        self.state = 'queued'
+        self.added = 0
+        self.failed = 0
+        self.errors: List[Dict] = []
+        self.error: Optional[str] = None
+        self.created_at = datetime.now().astimezone().isoformat()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def processed(self) -> int:
+        return self.added + self.failed
+
+    def snapshot(self) -> Dict:
+        elapsed = None
+        if self.started is not None:
+            elapsed = (self.finished or time.monotonic()) - self.started
+        result = {
+            "job_id": self.id,
+            "state": self.state,
+            "correlation_id": self.correlation_id,
+            "created_at": self.created_at,
+            "total": self.total,
+            "processed": self.processed,
+            "added_count": self.added,
+            "failed_count": self.failed,
+            "progress": round(self.processed / self.total, 4) if self.total else 1.0,
+            "elapsed_seconds": round(elapsed, 3) if elapsed is not None else None,
+            "throughput_per_second": round(self.processed / elapsed, 1) if elapsed else None,
+            "errors": list(self.errors),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+class ImportJobs:
+    """Очередь заданий импорта на workers потоках.
+
+    run_batch(пачка, correlation_id, номер первого элемента) -> (добавлено,
+    [(номер, ошибка)]) — тот же import_transactions, что у синхронного
+    импорта; wait_for_room(размер пачки) -> False, если задание надо
+    прервать.
+    """
+
+    def __init__(self, run_batch: Callable[[List, str, int], Tuple[int, List[Tuple[int, Dict]]]],
+                 wait_for_room: Callable[[int], bool], batch_size: int = 500, workers: int = 2,
+                 max_errors: int = 100, retention_seconds: float = 3600, max_jobs: int = 1000):
+        self.run_batch = run_batch
+        self.wait_for_room = wait_for_room
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.retention_seconds = retention_seconds
+        self.max_jobs = max_jobs
+        self._jobs: 'OrderedDict[str, ImportJob]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ImportJob")
+
+    def submit(self, items: List, correlation_id: str) -> ImportJob:
+        job = ImportJob(len(items), correlation_id)
+        with self._lock:
+            self._evict(time.monotonic())
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, items)
+        return job
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state not in FINISHED)
+
+    def _run(self, job: ImportJob, items: List):
+        job.state = 'running'
+        job.started = time.monotonic()
+        try:
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                if not self.wait_for_room(len(batch)):
+                    job.state = 'interrupted'
+                    job.error = f"service is shutting down, {job.total - job.processed} transactions were not imported"
+                    break
+                added, errors = self.run_batch(batch, job.correlation_id, start)
+                job.added += added
+                job.failed += len(errors)
+                room = self.max_errors - len(job.errors)
+                if room > 0:
+                    job.errors.extend({'index': index, **error} for index, error in errors[:room])
+            else:
+                job.state = 'completed'
+        except Exception as e:
+            job.state = 'failed'
+            job.error = str(e) or type(e).__name__
+            logger.error(f"Import job {job.id} failed: {job.error}",
+                         extra={'component': 'import', 'correlation_id': job.correlation_id})
+        finally:
+            job.finished = time.monotonic()
+        logger.info(f"Import job {job.id} {job.state}: {job.added} added, {job.failed} failed "
+                    f"of {job.total} in {job.finished - job.started:.2f}s",
+                    extra={'component': 'import', 'correlation_id': job.correlation_id})
+
+    def _evict(self, now: float):
+        # задания добавляются по порядку, поэтому старые завершённые — в начале
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if job.state not in FINISHED:
+                continue
+            if len(self._jobs) >= self.max_jobs or now - job.finished > self.retention_seconds:
+                del self._jobs[job_id]
@@ -0,0 +1,51 @@
+"""Кодек JSON для тел запросов и ответов API.
+
+API_JSON_BACKEND выбирает реализацию: orjson (в разы быстрее stdlib и сразу
+отдаёт UTF-8 байты), stdlib или auto — orjson, если он установлен. Обе
+реализации дают одинаковый интерфейс: dumps() -> bytes, loads() принимает
+bytes или str, а ошибки разбора — подклассы json.JSONDecodeError.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость
+    orjson = None
+
+JSON_BACKEND = os.getenv("API_JSON_BACKEND", "auto")
+
+if JSON_BACKEND == 'orjson' and orjson is None:
+    raise RuntimeError("API_JSON_BACKEND=orjson, but orjson is not installed")
+
+
+def _stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, default=str).encode('utf-8')
+
+
+def _stdlib_loads(data):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        # как orjson: невалидный UTF-8 — ошибка разбора, а не UnicodeDecodeError
+        try:
+            data = bytes(data).decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise json.JSONDecodeError(f"invalid UTF-8: {e.reason}", '', e.start) from None
+    return json.loads(data)
+
+
+if orjson is not None and JSON_BACKEND in ('auto', 'orjson'):
+    BACKEND = 'orjson'
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj) -> bytes:
+        try:
+            return orjson.dumps(obj, default=str, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # например, целые больше 64 бит
+            return _stdlib_dumps(obj)
+
+    loads = orjson.loads
+else:
+    BACKEND = 'stdlib'
+    dumps = _stdlib_dumps
+    loads = _stdlib_loads
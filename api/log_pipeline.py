@@ -0,0 +1,144 @@
+"""Неблокирующее логирование API.
+
+Записи не пишутся в поток запроса или воркера: AsyncQueueHandler кладёт их
+в ограниченную очередь, а фоновый QueueListener отдаёт их консольному и
+файловому обработчикам. Формат — JSON-строка на запись с component и
+correlation_id из CorrelationFilter (или прежний текстовый формат).
+
+InfoSampler прореживает INFO-строки отдельных транзакций (correlation_id не
+'system'): первые info_rate_limit строк в секунду проходят, дальше — только
+каждая 1/info_sample_ratio-я. При переполнении очереди отбрасываются только
+записи ниже WARNING; WARNING и ERROR ждут места в очереди и не теряются.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - [%(component)s] [%(correlation_id)s] %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "component": getattr(record, 'component', 'main'),
+            "correlation_id": getattr(record, 'correlation_id', 'system'),
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class InfoSampler(logging.Filter):
+    """Прореживание INFO по транзакциям при высоком темпе; прочие записи проходят всегда."""
+
+    def __init__(self, rate_limit: int = 200, sample_ratio: float = 0.01):
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.every = max(1, round(1 / sample_ratio)) if sample_ratio > 0 else 0
+        self.sampled_out = 0
+        self._window = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.INFO or getattr(record, 'correlation_id', 'system') == 'system':
+            return True
+        window = int(time.monotonic())
+        with self._lock:
+            if window != self._window:
+                self._window, self._count = window, 0
+            self._count += 1
+            over = self._count - self.rate_limit
+            if over <= 0 or (self.every and over % self.every == 0):
+                return True
+            self.sampled_out += 1
+            return False
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не ждёт места для INFO/DEBUG и ждёт его для WARNING+."""
+
+    def __init__(self, log_queue: queue.Queue, fallback: logging.Handler):
+        super().__init__(log_queue)
+        self.fallback = fallback
+        self.dropped = 0
+        self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # форматирует уже фоновый поток; здесь только фиксируем сообщение и трассировку
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        if os.getpid() != self._pid:
+            # процесс пула оценки после fork: фонового писателя здесь нет
+            self.fallback.handle(record)
+            return
+        try:
+            record = self.prepare(record)
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                try:
+                    self.queue.put_nowait(record)
+                except queue.Full:
+                    self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class LogPipeline:
+    """Очередь, фоновый писатель и фильтры логов корневого логгера."""
+
+    def __init__(self, handlers: List[logging.Handler], filters: List[logging.Filter],
+                 json_format: bool = True, queue_size: int = 10000,
+                 info_rate_limit: int = 200, info_sample_ratio: float = 0.01):
+        formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        fallback = logging.StreamHandler(sys.stderr)
+        fallback.setFormatter(formatter)
+        self.sampler = InfoSampler(info_rate_limit, info_sample_ratio)
+        self.handler = AsyncQueueHandler(queue.Queue(maxsize=queue_size), fallback)
+        for log_filter in filters + [self.sampler]:
+            self.handler.addFilter(log_filter)
+        self.listener = logging.handlers.QueueListener(self.handler.queue, *handlers, respect_handler_level=True)
+
+    def install(self, logger: logging.Logger, level: int = logging.INFO):
+        logger.setLevel(level)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(self.handler)
+        self.listener.start()
+
+    def stop(self):
+        """Дописывает очередь и останавливает фоновый поток."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def snapshot(self) -> Dict:
+        return {
+            "queued": self.handler.queue.qsize(),
+            "dropped_queue_full": self.handler.dropped,
+            "sampled_out": self.sampler.sampled_out,
+            "info_rate_limit": self.sampler.rate_limit,
+        }
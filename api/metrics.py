@@ -0,0 +1,185 @@
+"""Метрики API в формате Prometheus (GET /metrics).
+
+Собственный CollectorRegistry, а не глобальный: в нём только метрики
+сервиса, без метрик процесса клиентской библиотеки. Гистограммы (задержка
+запросов по маршрутам, ожидание в очереди, время проверки правил)
+обновляются по ходу работы; глубина очереди, статусы транзакций и загрузка
+воркеров считаются в момент опроса из текущего состояния. Для сжатых тел
+копятся байты до и после сжатия и процессорное время кодека — отсюда
+степень сжатия и стоимость мегабайта.
+
+Ожидание в очереди меряет сама ShardedQueue (shard_queue.py): put()
+запоминает момент постановки, take() отдаёт в гистограмму время до того, как
+транзакцию забрал воркер. Глубина и приток по шардам — для оценки перекоса.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+REQUEST_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUEUE_WAIT_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+# threerules-правила работают за микросекунды, pattern с большим окном — дольше
+RULE_BUCKETS = (.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1)
+
+
+class WorkerUtilization:
+    """Доля времени, которую каждый воркер занят пачкой, за окна по window секунд.
+
+    Отдаётся доля последнего завершённого окна, а пока окно первое — доля
+    с момента запуска воркера. Пачка, которая ещё идёт, учитывается сразу.
+    """
+
+    def __init__(self, window: float = 10.0):
+        self.window = window
+        # имя потока -> [начало окна, занято в окне, начало текущей пачки или None, доля прошлого окна]
+        self._state: Dict[str, list] = {}
+        self._busy_total: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def busy(self):
+        name = threading.current_thread().name
+        started = time.monotonic()
+        with self._lock:
+            state = self._state.setdefault(name, [started, 0.0, None, None])
+            state[2] = started
+        try:
+            yield
+        finally:
+            now = time.monotonic()
+            with self._lock:
+                state[1] += now - state[2]
+                state[2] = None
+                self._busy_total[name] = self._busy_total.get(name, 0.0) + now - started
+
+    def register(self):
+        """Воркер текущего потока запущен: до первой пачки его доля нулевая."""
+        with self._lock:
+            self._state.setdefault(threading.current_thread().name, [time.monotonic(), 0.0, None, None])
+
+    def forget(self):
+        """Воркер текущего потока вышел и больше не отображается."""
+        with self._lock:
+            self._state.pop(threading.current_thread().name, None)
+
+    def ratios(self) -> Dict[str, float]:
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            for name, state in self._state.items():
+                if state[2] is not None:
+                    state[1] += now - state[2]
+                    state[2] = now
+                elapsed = now - state[0]
+                if elapsed >= self.window:
+                    state[3] = min(1.0, state[1] / elapsed)
+                    state[0], state[1] = now, 0.0
+                result[name] = state[3] if state[3] is not None else min(1.0, state[1] / max(elapsed, 1e-6))
+        return result
+
+    def busy_totals(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._busy_total)
+
+
+class _StateCollector:
+    """Метрики, которые читаются из состояния сервиса в момент опроса."""
+
+    def __init__(self, status_counts: Callable[[], Dict[str, int]],
+                 transition_totals: Callable[[], Dict[str, int]], workers: WorkerUtilization,
+                 shard_loads: Callable[[], List[Dict]]):
+        self.status_counts = status_counts
+        self.transition_totals = transition_totals
+        self.workers = workers
+        self.shard_loads = shard_loads
+
+    def collect(self):
+        by_status = GaugeMetricFamily('api_transactions', 'Transactions in the store by status',
+                                      labels=['status'])
+        for status, count in sorted(self.status_counts().items()):
+            by_status.add_metric([status], count)
+        yield by_status
+
+        transitions = CounterMetricFamily('api_transaction_transitions', 'Status transitions since start',
+                                          labels=['status'])
+        for status, count in sorted(self.transition_totals().items()):
+            transitions.add_metric([status], count)
+        yield transitions
+
+        busy_ratio = GaugeMetricFamily('api_worker_busy_ratio',
+                                       'Share of wall time each queue worker spends scoring batches',
+                                       labels=['worker'])
+        for worker, ratio in sorted(self.workers.ratios().items()):
+            busy_ratio.add_metric([worker], ratio)
+        yield busy_ratio
+
+        busy_seconds = CounterMetricFamily('api_worker_busy_seconds', 'Time queue workers spent scoring batches',
+                                           labels=['worker'])
+        for worker, seconds in sorted(self.workers.busy_totals().items()):
+            busy_seconds.add_metric([worker], seconds)
+        yield busy_seconds
+
+        shards = self.shard_loads()
+        shard_depth = GaugeMetricFamily('api_queue_shard_depth', 'Transactions waiting in each queue shard',
+                                        labels=['shard'])
+        shard_enqueued = CounterMetricFamily('api_queue_shard_enqueued', 'Transactions put into each queue shard',
+                                             labels=['shard'])
+        for shard in shards:
+            shard_depth.add_metric([str(shard["shard"])], shard["depth"])
+            shard_enqueued.add_metric([str(shard["shard"])], shard["enqueued"])
+        yield shard_depth
+        yield shard_enqueued
+
+
+class ApiMetrics:
+    """Реестр метрик API; watch() подключает состояние очереди, хранилища и воркеров."""
+
+    content_type = CONTENT_TYPE_LATEST
+
+    def __init__(self, worker_window: float = 10.0):
+        self.registry = CollectorRegistry()
+        self.requests = Histogram('api_request_duration_seconds', 'HTTP request latency by endpoint',
+                                  ['method', 'endpoint', 'status'], buckets=REQUEST_BUCKETS,
+                                  registry=self.registry)
+        self.queue_wait = Histogram('api_queue_wait_seconds',
+                                    'Time a transaction waits in processing_queue before a worker takes it',
+                                    buckets=QUEUE_WAIT_BUCKETS, registry=self.registry)
+        self.rules = Histogram('api_rule_evaluation_seconds', 'Rule evaluation latency in rule check endpoints',
+                               ['rule'], buckets=RULE_BUCKETS, registry=self.registry)
+        self.body_bytes = Counter('api_compressed_body_bytes', 'Compressed request/response body sizes',
+                                  ['direction', 'encoding', 'form'], registry=self.registry)
+        self.codec_seconds = Counter('api_compression_cpu_seconds', 'CPU time spent compressing/decompressing bodies',
+                                     ['direction', 'encoding'], registry=self.registry)
+        self.workers = WorkerUtilization(worker_window)
+
+    def watch(self, queue_depth: Callable[[], int], queue_capacity: int, worker_count: Callable[[], int],
+              status_counts: Callable[[], Dict[str, int]], transition_totals: Callable[[], Dict[str, int]],
+              shard_loads: Callable[[], List[Dict]]):
+        Gauge('api_queue_depth', 'Transactions waiting in processing_queue (all shards)',
+              registry=self.registry).set_function(queue_depth)
+        Gauge('api_queue_capacity', 'processing_queue size limit',
+              registry=self.registry).set(queue_capacity)
+        Gauge('api_workers', 'Running queue worker threads',
+              registry=self.registry).set_function(worker_count)
+        self.registry.register(_StateCollector(status_counts, transition_totals, self.workers, shard_loads))
+
+    def observe_request(self, method: str, endpoint: str, status: int, seconds: float):
+        self.requests.labels(method, endpoint, str(status)).observe(seconds)
+
+    def observe_compression(self, direction: str, encoding: str, raw_bytes: int, wire_bytes: int,
+                            cpu_seconds: float):
+        """direction — request или response; raw — несжатые байты, wire — переданные."""
+        self.body_bytes.labels(direction, encoding, 'raw').inc(raw_bytes)
+        self.body_bytes.labels(direction, encoding, 'wire').inc(wire_bytes)
+        self.codec_seconds.labels(direction, encoding).inc(cpu_seconds)
+
+    def time_rule(self, rule: str):
+        """Контекстный менеджер: время проверки правила rule."""
+        return self.rules.labels(rule).time()
+
+    def render(self) -> bytes:
+        return generate_latest(self.registry)
@@ -0,0 +1,230 @@
+"""Скользящие окна по отправителям и получателям для pattern-правил.
+
+pattern_rule получает от админки все недавние транзакции отправителя и на
+каждый вызов заново разбирает их даты и пересчитывает подходящие. Здесь API
+сам ведёт историю принятых транзакций за retention секунд: по паре
+отправитель/получатель, по отправителю и по получателю. Время и сумма лежат
+в двух array('d'), отсортированных по времени транзакции, так что число
+транзакций в окне — два бинарных поиска.
+
+Условие на сумму (оператор и порог правила) превращается в предикат: для
+каждого встреченного предиката при первом обращении из истории строятся
+такие же ряды только подходящих транзакций, а дальше они пополняются при
+record(). Проверка правила — O(log n) по ряду нужного ключа. Предикатов
+хранится не больше max_predicates, давно не нужные выбрасываются.
+
+Память ограничена не только retention: в ряду ключа не больше
+max_entries_per_key последних транзакций (счётчик окна насыщается на этом
+числе, а вставка в ряд стоит не больше O(max_entries_per_key)), а всего во
+всех рядах не больше max_entries — сверх него целиком выбрасываются ключи,
+в которые дольше всего ничего не записывалось. 0 — без ограничения.
+"""
+import operator
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+# те же операторы, что подставляет в eval threshold_rule
+OPERATORS = {
+    '>': operator.gt, '<': operator.lt, '>=': operator.ge,
+    '<=': operator.le, '==': operator.eq, '!=': operator.ne,
+}
+SCOPES = ('pair', 'sender', 'receiver')
+TIME_UNITS = {'minutes': 60, 'minute': 60, 'hours': 3600, 'hour': 3600, 'days': 86400, 'day': 86400}
+
+
+def window_seconds(window: float, time_type: str) -> float:
+    """Окно pattern-правила в секундах; неизвестная единица — минуты, как в pattern_rule."""
+    return float(window) * TIME_UNITS.get(time_type, 60)
+
+
+def _epoch(timestamp) -> float:
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    return datetime.fromisoformat(str(timestamp).replace('Z', '+00:00')).timestamp()
+
+
+class _Series:
+    """Отметки времени (и суммы) по возрастанию времени."""
+    __slots__ = ('times', 'amounts')
+
+    def __init__(self, with_amounts: bool = True):
+        self.times = array('d')
+        self.amounts = array('d') if with_amounts else None
+
+    def insert(self, ts: float, amount: float):
+        times = self.times
+        # транзакции приходят почти по порядку — обычно это append
+        i = len(times) if not times or ts >= times[-1] else bisect_right(times, ts)
+        times.insert(i, ts)
+        if self.amounts is not None:
+            self.amounts.insert(i, amount)
+
+    def expire(self, cutoff: float) -> int:
+        i = bisect_left(self.times, cutoff)
+        if i:
+            del self.times[:i]
+            if self.amounts is not None:
+                del self.amounts[:i]
+        return i
+
+    def trim(self, limit: int) -> int:
+        """Оставляет limit самых поздних отметок; возвращает, сколько выброшено."""
+        extra = len(self.times) - limit
+        if extra <= 0:
+            return 0
+        del self.times[:extra]
+        if self.amounts is not None:
+            del self.amounts[:extra]
+        return extra
+
+    def count(self, start: float, end: float) -> int:
+        return bisect_right(self.times, end) - bisect_left(self.times, start)
+
+
+class PatternState:
+    """История транзакций за retention_seconds по трём ключам и счётчики окон по ней."""
+
+    def __init__(self, retention_seconds: float, max_predicates: int = 32,
+                 sweep_interval: float = 60.0, clock=time.time,
+                 max_entries: int = 0, max_entries_per_key: int = 0):
+        self.retention_seconds = retention_seconds
+        self.max_predicates = max_predicates
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        self.max_entries = max_entries
+        self.max_entries_per_key = max_entries_per_key
+        # (scope, *accounts) -> _Series, от давно не пополнявшихся к недавним
+        self._series: 'OrderedDict[Tuple, _Series]' = OrderedDict()
+        self._entries = 0
+        self.trimmed = 0
+        self.evicted_keys = 0
+        # (оператор, порог) -> {ключ -> _Series без сумм}
+        self._predicates: 'OrderedDict[Tuple[str, float], Dict[Tuple, _Series]]' = OrderedDict()
+        self._last_sweep = clock()
+        self.recorded = 0
+        self.skipped = 0
+        self.lookups = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def keys(sender, receiver) -> Tuple[Tuple, ...]:
+        return ('pair', sender, receiver), ('sender', sender), ('receiver', receiver)
+
+    def record(self, tx: Dict):
+        """Учитывает принятую транзакцию; без корректных времени и суммы — пропускает."""
+        try:
+            ts = _epoch(tx['timestamp'])
+            amount = float(tx['amount'])
+        except (KeyError, TypeError, ValueError):
+            self.skipped += 1
+            return
+        now = self.clock()
+        if ts < now - self.retention_seconds:
+            self.skipped += 1
+            return
+        with self._lock:
+            per_key = self.max_entries_per_key
+            for key in self.keys(tx.get('sender_account'), tx.get('receiver_account')):
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = _Series()
+                else:
+                    self._series.move_to_end(key)
+                series.insert(ts, amount)
+                self._entries += 1
+                if per_key:
+                    trimmed = series.trim(per_key)
+                    self._entries -= trimmed
+                    self.trimmed += trimmed
+                for (name, threshold), by_key in self._predicates.items():
+                    if OPERATORS[name](amount, threshold):
+                        matching = by_key.get(key)
+                        if matching is None:
+                            matching = by_key[key] = _Series(with_amounts=False)
+                        matching.insert(ts, amount)
+                        if per_key:
+                            matching.trim(per_key)
+            self.recorded += 1
+            if self.max_entries and self._entries > self.max_entries:
+                self._evict_keys()
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+
+    def count(self, key: Tuple, operator_name: str, threshold: float, window: float,
+              now: Optional[float] = None) -> int:
+        """Сколько транзакций ключа за последние window секунд с amount <operator> threshold."""
+        if operator_name not in OPERATORS:
+            raise ValueError(f"operator must be one of {tuple(OPERATORS)}")
+        if window > self.retention_seconds:
+            raise ValueError(f"time window {window:g}s exceeds pattern state retention "
+                             f"{self.retention_seconds:g}s")
+        now = self.clock() if now is None else now
+        with self._lock:
+            self.lookups += 1
+            series = self._predicate(operator_name, float(threshold)).get(key)
+            return series.count(now - window, now) if series is not None else 0
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            by_scope = {scope: 0 for scope in SCOPES}
+            for key in self._series:
+                by_scope[key[0]] += 1
+            return {
+                "retention_seconds": self.retention_seconds,
+                "keys": by_scope,
+                "entries": self._entries,
+                "max_entries": self.max_entries or None,
+                "max_entries_per_key": self.max_entries_per_key or None,
+                "trimmed": self.trimmed,
+                "evicted_keys": self.evicted_keys,
+                "predicates": [{"operator": name, "threshold": threshold, "keys": len(by_key)}
+                               for (name, threshold), by_key in self._predicates.items()],
+                "recorded": self.recorded,
+                "skipped": self.skipped,
+                "lookups": self.lookups,
+            }
+
+    def _predicate(self, name: str, threshold: float) -> Dict[Tuple, _Series]:
+        predicate = (name, threshold)
+        by_key = self._predicates.get(predicate)
+        if by_key is not None:
+            self._predicates.move_to_end(predicate)
+            return by_key
+        test = OPERATORS[name]
+        by_key = {}
+        for key, series in self._series.items():
+            matching = _Series(with_amounts=False)
+            matching.times = array('d', (ts for ts, amount in zip(series.times, series.amounts)
+                                         if test(amount, threshold)))
+            if matching.times:
+                by_key[key] = matching
+        self._predicates[predicate] = by_key
+        while len(self._predicates) > self.max_predicates:
+            self._predicates.popitem(last=False)
+        return by_key
+
+    def _evict_keys(self):
+        # ряды предикатов — подмножества рядов ключа и уходят вместе с ними
+        while self._entries > self.max_entries and self._series:
+            key, series = self._series.popitem(last=False)
+            self._entries -= len(series.times)
+            self.evicted_keys += 1
+            for by_key in self._predicates.values():
+                by_key.pop(key, None)
+
+    def _sweep(self, now: float):
+        cutoff = now - self.retention_seconds
+        for index in [self._series] + list(self._predicates.values()):
+            for key in list(index):
+                series = index[key]
+                expired = series.expire(cutoff)
+                if index is self._series:
+                    self._entries -= expired
+                if not series.times:
+                    del index[key]
+        self._last_sweep = now
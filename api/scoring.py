@@ -0,0 +1,470 @@
+"""Пакетная оценка транзакций воркерами API.
+
+Воркер забирает из processing_queue микропачку (не больше batch_size записей
+и не дольше max_wait_ms ожидания) и отдаёт её BatchScorer: каждое активное
+правило из methods/threerules.py проходит по всей пачке разом, pattern-правило
+считается один раз на пару отправитель/получатель, а LightGBM-артефакт из
+methods/fraud_pipeline (если задан) получает всю пачку одним DataFrame.
+
+Правила описываются так же, как модель Rules в админке (rule_type, operator,
+threshold_value, pattern_*, composite_conditions) и читаются из JSON-файла;
+composite_conditions не передаются в eval (как в composite_rule), а
+разбираются compile_conditions() по белому списку: amount, числа,
+nighttime/daytime, операторы сравнения, AND/OR/NOT и скобки.
+решение об алерте и уровень риска считаются так же, как в transaction_importer
+админки: чем больше сработавших правил, тем выше риск.
+"""
+import functools
+import json
+import logging
+import operator
+import re
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from methods.threerules import threshold_rule, pattern_rule
+
+logger = logging.getLogger()
+
+RULE_TYPES = ('threshold', 'pattern', 'composite')
+# операторы подставляются в eval внутри threerules, поэтому только из списка
+RULE_OPERATORS = ('>', '<', '>=', '<=', '==', '!=')
+_COMPARISONS = {'>': operator.gt, '<': operator.lt, '>=': operator.ge, '<=': operator.le,
+                '==': operator.eq, '!=': operator.ne}
+# composite_rule убирает все пробелы («5 000» — это 5000), поэтому и лексемы — без них
+_CONDITION_TOKEN = re.compile(r'amount|nighttime|daytime|True|False|AND|OR|NOT|and|or|not'
+                              r'|>=|<=|==|!=|>|<|\(|\)|\d+(?:\.\d+)?')
+# числовые поля правила по типам и их верхние границы: строка или 1e308 дошли бы до
+# float()/timedelta в threerules и дали бы 500 вместо 400
+RULE_NUMBER_FIELDS = {
+    'threshold': {'threshold_value': 1e15},
+    'pattern': {'pattern_window_minutes': 525600, 'pattern_max_count': 1e9, 'pattern_max_amount': 1e15},
+}
+MODEL_RULE_NAME = 'ml_model'
+# как send_notification в админке: число сработавших правил -> риск и severity
+RISK_SEVERITY = {'high': '0.9', 'medium': '0.6', 'low': '0.3'}
+
+DEFAULT_RULES = [
+    {"name": "large_amount", "rule_type": "threshold", "operator": ">", "threshold_value": 10000},
+    {"name": "repeated_transfers", "rule_type": "pattern", "operator": ">", "pattern_window_minutes": 60,
+     "pattern_max_count": 3, "pattern_max_amount": 5000},
+    {"name": "night_large_amount", "rule_type": "composite",
+     "composite_conditions": "(amount > 5000) AND (nighttime)"},
+]
+
+
+def load_rules(path: Optional[str] = None) -> List[Dict]:
+    """Активные правила из JSON-файла (список объектов) или DEFAULT_RULES."""
+    if path:
+        with open(path, encoding='utf-8') as f:
+            rules = json.load(f)
+    else:
+        rules = DEFAULT_RULES
+    return validate_rules(rules)
+
+
+def validate_rules(rules) -> List[Dict]:
+    """Проверенные активные правила в формате модели Rules; у каждого есть name."""
+    if not isinstance(rules, list):
+        raise ValueError("rules must be a JSON list")
+    active = []
+    for index, rule in enumerate(rules):
+        if not isinstance(rule, dict):
+            raise ValueError(f"rule #{index}: must be an object")
+        if not rule.get('is_active', True):
+            continue
+        rule_type = rule.get('rule_type')
+        if rule_type not in RULE_TYPES:
+            raise ValueError(f"rule #{index}: rule_type must be one of {RULE_TYPES}")
+        if rule_type != 'composite' and rule.get('operator') not in RULE_OPERATORS:
+            raise ValueError(f"rule #{index}: operator must be one of {RULE_OPERATORS}")
+        for field, limit in RULE_NUMBER_FIELDS.get(rule_type, {}).items():
+            value = rule.get(field)
+            # None — поле не задано, правило берёт 0, как и раньше
+            if value is not None and not (is_number(value) and 0 <= value <= limit):
+                raise ValueError(f"rule #{index}: {field} must be a number between 0 and {limit:g}")
+        if rule_type == 'composite':
+            try:
+                compile_conditions(_conditions_text(rule))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"rule #{index}: composite_conditions: {str(e)}")
+        active.append({**rule, 'name': rule.get('name') or f"{rule_type}_{index}"})
+    return active
+
+
+def required_fields(rules: List[Dict]) -> Tuple[str, ...]:
+    """Поля транзакции, без которых правила rules не посчитать."""
+    types = {rule['rule_type'] for rule in rules}
+    return (('amount',) + (('sender_account', 'receiver_account') if 'pattern' in types else ())
+            + (('timestamp',) if 'composite' in types else ()))
+
+
+def pattern_inputs_from(rules: List[Dict], history: List[Dict]) -> Dict[Tuple, List[Tuple]]:
+    """Вход pattern-правил из переданных клиентом транзакций, как у BatchScorer.pattern_inputs().
+
+    Окно по времени проверяет сам pattern_rule, здесь история только
+    раскладывается по парам отправитель/получатель.
+    """
+    by_pair = {}
+    for item in history:
+        pair = (item.get('sender_account'), item.get('receiver_account'))
+        by_pair.setdefault(pair, []).append((item.get('timestamp'), item.get('amount')))
+    windows = {rule.get('pattern_window_minutes') or 0 for rule in rules if rule['rule_type'] == 'pattern'}
+    return {(window,) + pair: items for window in windows for pair, items in by_pair.items()}
+
+
+def _conditions_text(rule: Dict) -> str:
+    conditions = rule.get('composite_conditions') or 'False'
+    if isinstance(conditions, list):
+        conditions = ' AND '.join(f"({condition})" for condition in conditions)
+    if not isinstance(conditions, str):
+        raise TypeError("must be a string or a list of strings")
+    return conditions
+
+
+@functools.lru_cache(maxsize=256)
+def compile_conditions(conditions: str) -> tuple:
+    """Дерево условия composite-правила; ValueError — в условии есть что-то кроме белого списка.
+
+    Приоритеты как у выражения Python, которое строил composite_rule:
+    NOT выше AND, AND выше OR, сравнения цепочкой (1000 < amount <= 5000).
+    """
+    text = re.sub(r'\s+', '', conditions)
+    tokens, pos = [], 0
+    while pos < len(text):
+        match = _CONDITION_TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError(f"unexpected input at {text[pos:pos + 20]!r}")
+        tokens.append(match.group().lower() if match.group() in ('AND', 'OR', 'NOT') else match.group())
+        pos = match.end()
+    tokens.append(None)
+    position = 0
+
+    def peek():
+        return tokens[position]
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        node = [parse_and()]
+        while peek() == 'or':
+            take()
+            node.append(parse_and())
+        return node[0] if len(node) == 1 else ('or', tuple(node))
+
+    def parse_and():
+        node = [parse_not()]
+        while peek() == 'and':
+            take()
+            node.append(parse_not())
+        return node[0] if len(node) == 1 else ('and', tuple(node))
+
+    def parse_not():
+        if peek() == 'not':
+            take()
+            return ('not', parse_not())
+        first = parse_operand()
+        chain = []
+        while peek() in _COMPARISONS:
+            chain.append((take(), parse_operand()))
+        return ('compare', first, tuple(chain)) if chain else first
+
+    def parse_operand():
+        token = take()
+        if token == '(':
+            node = parse_or()
+            if take() != ')':
+                raise ValueError("unbalanced parentheses")
+            return node
+        if token in ('amount', 'nighttime', 'daytime'):
+            return (token,)
+        if token in ('True', 'False'):
+            return ('value', token == 'True')
+        if token is not None and token[0].isdigit():
+            return ('value', float(token))
+        raise ValueError(f"unexpected {token!r}" if token is not None else "unexpected end of condition")
+
+    tree = parse_or()
+    if peek() is not None:
+        raise ValueError(f"unexpected {peek()!r}")
+    return tree
+
+
+def evaluate_conditions(tree: tuple, amount: float, night: bool):
+    kind = tree[0]
+    if kind == 'amount':
+        return amount
+    if kind == 'nighttime':
+        return night
+    if kind == 'daytime':
+        return not night
+    if kind == 'value':
+        return tree[1]
+    if kind == 'not':
+        return not evaluate_conditions(tree[1], amount, night)
+    if kind == 'and':
+        return all(evaluate_conditions(node, amount, night) for node in tree[1])
+    if kind == 'or':
+        return any(evaluate_conditions(node, amount, night) for node in tree[1])
+    left = evaluate_conditions(tree[1], amount, night)
+    for name, operand in tree[2]:
+        right = evaluate_conditions(operand, amount, night)
+        if not _COMPARISONS[name](left, right):
+            return False
+        left = right
+    return True
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def risk_level(triggered_count: int) -> str:
+    if triggered_count >= 3:
+        return 'high'
+    if triggered_count == 2:
+        return 'medium'
+    return 'low'
+
+
+def _local_naive(timestamp) -> Optional[datetime]:
+    """Время транзакции в локальном поясе без tzinfo — как datetime.now() в threerules."""
+    try:
+        ts = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return ts.astimezone().replace(tzinfo=None) if ts.tzinfo is not None else ts
+
+
+class FraudModel:
+    """LightGBM-пайплайн, сохранённый methods/fraud_pipeline/model/trainer.py.
+
+    Признаки строятся тем же FeatureBuilder, что и в predictor.predict, но в
+    одном процессе: микропачке не нужен пул joblib.
+    """
+
+    def __init__(self, model_path: str, state_path: Optional[str] = None):
+        import joblib
+        from methods.fraud_pipeline.config import (
+            DEFAULT_WINDOWS, DEFAULT_LAST_N, DEFAULT_BURST_MINUTES, DEFAULT_BURST_TXN, DEFAULT_BURST_UNIQ_SENDERS,
+        )
+        from methods.fraud_pipeline.state import FeatureState
+
+        bundle = joblib.load(model_path)
+        self.pipeline = bundle["pipeline"]
+        self.threshold = float(bundle.get("decision_threshold", 0.5))
+        self.columns = bundle["cat_cols"] + bundle["num_cols"]
+        fb_conf = bundle.get("feature_builder", {})
+        if fb_conf.get("engine", "pandas") == "polars":
+            try:
+                from methods.fraud_pipeline.features.polars_fb import PolarsFeatureBuilder as FB
+            except Exception:
+                logger.warning("polars is not available, falling back to pandas feature builder",
+                               extra={'component': 'scoring', 'correlation_id': 'system'})
+                from methods.fraud_pipeline.features.pandas_fb import PandasFeatureBuilder as FB
+        else:
+            from methods.fraud_pipeline.features.pandas_fb import PandasFeatureBuilder as FB
+        self.feature_builder = FB(fb_conf.get("time_windows", DEFAULT_WINDOWS),
+                                  fb_conf.get("rolling_last_n", DEFAULT_LAST_N),
+                                  fb_conf.get("burst_T_minutes", DEFAULT_BURST_MINUTES),
+                                  fb_conf.get("burst_min_txn", DEFAULT_BURST_TXN),
+                                  fb_conf.get("burst_min_unique_senders", DEFAULT_BURST_UNIQ_SENDERS))
+        if hasattr(self.feature_builder, 'n_jobs'):
+            self.feature_builder.n_jobs = 1
+        self.state = FeatureState.load(state_path)
+        # FeatureState меняется при каждом transform_with_state
+        self._lock = threading.Lock()
+
+    def score(self, transactions: List[Dict]) -> List[Optional[float]]:
+        """Вероятность мошенничества для каждой транзакции; None — строка отброшена очисткой."""
+        import pandas as pd
+        from methods.fraud_pipeline.config import RAW_COLS
+
+        df_raw = pd.DataFrame([{c: tx.get(c) for c in RAW_COLS} for tx in transactions], columns=RAW_COLS)
+        with self._lock:
+            df_feat = self.feature_builder.transform_with_state(df_raw, state=self.state)
+        proba = self.pipeline.predict_proba(df_feat[self.columns].copy())[:, 1]
+        by_id = dict(zip(df_feat["transaction_id"].astype(str), proba))
+        return [float(by_id[tx['transaction_id']]) if tx['transaction_id'] in by_id else None
+                for tx in transactions]
+
+
+class BatchScorer:
+    """Оценка микропачки: правило за правилом по всей пачке, затем модель.
+
+    history(sender, receiver, received_from) возвращает пары (timestamp, amount)
+    транзакций между sender и receiver, принятых не раньше received_from
+    (epoch), — данные для pattern-правил. Их собирает pattern_inputs() там,
+    где доступно хранилище, поэтому сама score_batch() может выполняться и в
+    другом процессе (см. init_process_scorer/score_in_process).
+    """
+
+    def __init__(self, rules: List[Dict], history: Optional[Callable[[str, str, float], List[Tuple]]] = None,
+                 model: Optional[FraudModel] = None):
+        self.rules = rules
+        self.history = history
+        self.model = model
+
+    def pattern_inputs(self, transactions: List[Dict]) -> Dict[Tuple, List[Tuple]]:
+        """История pattern-правил пачки: (окно в минутах, sender, receiver) -> [(timestamp, amount)]."""
+        inputs = {}
+        for rule in self.rules:
+            if rule['rule_type'] != 'pattern':
+                continue
+            window = rule.get('pattern_window_minutes') or 0
+            received_from = (datetime.now() - timedelta(minutes=window)).timestamp()
+            for tx in transactions:
+                key = (window, tx['sender_account'], tx['receiver_account'])
+                if key not in inputs:
+                    inputs[key] = self.history(key[1], key[2], received_from)
+        return inputs
+
+    def rule_columns(self, transactions: List[Dict],
+                     pattern_inputs: Optional[Dict[Tuple, List[Tuple]]] = None) -> List[List[bool]]:
+        """Столбец результатов по всей пачке для каждого правила, в порядке self.rules."""
+        if pattern_inputs is None:
+            pattern_inputs = self.pattern_inputs(transactions)
+        return [getattr(self, f"_{rule['rule_type']}_column")(rule, transactions, pattern_inputs)
+                for rule in self.rules]
+
+    def score_batch(self, transactions: List[Dict],
+                    pattern_inputs: Optional[Dict[Tuple, List[Tuple]]] = None) -> List[Dict]:
+        """Поля результата для каждой транзакции пачки (для transition('processed'))."""
+        rule_results = [{} for _ in transactions]
+        triggered = [[] for _ in transactions]
+        for rule, column in zip(self.rules, self.rule_columns(transactions, pattern_inputs)):
+            for i, hit in enumerate(column):
+                rule_results[i][rule['name']] = hit
+                if hit:
+                    triggered[i].append(rule['name'])
+
+        scores = self.model.score(transactions) if self.model is not None else [None] * len(transactions)
+        results = []
+        for i, score in enumerate(scores):
+            if score is not None and score >= self.model.threshold:
+                triggered[i].append(MODEL_RULE_NAME)
+            level = risk_level(len(triggered[i]))
+            results.append({
+                'rule_results': rule_results[i],
+                'triggered_rules': triggered[i],
+                'fraud_score': score,
+                'risk_level': level,
+                'alert': bool(triggered[i]),
+                'severity': RISK_SEVERITY[level] if triggered[i] else None,
+            })
+        return results
+
+    @staticmethod
+    def _threshold_column(rule: Dict, transactions: List[Dict], pattern_inputs: Dict) -> List[bool]:
+        operator, number = rule['operator'], rule.get('threshold_value') or 0
+        column = []
+        for tx in transactions:
+            try:
+                column.append(threshold_rule(tx['amount'], operator, number))
+            except Exception:
+                column.append(False)
+        return column
+
+    @staticmethod
+    def _pattern_column(rule: Dict, transactions: List[Dict], pattern_inputs: Dict) -> List[bool]:
+        window = rule.get('pattern_window_minutes') or 0
+        # pattern_rule не зависит от суммы текущей транзакции: одна проверка на пару
+        by_pair = {}
+        column = []
+        for tx in transactions:
+            pair = (tx['sender_account'], tx['receiver_account'])
+            if pair not in by_pair:
+                data = [{'timestamp': ts, 'amount': amount, 'receiver_account': pair[1]}
+                        for timestamp, amount in pattern_inputs.get((window,) + pair, ())
+                        for ts in (_local_naive(timestamp),) if ts is not None]
+                by_pair[pair] = pattern_rule(pair[1], tx['amount'], rule['operator'],
+                                             rule.get('pattern_max_amount') or 0, window, 'minutes',
+                                             rule.get('pattern_max_count') or 0, data)
+            column.append(by_pair[pair])
+        return column
+
+    @staticmethod
+    def _composite_column(rule: Dict, transactions: List[Dict], pattern_inputs: Dict) -> List[bool]:
+        tree = compile_conditions(_conditions_text(rule))
+        column = []
+        for tx in transactions:
+            ts = _local_naive(tx['timestamp'])
+            if ts is None or not is_number(tx['amount']):
+                column.append(False)
+                continue
+            # ночь — с 00:00:00 по 06:00:00 включительно, как в composite_rule
+            night = ts.strftime('%H:%M:%S') <= '06:00:00'
+            column.append(bool(evaluate_conditions(tree, tx['amount'], night)))
+        return column
+
+
+# BatchScorer процесса пула (API_WORKER_BACKEND=process)
+_process_scorer: Optional[BatchScorer] = None
+
+
+def init_process_scorer(rules: List[Dict], model: Optional[FraudModel]):
+    """initializer ProcessPoolExecutor: у каждого процесса свой BatchScorer без хранилища."""
+    global _process_scorer
+    _process_scorer = BatchScorer(rules, model=model)
+
+
+def score_in_process(transactions: List[Dict], pattern_inputs: Dict[Tuple, List[Tuple]]) -> List[Dict]:
+    return _process_scorer.score_batch(transactions, pattern_inputs)
+
+
+class BatchStats:
+    """Размеры и длительности обработанных пачек для /scoring/stats."""
+
+    def __init__(self, window: int = 1024):
+        self.batches_total = 0
+        self.transactions_total = 0
+        self.alerts_total = 0
+        self.failed_batches = 0
+        self.failed_transactions = 0
+        self.max_batch_size = 0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, size: int, latency: float, alerts: int):
+        with self._lock:
+            self.batches_total += 1
+            self.transactions_total += size
+            self.alerts_total += alerts
+            self.max_batch_size = max(self.max_batch_size, size)
+            self._recent.append((size, latency))
+
+    def record_failure(self, size: int):
+        with self._lock:
+            self.failed_batches += 1
+            self.failed_transactions += size
+
+    def completed(self) -> int:
+        """Сколько транзакций воркеры довели до processed/failed — для темпа разбора очереди."""
+        return self.transactions_total + self.failed_transactions
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            recent = list(self._recent)
+            result = {
+                "batches_total": self.batches_total,
+                "transactions_total": self.transactions_total,
+                "alerts_total": self.alerts_total,
+                "failed_batches": self.failed_batches,
+                "failed_transactions": self.failed_transactions,
+                "max_batch_size": self.max_batch_size,
+            }
+        sizes = [size for size, _ in recent]
+        latencies = sorted(latency * 1000 for _, latency in recent)
+        pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 3) if latencies else None
+        result["recent"] = {
+            "batches": len(recent),
+            "avg_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else None,
+            "last_batch_size": sizes[-1] if sizes else None,
+            "latency_ms": {"p50": pick(0.50), "p99": pick(0.99), "max": round(latencies[-1], 3) if latencies else None},
+        }
+        return result
@@ -0,0 +1,204 @@
+"""Очередь обработки, разбитая на шарды по отправителю.
+
+Общая FIFO отдавала соседние транзакции одного отправителя разным воркерам,
+и они оценивались вперемешку. ShardedQueue раскладывает транзакции по
+shards очередям по crc32(sender_account). Воркер берёт шард в аренду
+(take), забирает из него пачку и возвращает шард (release) только после её
+оценки, так что у шарда в каждый момент не больше одного воркера и
+транзакции отправителя проходят строго в порядке приёма. Разные шарды
+разбираются параллельно.
+
+Внутри шарда у каждого отправителя своя FIFO, пачка набирается по кругу —
+по одной транзакции от каждого отправителя: отправитель с тысячами
+транзакций в очереди не задерживает остальных отправителей своего шарда
+дольше, чем на одну транзакцию за круг.
+
+Снаружи это та же очередь, что и queue.Queue: put/put_nowait с общим
+maxsize, qsize, task_done, unfinished_tasks и all_tasks_done.
+"""
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from queue import Full
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class _Shard:
+    __slots__ = ('senders', 'size', 'leased', 'ready', 'enqueued', 'taken', 'peak', 'not_empty')
+
+    def __init__(self, mutex: threading.Lock):
+        # отправитель -> deque[(момент постановки, транзакция)]; порядок ключей — очередь обхода
+        self.senders: 'OrderedDict[str, deque]' = OrderedDict()
+        self.size = 0
+        self.leased = False
+        self.ready = False
+        self.enqueued = 0
+        self.taken = 0
+        self.peak = 0
+        # добор пачки арендатором шарда
+        self.not_empty = threading.Condition(mutex)
+
+
+class ShardedQueue:
+    """shards очередей по ключу key(item) с общим ограничением maxsize."""
+
+    def __init__(self, shards: int, maxsize: int = 0, key: Callable[[Dict], str] = None,
+                 observe_wait: Callable[[float, Dict], None] = None):
+        """observe_wait(секунды, транзакция) вызывается, когда воркер забирает транзакцию."""
+        if shards < 1:
+            raise ValueError("queue needs at least one shard")
+        self.maxsize = maxsize
+        self.key = key or (lambda item: str(item.get('sender_account', '')))
+        self.observe_wait = observe_wait
+        self.mutex = threading.Lock()
+        self.not_full = threading.Condition(self.mutex)
+        self.all_tasks_done = threading.Condition(self.mutex)
+        # есть свободный непустой шард
+        self._available = threading.Condition(self.mutex)
+        self._shards = [_Shard(self.mutex) for _ in range(shards)]
+        self._ready: deque = deque()
+        self._size = 0
+        self.unfinished_tasks = 0
+
+    @property
+    def shards(self) -> int:
+        return len(self._shards)
+
+    def shard_of(self, key: str) -> int:
+        # crc32, а не hash(): номер шарда не меняется между запусками
+        return zlib.crc32(key.encode('utf-8')) % len(self._shards)
+
+    def qsize(self) -> int:
+        with self.mutex:
+            return self._size
+
+    def put(self, item: Dict, block: bool = True, timeout: Optional[float] = None):
+        key = self.key(item)
+        with self.not_full:
+            if self.maxsize > 0:
+                if not block:
+                    if self._size >= self.maxsize:
+                        raise Full
+                else:
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                    while self._size >= self.maxsize:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise Full
+                        self.not_full.wait(remaining)
+            index = self.shard_of(key)
+            shard = self._shards[index]
+            pending = shard.senders.get(key)
+            if pending is None:
+                pending = shard.senders[key] = deque()
+            pending.append((time.monotonic(), item))
+            shard.size += 1
+            shard.enqueued += 1
+            shard.peak = max(shard.peak, shard.size)
+            self._size += 1
+            self.unfinished_tasks += 1
+            if shard.leased:
+                shard.not_empty.notify()
+            elif not shard.ready:
+                shard.ready = True
+                self._ready.append(index)
+                self._available.notify()
+
+    def put_nowait(self, item: Dict):
+        self.put(item, block=False)
+
+    def take(self, max_items: int, timeout: float, max_wait: float = 0.0) -> Tuple[Optional[int], List[Dict]]:
+        """Арендует непустой свободный шард и забирает из него до max_items транзакций.
+
+        Ждёт свободный шард до timeout секунд (иначе (None, [])), затем
+        добирает пачку не дольше max_wait. Шард остаётся за вызывающим до
+        release(номер шарда).
+        """
+        with self.mutex:
+            deadline = time.monotonic() + timeout
+            while not self._ready:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, []
+                self._available.wait(remaining)
+            index = self._ready.popleft()
+            shard = self._shards[index]
+            shard.ready = False
+            shard.leased = True
+            batch = self._pop(shard, max_items)
+            deadline = time.monotonic() + max_wait
+            while len(batch) < max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                shard.not_empty.wait(remaining)
+                batch.extend(self._pop(shard, max_items - len(batch)))
+            return index, batch
+
+    def release(self, index: int):
+        with self.mutex:
+            shard = self._shards[index]
+            shard.leased = False
+            if shard.size and not shard.ready:
+                shard.ready = True
+                self._ready.append(index)
+                self._available.notify()
+
+    def task_done(self):
+        with self.all_tasks_done:
+            unfinished = self.unfinished_tasks - 1
+            if unfinished < 0:
+                raise ValueError('task_done() called too many times')
+            if unfinished == 0:
+                self.all_tasks_done.notify_all()
+            self.unfinished_tasks = unfinished
+
+    def depths(self) -> List[int]:
+        with self.mutex:
+            return [shard.size for shard in self._shards]
+
+    def snapshot(self) -> Dict:
+        """Глубина и поток по шардам и перекос: максимум к среднему (1.0 — поровну)."""
+        with self.mutex:
+            shards = [{"shard": i, "depth": s.size, "senders": len(s.senders), "leased": s.leased,
+                       "enqueued": s.enqueued, "taken": s.taken, "peak_depth": s.peak}
+                      for i, s in enumerate(self._shards)]
+            size = self._size
+        return {
+            "shards": len(shards),
+            "depth": size,
+            "depth_skew": _skew([s["depth"] for s in shards]),
+            "enqueued_skew": _skew([s["enqueued"] for s in shards]),
+            "hottest_shard": max(shards, key=lambda s: (s["depth"], s["enqueued"]))["shard"],
+            "by_shard": shards,
+        }
+
+    def _pop(self, shard: _Shard, limit: int) -> List[Dict]:
+        # по кругу: одна транзакция от отправителя, и он уходит в конец обхода
+        batch = []
+        senders = shard.senders
+        now = time.monotonic()
+        while senders and len(batch) < limit:
+            key, pending = next(iter(senders.items()))
+            enqueued, item = pending.popleft()
+            if pending:
+                senders.move_to_end(key)
+            else:
+                del senders[key]
+            if self.observe_wait is not None:
+                self.observe_wait(now - enqueued, item)
+            batch.append(item)
+        if batch:
+            shard.size -= len(batch)
+            shard.taken += len(batch)
+            self._size -= len(batch)
+            self.not_full.notify(len(batch))
+        return batch
+
+
+def _skew(values: List[int]) -> float:
+    total = sum(values)
+    if not total:
+        return 1.0
+    return round(max(values) * len(values) / total, 3)
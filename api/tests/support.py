@@ -0,0 +1,62 @@
+"""Общее окружение тестов API: модуль api с маленькой очередью и сервер в том же процессе.
+
+Переменные окружения читаются при импорте api, поэтому api импортируется
+только отсюда — один раз на весь прогон тестов.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# очередь меньше импорта в тестах: импорт обязан дождаться места, а не терять транзакции
+QUEUE_SIZE = 40
+os.environ['API_JOURNAL_DIR'] = ''
+os.environ['API_MAX_QUEUE_SIZE'] = str(QUEUE_SIZE)
+os.environ.setdefault('API_LOG_FILE', os.path.join(tempfile.mkdtemp(), 'transaction_service.log'))
+
+# уведомления в Redis тестам не нужны
+with mock.patch('notifications.notification.RedisHandler'):
+    import api  # noqa: E402
+
+
+def make_transaction(**fields) -> dict:
+    suffix = uuid.uuid4().hex[:12].upper()
+    tx = {
+        "transaction_id": f"TXR{suffix}", "correlation_id": f"COR{suffix}",
+        "timestamp": datetime.now().astimezone().isoformat(), "sender_account": "ACC000001",
+        "receiver_account": "ACC000100", "amount": 125.5, "transaction_type": "transfer",
+    }
+    tx.update(fields)
+    return tx
+
+
+class Server:
+    """FraudDetectionAPIHandler на свободном порту в фоновом потоке."""
+
+    def __init__(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), api.FraudDetectionAPIHandler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def request(self, method: str, path: str, body=None, headers=None) -> tuple:
+        conn = HTTPConnection(*self.httpd.server_address, timeout=30)
+        try:
+            if body is not None and not isinstance(body, bytes):
+                body = json.dumps(body)
+            conn.request(method, path, body, {'Content-Type': 'application/json', **(headers or {})})
+            response = conn.getresponse()
+            data = response.read()
+            return response.status, dict(response.getheaders()), json.loads(data) if data else None
+        finally:
+            conn.close()
@@ -0,0 +1,60 @@
+"""Токены источника списываются за транзакции, а не за запрос.
+
+Асинхронный импорт (?async=1) платит за весь список при допуске, NDJSON —
+за каждую разобранную пачку: исчерпав bucket, поток ждёт пополнения, а не
+проходит мимо лимита.
+
+    python -m unittest discover -s api/tests
+"""
+import json
+import time
+import unittest
+import uuid
+from unittest import mock
+
+from support import Server, api, make_transaction
+
+
+class AdmissionCostTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def limited_source(self, rate: float, burst: float) -> str:
+        source = f"test-{uuid.uuid4().hex[:8]}"
+        patcher = mock.patch.dict(api.admission.client_limits, {source: (rate, burst)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return source
+
+    def test_async_import_is_charged_per_transaction(self):
+        source = self.limited_source(rate=0.01, burst=10)
+        headers = {'X-API-Source': source}
+        status, _, body = self.server.request('POST', '/transactions/import-json?async=1',
+                                              [make_transaction() for _ in range(6)], headers)
+        self.assertEqual(status, 202, body)
+        status, _, body = self.server.request('POST', '/transactions/import-json?async=1',
+                                              [make_transaction() for _ in range(6)], headers)
+        self.assertEqual(status, 429, body)
+        self.assertEqual(body['reason'], 'rate_limited')
+
+    def test_ndjson_waits_for_tokens_per_batch(self):
+        source = self.limited_source(rate=50, burst=10)
+        lines = '\n'.join(json.dumps(make_transaction()) for _ in range(60)).encode()
+        started = time.monotonic()
+        with mock.patch.object(api, 'NDJSON_BATCH_SIZE', 10):
+            status, _, body = self.server.request('POST', '/transactions/ingest-ndjson', lines,
+                                                  {'Content-Type': 'application/x-ndjson', 'X-API-Source': source})
+        elapsed = time.monotonic() - started
+        self.assertEqual(status, 207, body)
+        self.assertEqual((body['added_count'], body['failed_count']), (60, 0), body)
+        # 10 токенов в запасе, ещё 50 по 50 в секунду
+        self.assertGreaterEqual(elapsed, 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Ошибка записи журнала: sync() не подтверждает, durable-приём отвечает 503.
+
+    python -m unittest discover -s api/tests
+"""
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from support import Server, api, make_transaction
+import journal as journal_module
+from journal import Journal
+from transaction_store import TransactionStore
+
+
+class JournalWriteFailureTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.store = TransactionStore()
+        self.journal = Journal(directory, snapshot_interval=3600)
+        self.journal.open(self.store)
+        self.addCleanup(self.journal.close)
+
+    def test_failed_write_is_not_synced_until_snapshot(self):
+        with mock.patch.object(journal_module, '_fsync', side_effect=OSError(5, 'Input/output error')), \
+                mock.patch.object(self.journal, '_maybe_compact'):
+            self.store.add(make_transaction(), 'queued')
+            self.assertFalse(self.journal.sync(timeout=5))
+            self.store.add(make_transaction(), 'queued')
+            # за битым кадром журнал при восстановлении не прочитается
+            self.assertFalse(self.journal.sync(timeout=5))
+        self.assertTrue(self.journal.snapshot()['damaged'])
+
+        self.journal.compact()
+        self.store.add(make_transaction(), 'queued')
+        self.assertTrue(self.journal.sync(timeout=5))
+        self.assertFalse(self.journal.snapshot()['damaged'])
+
+
+class JournalUnavailableResponseTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def test_transaction_is_not_acknowledged(self):
+        with mock.patch.object(api, 'journal_sync', return_value=False):
+            status, _, body = self.server.request('POST', '/transactions', make_transaction())
+        self.assertEqual(status, 503, body)
+
+    def test_import_is_not_acknowledged(self):
+        with mock.patch.object(api, 'journal_sync', return_value=False):
+            status, _, body = self.server.request('POST', '/transactions/import-json',
+                                                  [make_transaction() for _ in range(3)])
+        self.assertEqual(status, 503, body)
+
+
+if __name__ == '__main__':
+    unittest.main()
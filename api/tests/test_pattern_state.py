@@ -0,0 +1,57 @@
+"""Память PatternState ограничена числом отметок, а не только retention.
+
+    python -m unittest discover -s api/tests
+"""
+import unittest
+
+import support  # noqa: F401  путь к модулям api/
+from pattern_state import PatternState
+
+NOW = 1_700_000_000.0
+
+
+def transaction(sender: str, receiver: str, amount: float = 100.0, ts: float = NOW) -> dict:
+    return {"sender_account": sender, "receiver_account": receiver, "amount": amount, "timestamp": ts}
+
+
+class PatternStateLimitsTest(unittest.TestCase):
+    def test_series_is_capped_per_key(self):
+        state = PatternState(3600, clock=lambda: NOW, max_entries_per_key=5)
+        for i in range(8):
+            state.record(transaction('A', 'B', ts=NOW - 8 + i))
+        # предикат, построенный до и после переполнения, видит те же 5 последних
+        self.assertEqual(state.count(('pair', 'A', 'B'), '>', 0, 3600), 5)
+        state.record(transaction('A', 'B', amount=50))
+        self.assertEqual(state.count(('pair', 'A', 'B'), '>', 0, 3600), 5)
+        self.assertEqual(state.count(('pair', 'A', 'B'), '<', 60, 3600), 1)
+        snapshot = state.snapshot()
+        self.assertEqual(snapshot['entries'], 15)
+        self.assertEqual(snapshot['trimmed'], 12)
+        self.assertEqual(snapshot['max_entries_per_key'], 5)
+
+    def test_least_recently_recorded_keys_are_evicted(self):
+        state = PatternState(3600, clock=lambda: NOW, max_entries=6)
+        state.record(transaction('A', 'B'))
+        state.count(('pair', 'A', 'B'), '>', 0, 3600)
+        state.record(transaction('C', 'D'))
+        self.assertEqual(state.snapshot()['entries'], 6)
+
+        state.record(transaction('C', 'E'))
+        # выброшены ключи A-B, A и B, и ряды предиката для них тоже
+        self.assertEqual(state.count(('pair', 'A', 'B'), '>', 0, 3600), 0)
+        self.assertEqual(state.count(('sender', 'C'), '>', 0, 3600), 2)
+        snapshot = state.snapshot()
+        self.assertEqual((snapshot['entries'], snapshot['evicted_keys']), (6, 3))
+        self.assertEqual(snapshot['predicates'][0]['keys'], 5)
+
+    def test_expiry_releases_entries(self):
+        clock = [NOW]
+        state = PatternState(60, sweep_interval=0, clock=lambda: clock[0], max_entries=100)
+        state.record(transaction('A', 'B'))
+        clock[0] += 120
+        state.record(transaction('C', 'D', ts=clock[0]))
+        self.assertEqual(state.snapshot()['entries'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
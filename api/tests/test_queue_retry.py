@@ -0,0 +1,109 @@
+"""Транзакции, которые не влезли в очередь, и импорт больше свободного места в ней.
+
+После 429 (или ошибки "processing queue full" в импорте) запись остаётся в
+хранилище как queue_failed, а id — в фильтре дубликатов; повтор с тем же
+transaction_id должен быть принят, а не отклонён как дубликат, и попасть в
+историю pattern_state один раз. Импорт (и JSON, и NDJSON) больше свободного
+места ждёт воркеров и ничего не теряет.
+
+    python -m unittest discover -s api/tests
+"""
+import json
+import unittest
+import uuid
+from queue import Full
+from unittest import mock
+
+from support import QUEUE_SIZE, Server, api, make_transaction
+
+
+class QueueFullRetryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def test_retry_after_429_is_accepted(self):
+        tx = make_transaction()
+        with mock.patch.object(api.processing_queue, 'put_nowait', side_effect=Full):
+            status, headers, _ = self.server.request('POST', '/transactions', tx)
+        self.assertEqual(status, 429)
+        self.assertIn('Retry-After', headers)
+        self.assertEqual(api.transaction_store.status_of(tx['transaction_id']), 'queue_failed')
+
+        status, _, body = self.server.request('POST', '/transactions', tx)
+        self.assertEqual(status, 202, body)
+        self.assertNotEqual(api.transaction_store.status_of(tx['transaction_id']), 'queue_failed')
+
+    def test_import_retry_after_queue_full_is_accepted(self):
+        tx = make_transaction()
+        with mock.patch.object(api.processing_queue, 'put', side_effect=Full):
+            added, errors = api.import_transactions([dict(tx)], 'test-import')
+        self.assertEqual(added, 0)
+        self.assertEqual(errors, [(0, {'transaction': tx['transaction_id'], 'error': "processing queue full"})])
+
+        added, errors = api.import_transactions([dict(tx)], 'test-import')
+        self.assertEqual((added, errors), (1, []))
+
+    def test_retry_after_429_is_counted_once_in_pattern_state(self):
+        tx = make_transaction(sender_account=f"ACC{uuid.uuid4().hex[:6].upper()}")
+        key = ('pair', tx['sender_account'], tx['receiver_account'])
+        with mock.patch.object(api.processing_queue, 'put_nowait', side_effect=Full):
+            status, _, _ = self.server.request('POST', '/transactions', tx)
+        self.assertEqual(status, 429)
+        self.assertEqual(api.pattern_state.count(key, '>=', 0, 3600), 0)
+
+        status, _, body = self.server.request('POST', '/transactions', tx)
+        self.assertEqual(status, 202, body)
+        self.assertEqual(api.pattern_state.count(key, '>=', 0, 3600), 1)
+
+    def test_import_retry_is_counted_once_in_pattern_state(self):
+        tx = make_transaction(sender_account=f"ACC{uuid.uuid4().hex[:6].upper()}")
+        key = ('pair', tx['sender_account'], tx['receiver_account'])
+        with mock.patch.object(api.processing_queue, 'put', side_effect=Full):
+            api.import_transactions([dict(tx)], 'test-import')
+        api.import_transactions([dict(tx)], 'test-import')
+        self.assertEqual(api.pattern_state.count(key, '>=', 0, 3600), 1)
+
+    def test_accepted_transaction_is_still_a_duplicate(self):
+        tx = make_transaction()
+        status, _, _ = self.server.request('POST', '/transactions', tx)
+        self.assertEqual(status, 202)
+        status, _, body = self.server.request('POST', '/transactions', tx)
+        self.assertEqual(status, 400, body)
+
+    def test_duplicate_in_store_is_found_despite_filter_negative(self):
+        # переполненный фильтр уже ротировал и забыл id, но запись ещё в хранилище
+        tx = make_transaction()
+        status, _, _ = self.server.request('POST', '/transactions', tx)
+        self.assertEqual(status, 202)
+        with mock.patch.object(api.duplicate_filter, 'check', return_value=False):
+            status, _, body = self.server.request('POST', '/transactions', tx)
+        self.assertEqual(status, 400, body)
+
+    def test_import_larger_than_queue_loses_nothing(self):
+        transactions = [make_transaction() for _ in range(QUEUE_SIZE * 8)]
+        status, _, body = self.server.request('POST', '/transactions/import-json', transactions)
+        self.assertEqual(status, 207, body)
+        self.assertEqual((body['added_count'], body['failed_count']), (len(transactions), 0), body)
+        statuses = {api.transaction_store.status_of(tx['transaction_id']) for tx in transactions}
+        self.assertNotIn('queue_failed', statuses)
+
+    def test_ndjson_larger_than_queue_waits_for_room(self):
+        transactions = [make_transaction() for _ in range(QUEUE_SIZE * 8)]
+        lines = '\n'.join(json.dumps(tx) for tx in transactions).encode()
+        with mock.patch.object(api, '_wait_for_queue_room', wraps=api._wait_for_queue_room) as wait:
+            status, _, body = self.server.request('POST', '/transactions/ingest-ndjson', lines,
+                                                  {'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(status, 207, body)
+        self.assertEqual((body['added_count'], body['failed_count']), (len(transactions), 0), body)
+        self.assertGreater(wait.call_count, 1)
+        statuses = {api.transaction_store.status_of(tx['transaction_id']) for tx in transactions}
+        self.assertNotIn('queue_failed', statuses)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Проверка правил из запроса: composite-условия без eval и числовые поля в границах.
+
+    python -m unittest discover -s api/tests
+"""
+import unittest
+
+from support import Server, make_transaction
+from scoring import compile_conditions, evaluate_conditions, validate_rules
+
+
+class CompositeConditionsTest(unittest.TestCase):
+    def test_injection_is_rejected(self):
+        for conditions in ("__import__('os').system('id')", "amount > 5 or open('/etc/passwd')",
+                           "amount.__class__", "amount > 5; amount", "(lambda: 1)()", "amount > 5)",
+                           "amount > 5e3", "amount >"):
+            with self.subTest(conditions=conditions), self.assertRaises(ValueError):
+                compile_conditions(conditions)
+
+    def test_composite_evaluates(self):
+        cases = [
+            ("(amount > 5000) AND (nighttime)", 6000, True, True),
+            ("(amount > 5000) AND (nighttime)", 6000, False, False),
+            ("(amount > 5000) AND (nighttime)", 100, True, False),
+            ("NOT daytime OR amount <= 10", 10, False, True),
+            ("NOT daytime OR amount <= 10", 11, False, False),
+            ("1 < amount < 10", 5, False, True),
+            ("1 < amount < 10", 10, False, False),
+            ("amount == 5 000", 5000, False, True),
+        ]
+        for conditions, amount, night, expected in cases:
+            with self.subTest(conditions=conditions, amount=amount, night=night):
+                self.assertEqual(bool(evaluate_conditions(compile_conditions(conditions), amount, night)), expected)
+
+
+class RuleNumbersTest(unittest.TestCase):
+    def test_invalid_numbers_are_rejected(self):
+        for field, value in (('threshold_value', '100'), ('threshold_value', float('inf')),
+                             ('threshold_value', float('nan')), ('threshold_value', -1),
+                             ('threshold_value', True)):
+            with self.subTest(field=field, value=value), self.assertRaises(ValueError):
+                validate_rules([{"rule_type": "threshold", "operator": ">", field: value}])
+        for field, value in (('pattern_window_minutes', 10 ** 20), ('pattern_window_minutes', '60'),
+                             ('pattern_max_count', 1e300), ('pattern_max_amount', -5)):
+            with self.subTest(field=field, value=value), self.assertRaises(ValueError):
+                validate_rules([{"rule_type": "pattern", "operator": ">", field: value}])
+
+    def test_valid_numbers_pass(self):
+        rules = validate_rules([
+            {"rule_type": "threshold", "operator": ">", "threshold_value": 10000},
+            {"rule_type": "pattern", "operator": ">", "pattern_window_minutes": 60, "pattern_max_count": 3,
+             "pattern_max_amount": 5000.5},
+            {"rule_type": "pattern", "operator": ">", "pattern_window_minutes": None},
+        ])
+        self.assertEqual([rule['name'] for rule in rules], ['threshold_0', 'pattern_1', 'pattern_2'])
+
+    def test_invalid_numbers_are_a_bad_request(self):
+        server = Server()
+        self.addCleanup(server.close)
+        for rule in ({"rule_type": "threshold", "operator": ">", "threshold_value": "100"},
+                     {"rule_type": "pattern", "operator": ">", "pattern_window_minutes": 1e300}):
+            with self.subTest(rule=rule):
+                status, _, body = server.request('POST', '/rules/evaluate-batch',
+                                                 {"transactions": [make_transaction()], "rules": [rule]})
+                self.assertEqual(status, 400, body)
+
+
+if __name__ == '__main__':
+    unittest.main()
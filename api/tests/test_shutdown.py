@@ -0,0 +1,34 @@
+"""Порядок остановки: сервер, затем журнал, и только потом конвейер логов.
+
+    python -m unittest discover -s api/tests
+"""
+import unittest
+from unittest import mock
+
+from support import api
+
+
+class ShutdownOrderTest(unittest.TestCase):
+    def test_drain_only_stops_server(self):
+        steps = mock.Mock()
+        with mock.patch.object(api, '_drain'), \
+                mock.patch.object(api, 'stop_server', steps.stop_server), \
+                mock.patch.object(api, 'journal', steps.journal), \
+                mock.patch.object(api, 'log_pipeline', steps.log_pipeline), \
+                mock.patch.object(api, 'tracer', steps.tracer):
+            api.drain_and_stop()
+        # обработчики ещё могут писать в журнал и лог, пока сервер не вышел из цикла
+        self.assertEqual(steps.mock_calls, [mock.call.stop_server()])
+
+    def test_log_pipeline_stops_after_journal_close(self):
+        steps = mock.Mock()
+        with mock.patch.object(api, 'journal', steps.journal), \
+                mock.patch.object(api, 'log_pipeline', steps.log_pipeline), \
+                mock.patch.object(api, 'tracer', steps.tracer):
+            api.finish_shutdown()
+        self.assertEqual(steps.mock_calls, [mock.call.tracer.stop(), mock.call.journal.close(),
+                                            mock.call.log_pipeline.stop()])
+
+
+if __name__ == '__main__':
+    unittest.main()
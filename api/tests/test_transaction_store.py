@@ -0,0 +1,48 @@
+"""Вытеснение из TransactionStore: не оценённые записи (PENDING_STATUSES) остаются.
+
+    python -m unittest discover -s api/tests
+"""
+import unittest
+
+from support import make_transaction
+from transaction_store import TransactionStore
+
+
+class EvictionTest(unittest.TestCase):
+    def test_pending_survive_size_eviction(self):
+        store = TransactionStore(max_size=5)
+        pending = [make_transaction() for _ in range(5)]
+        for tx in pending:
+            store.add(tx, 'queued')
+        for _ in range(5):
+            store.add(make_transaction(), 'processed')
+        self.assertEqual(len(store), 5)
+        self.assertEqual([store.status_of(tx['transaction_id']) for tx in pending], ['queued'] * 5)
+        self.assertEqual(store.evicted_count, 5)
+
+    def test_pending_over_limit_stay_until_finished(self):
+        store = TransactionStore(max_size=2)
+        pending = [make_transaction() for _ in range(4)]
+        for tx in pending:
+            store.add(tx, 'processing')
+        self.assertEqual((len(store), store.pending_over_limit), (4, 2))
+
+        for tx in pending[:3]:
+            store.transition(tx['transaction_id'], 'processed')
+        store.add(make_transaction(), 'received')
+        # сверх лимита три записи, и все три теперь оценены — вытесняются они, не оценённые остаются
+        self.assertEqual([tx['transaction_id'] in store for tx in pending], [False, False, False, True])
+        self.assertEqual((len(store), store.pending_over_limit), (2, 0))
+
+    def test_pending_survive_ttl_eviction(self):
+        store = TransactionStore(ttl_seconds=0)
+        pending, finished = make_transaction(), make_transaction()
+        store.add(pending, 'queued')
+        store.add(finished, 'failed')
+        store.evict_expired()
+        self.assertIn(pending['transaction_id'], store)
+        self.assertNotIn(finished['transaction_id'], store)
+
+
+if __name__ == '__main__':
+    unittest.main()
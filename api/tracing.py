@@ -0,0 +1,179 @@
+"""Поэтапная трассировка приёма и оценки транзакций.
+
+received_at/queued_at/completed_at в хранилище — настенное время в ISO и
+показывают только момент смены статуса. Tracer записывает отрезки
+монотонных часов (time.perf_counter) по этапам: parse, validate, enqueue и
+respond — в потоке запроса, queue_wait и score — в воркере. Отрезок
+привязан к correlation_id: запроса для этапов приёма, транзакции для
+этапов очереди; у транзакций из импорта это «<запрос>-<номер>», поэтому
+поиск по correlation_id запроса находит и их.
+
+Отрезки лежат в кольцевом буфере на capacity штук: запись — добавление
+кортежа в deque, старые вытесняются. query() собирает трассы и сводку по
+этапам (p50/p95/p99), так что видно, куда уходит хвост задержки, без
+внешнего коллектора. Если задан export_path, отрезки раз в export_interval
+секунд дописываются туда строками NDJSON.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import json_codec
+
+logger = logging.getLogger()
+
+STAGES = ('parse', 'validate', 'enqueue', 'respond', 'queue_wait', 'score')
+
+
+class Tracer:
+    """Кольцевой буфер отрезков (correlation_id, этап, начало, длительность)."""
+
+    def __init__(self, capacity: int, export_path: Optional[str] = None, export_interval: float = 1.0):
+        self.capacity = capacity
+        self.enabled = capacity > 0
+        self.export_path = export_path or None
+        self.export_interval = export_interval
+        self.recorded = 0
+        self.exported = 0
+        self._spans: deque = deque(maxlen=max(capacity, 1))
+        # неотправленные в файл отрезки; если писатель отстал, старые теряются
+        self._export: Optional[deque] = deque(maxlen=max(capacity, 1)) if self.export_path and self.enabled else None
+        # точка отсчёта для перевода perf_counter в настенное время
+        self._origin = (time.time(), time.perf_counter())
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._exporter = None
+
+    def record(self, correlation_id: Optional[str], stage: str, started: float, duration: float):
+        """started — time.perf_counter() начала этапа, duration — секунды."""
+        if not self.enabled or correlation_id is None:
+            return
+        span = (correlation_id, stage, started, duration)
+        with self._lock:
+            self._spans.append(span)
+            self.recorded += 1
+            if self._export is not None:
+                self._export.append(span)
+
+    @contextmanager
+    def span(self, correlation_id: Optional[str], stage: str):
+        if not self.enabled or correlation_id is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(correlation_id, stage, started, time.perf_counter() - started)
+
+    def query(self, correlation_id: Optional[str] = None, stage: Optional[str] = None,
+              limit: int = 20) -> Dict:
+        """Последние limit трасс (новые первыми) и сводка по этапам отобранных отрезков."""
+        with self._lock:
+            spans = list(self._spans)
+        if correlation_id:
+            prefix = correlation_id + '-'
+            spans = [s for s in spans if s[0] == correlation_id or s[0].startswith(prefix)]
+        if stage:
+            spans = [s for s in spans if s[1] == stage]
+        traces: Dict[str, List[tuple]] = {}
+        for span in reversed(spans):
+            trace = traces.get(span[0])
+            if trace is None:
+                if len(traces) >= limit:
+                    continue
+                trace = traces[span[0]] = []
+            trace.append(span)
+        return {
+            "spans": len(spans),
+            "summary": self._summary(spans),
+            "traces": [self._trace(cid, sorted(trace, key=lambda s: s[2])) for cid, trace in traces.items()],
+        }
+
+    @property
+    def buffered(self) -> int:
+        with self._lock:
+            return len(self._spans) if self.enabled else 0
+
+    def snapshot(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "capacity": self.capacity,
+            "buffered": self.buffered,
+            "recorded": self.recorded,
+            "export_path": self.export_path,
+            "exported": self.exported,
+        }
+
+    def start_export(self):
+        if self._export is None:
+            return
+        def run():
+            while not self._stop.wait(self.export_interval):
+                self.flush()
+        self._exporter = threading.Thread(target=run, daemon=True, name="TraceExporter")
+        self._exporter.start()
+
+    def flush(self):
+        """Дописывает накопленные отрезки в export_path."""
+        if self._export is None:
+            return
+        with self._lock:
+            spans = list(self._export)
+            self._export.clear()
+        if not spans:
+            return
+        try:
+            with open(self.export_path, 'ab') as f:
+                f.write(b''.join(json_codec.dumps(self._span(span)) + b'\n' for span in spans))
+            self.exported += len(spans)
+        except OSError as e:
+            logger.error(f"Failed to export {len(spans)} trace spans to {self.export_path}: {str(e)}",
+                         extra={'component': 'tracing', 'correlation_id': 'system'})
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def _wall(self, started: float) -> str:
+        wall = self._origin[0] + (started - self._origin[1])
+        return datetime.fromtimestamp(wall, timezone.utc).isoformat(timespec='microseconds')
+
+    def _span(self, span: tuple) -> Dict:
+        correlation_id, stage, started, duration = span
+        return {"correlation_id": correlation_id, "stage": stage, "start": self._wall(started),
+                "duration_ms": round(duration * 1000, 3)}
+
+    def _trace(self, correlation_id: str, spans: List[tuple]) -> Dict:
+        first = spans[0][2]
+        return {
+            "correlation_id": correlation_id,
+            "start": self._wall(first),
+            "total_ms": round((max(s[2] + s[3] for s in spans) - first) * 1000, 3),
+            "spans": [{"stage": stage, "offset_ms": round((started - first) * 1000, 3),
+                       "duration_ms": round(duration * 1000, 3)}
+                      for _, stage, started, duration in spans],
+        }
+
+    @staticmethod
+    def _summary(spans: List[tuple]) -> Dict:
+        by_stage: Dict[str, List[float]] = {}
+        for _, stage, _, duration in spans:
+            by_stage.setdefault(stage, []).append(duration)
+        summary = {}
+        for stage in sorted(by_stage, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+            durations = sorted(by_stage[stage])
+            n = len(durations)
+            summary[stage] = {
+                "count": n,
+                "total_ms": round(sum(durations) * 1000, 3),
+                # ближайший ранг
+                **{f"p{q}_ms": round(durations[min(n - 1, max(0, -(-n * q // 100) - 1))] * 1000, 3)
+                   for q in (50, 95, 99)},
+                "max_ms": round(durations[-1] * 1000, 3),
+            }
+        return summary
@@ -0,0 +1,833 @@
+"""Ограниченное in-memory хранилище транзакций API.
+
+Каждая транзакция хранится как запись со __slots__ вместо словаря: имена полей
+не повторяются в каждой записи, категориальные строки интернируются, а
+отметки времени статусов лежат как float (epoch) и превращаются в ISO-строки
+только при выдаче. Размер хранилища ограничен max_size, записи старше
+ttl_seconds вытесняются — кроме ещё не оценённых (PENDING_STATUSES): они
+остаются и сверх max_size, пока воркер не доведёт их до конечного статуса,
+а их число сверх лимита видно в pending_over_limit; все операции защищены одной блокировкой, так как
+хранилище меняют и обработчики запросов, и воркеры.
+
+Каждая запись получает возрастающий seq в порядке приёма (received_at), а
+вторичные индексы (все записи, по статусу, по отправителю/получателю) — это
+отсортированные списки seq. Страница выборки берётся с «нового» конца индекса,
+поэтому её стоимость порядка размера страницы, а не всего хранилища.
+page() продолжает обход с курсора (received_at, transaction_id) последней
+выданной записи: позиция в индексе находится за O(log n), и вставки между
+страницами не сдвигают уже выданные записи.
+
+Статус меняется только через add()/transition(): они ставят отметку времени
+перехода и под той же блокировкой обновляют индекс статусов, длины которого
+и есть счётчики по статусам, а также накопительные счётчики переходов.
+
+Каждое изменение — add() и любой transition() — получает следующий номер
+изменения change_seq, общий на хранилище; у записи хранится номер её
+последнего изменения, а индекс номеров изменений даёт записи, изменённые
+после since, в порядке изменений (changes()/iter_changes()). change_seq
+хранилища — верхняя отметка (high-water mark): выборка since=H увидит всё,
+что изменится после неё. Вытеснение изменением не считается.
+
+Если задан journal (см. journal.py), add() и transition() под той же
+блокировкой добавляют в него кадр изменения вместе с его change_seq;
+restore_rows()/replay() восстанавливают хранилище из снимка и журнала без
+счётчиков и вытеснения, finish_restore() достраивает индекс изменений и
+вытесняет лишнее уже после восстановления.
+"""
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+TRANSACTION_FIELDS = (
+    'transaction_id', 'correlation_id', 'timestamp', 'sender_account', 'receiver_account',
+    'amount', 'transaction_type', 'merchant_category', 'location', 'device_used', 'is_fraud',
+    'fraud_type', 'time_since_last_transaction', 'spending_deviation_score', 'velocity_score',
+    'geo_anomaly_score', 'payment_channel', 'ip_address', 'device_hash',
+)
+STATUS_FIELDS = ('status', 'error', 'queue_position')
+TIMESTAMP_FIELDS = ('received_at', 'queued_at', 'processed_at', 'completed_at')
+# транзакция ещё не оценена: не вытесняется и снова встаёт в очередь после перезапуска
+PENDING_STATUSES = ('received', 'queued', 'processing')
+# какую отметку времени ставит переход в статус
+STATUS_TIMESTAMPS = {
+    'received': 'received_at',
+    'queued': 'queued_at',
+    'processing': 'processed_at',
+    'processed': 'completed_at',
+}
+INTERNED_FIELDS = frozenset({
+    'sender_account', 'receiver_account', 'transaction_type', 'merchant_category',
+    'location', 'device_used', 'fraud_type', 'payment_channel', 'status',
+})
+_SLOT_NAMES = frozenset(TRANSACTION_FIELDS + STATUS_FIELDS + TIMESTAMP_FIELDS)
+_TIMESTAMP_NAMES = frozenset(TIMESTAMP_FIELDS)
+_PROJECTED_NAMES = _SLOT_NAMES | {'change_seq'}
+_MISSING = object()
+
+
+class TransactionRecord:
+    """Компактная запись транзакции; отсутствующее поле — незаданный слот."""
+    __slots__ = TRANSACTION_FIELDS + STATUS_FIELDS + TIMESTAMP_FIELDS + ('extra', 'seq', 'change_seq')
+
+    def set(self, name: str, value):
+        if name in INTERNED_FIELDS and type(value) is str:
+            value = sys.intern(value)
+        if name in _SLOT_NAMES:
+            setattr(self, name, value)
+        else:
+            extra = getattr(self, 'extra', None)
+            if extra is None:
+                extra = self.extra = {}
+            extra[name] = value
+
+    def data(self) -> Dict:
+        """Поля транзакции без статуса и отметок времени — как она пришла в API."""
+        result = {}
+        for name in TRANSACTION_FIELDS:
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                result[name] = value
+        extra = getattr(self, 'extra', None)
+        if extra:
+            result.update(extra)
+        return result
+
+    def project(self, fields: Tuple[str, ...]) -> Dict:
+        """Только поля fields; отсутствующее — None, отметки времени — ISO-строки."""
+        result = {}
+        extra = getattr(self, 'extra', None) or {}
+        for name in fields:
+            if name in _PROJECTED_NAMES:
+                value = getattr(self, name, None)
+                if value is not None and name in _TIMESTAMP_NAMES:
+                    value = datetime.fromtimestamp(value).isoformat()
+            else:
+                value = extra.get(name)
+            result[name] = value
+        return result
+
+    def to_dict(self) -> Dict:
+        result = {}
+        for name in TRANSACTION_FIELDS + STATUS_FIELDS:
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                result[name] = value
+        for name in TIMESTAMP_FIELDS:
+            value = getattr(self, name, None)
+            if value is not None:
+                result[name] = datetime.fromtimestamp(value).isoformat()
+        extra = getattr(self, 'extra', None)
+        if extra:
+            result.update(extra)
+        change_seq = getattr(self, 'change_seq', None)
+        if change_seq is not None:
+            result['change_seq'] = change_seq
+        return result
+
+
+# порядок полей в строке снимка: (маска, seq, поля..., extra, change_seq);
+# change_seq — последним, чтобы строки снимков без него дополнялись None
+ROW_SLOTS = ('seq',) + TRANSACTION_FIELDS + STATUS_FIELDS + TIMESTAMP_FIELDS + ('extra', 'change_seq')
+_ROW_LENGTH = len(ROW_SLOTS) + 1
+
+
+def _compile_row_codec() -> Tuple[Callable, Callable]:
+    """Линейные функции запись -> кортеж и обратно для снимков журнала.
+
+    Отсутствующий слот в кортеже — None; бит маски отличает от него поле,
+    которое есть и равно None. Строки категорий при загрузке интернируются.
+    """
+    dump = ['def dump_row(r):', '    mask = 0']
+    load = ['def load_row(row):', '    r = _Record()', f'    mask, {", ".join(f"v{i}" for i in range(len(ROW_SLOTS)))} = row']
+    for i, name in enumerate(ROW_SLOTS):
+        dump += [f'    v{i} = getattr(r, {name!r}, _MISSING)',
+                 f'    if v{i} is _MISSING:',
+                 f'        v{i} = None',
+                 f'    elif v{i} is None:',
+                 f'        mask |= {1 << i}']
+        value = f'_intern(v{i}) if type(v{i}) is str else v{i}' if name in INTERNED_FIELDS else f'v{i}'
+        load += [f'    if v{i} is not None or mask & {1 << i}:',
+                 f'        r.{name} = {value}']
+    # extra меняется под блокировкой хранилища, а снимок сериализуется уже без неё
+    extra = ROW_SLOTS.index('extra')
+    dump.append(f'    if v{extra} is not None:')
+    dump.append(f'        v{extra} = dict(v{extra})')
+    dump.append(f'    return (mask, {", ".join(f"v{i}" for i in range(len(ROW_SLOTS)))})')
+    load.append('    return r')
+    namespace = {'_MISSING': _MISSING, '_Record': TransactionRecord, '_intern': sys.intern}
+    exec(compile('\n'.join(dump + load) + '\n', '<transaction-row-codec>', 'exec'), namespace)
+    return namespace['dump_row'], namespace['load_row']
+
+
+_dump_row, _load_row = _compile_row_codec()
+
+
+class SeqIndex:
+    """Отсортированный список seq-номеров, разбитый на блоки (как SortedList).
+
+    Вставка и удаление стоят O(log n + LOAD), выборка страницы с конца —
+    O(число блоков + размер страницы) без копирования всего индекса.
+    """
+    LOAD = 512
+
+    def __init__(self):
+        self._buckets: List[List[int]] = []
+        self._maxes: List[int] = []
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def first(self) -> Optional[int]:
+        return self._buckets[0][0] if self._buckets else None
+
+    def add(self, seq: int):
+        if not self._buckets:
+            self._buckets.append([seq])
+            self._maxes.append(seq)
+        else:
+            i = bisect_left(self._maxes, seq)
+            if i == len(self._maxes):
+                i -= 1
+                self._buckets[i].append(seq)
+                self._maxes[i] = seq
+            else:
+                insort(self._buckets[i], seq)
+            bucket = self._buckets[i]
+            if len(bucket) > 2 * self.LOAD:
+                self._buckets[i:i + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+                self._maxes[i:i + 1] = [bucket[self.LOAD - 1], bucket[-1]]
+        self._len += 1
+
+    def extend(self, seqs: List[int]):
+        """Добавляет возрастающие seq; если все они больше имеющихся — без поиска, блоками."""
+        if not seqs:
+            return
+        if self._maxes and seqs[0] <= self._maxes[-1]:
+            for seq in seqs:
+                self.add(seq)
+            return
+        start = 0
+        if self._buckets and len(self._buckets[-1]) < self.LOAD:
+            start = self.LOAD - len(self._buckets[-1])
+            self._buckets[-1].extend(seqs[:start])
+            self._maxes[-1] = self._buckets[-1][-1]
+        for i in range(start, len(seqs), self.LOAD):
+            bucket = seqs[i:i + self.LOAD]
+            self._buckets.append(bucket)
+            self._maxes.append(bucket[-1])
+        self._len += len(seqs)
+
+    def discard(self, seq: int):
+        i = bisect_left(self._maxes, seq)
+        if i == len(self._maxes):
+            return
+        bucket = self._buckets[i]
+        j = bisect_left(bucket, seq)
+        if j == len(bucket) or bucket[j] != seq:
+            return
+        del bucket[j]
+        self._len -= 1
+        if bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+
+    def bisect_key(self, value, key: Callable[[int], float], right: bool = False) -> int:
+        """Первый seq, у которого key(seq) >= value (> при right); key монотонен по seq."""
+        search = bisect_right if right else bisect_left
+        i = search(self._maxes, value, key=key)
+        if i == len(self._maxes):
+            return self._maxes[-1] + 1 if self._maxes else 0
+        bucket = self._buckets[i]
+        return bucket[search(bucket, value, key=key)]
+
+    def count_range(self, lo: int, hi: int) -> int:
+        """Число seq в полуинтервале [lo, hi)."""
+        if lo <= (self.first() or 0) and (not self._maxes or hi > self._maxes[-1]):
+            return self._len
+        return sum(bisect_left(b, hi) - bisect_left(b, lo) for b in self._buckets
+                   if b[-1] >= lo and b[0] < hi)
+
+    def iter_desc(self, lo: int, hi: int, offset: int = 0) -> Iterator[int]:
+        """seq из [lo, hi) от больших к меньшим, пропуская первые offset."""
+        for i in range(bisect_left(self._maxes, hi), -1, -1):
+            if i >= len(self._buckets):
+                continue
+            bucket = self._buckets[i]
+            if bucket[-1] < lo:
+                break
+            start, end = bisect_left(bucket, lo), bisect_left(bucket, hi)
+            if offset >= end - start:
+                offset -= end - start
+                continue
+            for j in range(end - 1 - offset, start - 1, -1):
+                yield bucket[j]
+            offset = 0
+
+    def iter_asc(self, lo: int, hi: int) -> Iterator[int]:
+        """seq из [lo, hi) от меньших к большим."""
+        for i in range(bisect_left(self._maxes, lo), len(self._buckets)):
+            bucket = self._buckets[i]
+            if bucket[0] >= hi:
+                break
+            yield from bucket[bisect_left(bucket, lo):bisect_left(bucket, hi)]
+
+
+class TransactionStore:
+    """Потокобезопасное хранилище с ограничением по размеру и возрасту записей.
+
+    index_accounts включает индексы по sender_account/receiver_account.
+    """
+
+    def __init__(self, max_size: int = 1_000_000, ttl_seconds: float = 24 * 3600,
+                 index_accounts: bool = True):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.index_accounts = index_accounts
+        self.evicted_count = 0
+        self.pending_over_limit = 0
+        self._records: Dict[str, TransactionRecord] = {}
+        self._by_seq: Dict[int, TransactionRecord] = {}
+        self._all = SeqIndex()
+        self._by_status: Dict[str, SeqIndex] = {}
+        self._by_sender: Dict[str, SeqIndex] = {}
+        self._by_receiver: Dict[str, SeqIndex] = {}
+        self._transitions: Dict[str, int] = {}
+        self._next_seq = 0
+        # номер последнего изменения -> запись и все выданные номера по возрастанию:
+        # новый номер дописывается в конец, а номера перезаписанных изменений не
+        # удаляются по одному, а вычищаются скопом в _compact_changes();
+        # None, пока идёт восстановление
+        self._by_change: Dict[int, TransactionRecord] = {}
+        self._change_log: Optional[List[int]] = []
+        self._change_seq = 0
+        self._lock = threading.RLock()
+        self.journal = None
+
+    @property
+    def next_seq(self) -> int:
+        return self._next_seq
+
+    @property
+    def change_seq(self) -> int:
+        """Номер последнего изменения — верхняя отметка для выборок since."""
+        return self._change_seq
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, tx_id: str) -> bool:
+        return tx_id in self._records
+
+    def add(self, data: Dict, status: str, **fields) -> None:
+        """Сохраняет транзакцию в начальном статусе; fields — error, queue_position и т.п."""
+        record = TransactionRecord()
+        for name, value in data.items():
+            record.set(name, value)
+        for name, value in fields.items():
+            record.set(name, value)
+        with self._lock:
+            # штамп под блокировкой: received_at монотонен по seq
+            now = time.time()
+            record.received_at = now
+            record.seq = self._next_seq
+            self._apply_status(record, status, now)
+            self._insert(record)
+            change = self._touch(record)
+            if self.journal is not None:
+                self.journal.append(['a', record.seq, now, status, data, fields, change])
+            self._evict(now)
+
+    def transition(self, tx_id: str, status: str, **fields) -> bool:
+        """Единственная точка смены статуса; False, если запись уже вытеснена."""
+        with self._lock:
+            record = self._records.get(tx_id)
+            if record is None:
+                return False
+            now = time.time()
+            self._set_status(record, status, now, fields)
+            change = self._touch(record)
+            if self.journal is not None:
+                self.journal.append(['t', tx_id, status, now, fields, change])
+            return True
+
+    def snapshot_rows(self, batch_size: int = 5000) -> Iterator[List[tuple]]:
+        """Все записи от старых к новым кортежами по ROW_SLOTS; блокировка — на пачку."""
+        cursor = 0
+        while True:
+            with self._lock:
+                rows = []
+                for seq in self._all.iter_asc(cursor, self._next_seq):
+                    rows.append(_dump_row(self._by_seq[seq]))
+                    cursor = seq + 1
+                    if len(rows) >= batch_size:
+                        break
+            if not rows:
+                return
+            yield rows
+
+    def restore_rows(self, rows: List[tuple]):
+        """Записи из строк snapshot_rows() в порядке seq.
+
+        В пустое хранилище индексы достраиваются блоками (SeqIndex.extend), а
+        не вставкой по одному seq: так восстанавливаются миллионы записей.
+        Индекс изменений строится один раз в finish_restore(). Строки снимков
+        без change_seq дополняются None.
+        """
+        if rows and len(rows[0]) < _ROW_LENGTH:
+            rows = [tuple(row) + (None,) * (_ROW_LENGTH - len(row)) for row in rows]
+        with self._lock:
+            self._change_log = None
+            seqs = []
+            grouped = ((self._by_status, 'status', {}),) + ((
+                (self._by_sender, 'sender_account', {}),
+                (self._by_receiver, 'receiver_account', {}),
+            ) if self.index_accounts else ())
+            for row in rows:
+                record = _load_row(row)
+                if record.transaction_id in self._records:
+                    self._insert(record)
+                    self._register_change(record)
+                    continue
+                self._register_change(record)
+                self._records[record.transaction_id] = record
+                self._by_seq[record.seq] = record
+                seqs.append(record.seq)
+                for _, name, groups in grouped:
+                    key = getattr(record, name, None)
+                    if key is not None:
+                        group = groups.get(key)
+                        if group is None:
+                            group = groups[key] = []
+                        group.append(record.seq)
+            self._all.extend(seqs)
+            for indexes, _, groups in grouped:
+                for key, group in groups.items():
+                    index = indexes.get(key)
+                    if index is None:
+                        index = indexes[key] = SeqIndex()
+                    index.extend(group)
+            if seqs:
+                self._next_seq = max(self._next_seq, seqs[-1] + 1)
+
+    def replay(self, entry: list):
+        """Применяет кадр журнала; повторное применение даёт то же состояние."""
+        with self._lock:
+            # change_seq — последний элемент кадра; в журналах до него его нет
+            if entry[0] == 'a':
+                _, seq, now, status, data, fields = entry[:6]
+                record = TransactionRecord()
+                for name, value in data.items():
+                    record.set(name, value)
+                for name, value in fields.items():
+                    record.set(name, value)
+                record.received_at = now
+                record.seq = seq
+                self._apply_status(record, status, now, count=False)
+                self._insert(record)
+                self._touch(record, entry[6] if len(entry) > 6 else None)
+            elif entry[0] == 't':
+                _, tx_id, status, now, fields = entry[:5]
+                record = self._records.get(tx_id)
+                if record is not None:
+                    self._set_status(record, status, now, fields, count=False)
+                    self._touch(record, entry[5] if len(entry) > 5 else None)
+
+    def finish_restore(self, next_seq: int = 0, change_seq: int = 0):
+        with self._lock:
+            self._next_seq = max(self._next_seq, next_seq)
+            self._change_seq = max(self._change_seq, change_seq)
+            if self._change_log is None:
+                # записи из снимков без change_seq считаются изменёнными сейчас
+                for seq in self._all.iter_asc(0, self._next_seq):
+                    record = self._by_seq[seq]
+                    if getattr(record, 'change_seq', None) is None:
+                        self._change_seq += 1
+                        record.change_seq = self._change_seq
+                        self._by_change[record.change_seq] = record
+                self._change_log = sorted(self._by_change)
+            self._evict(time.time())
+
+    def pending(self, statuses: Tuple[str, ...] = PENDING_STATUSES) -> List[Dict]:
+        """Данные транзакций в статусах statuses от старых к новым — для повторной постановки в очередь."""
+        with self._lock:
+            seqs = sorted(seq for status in statuses if status in self._by_status
+                          for seq in self._by_status[status].iter_asc(0, self._next_seq))
+            return [self._by_seq[seq].data() for seq in seqs]
+
+    def status_counts(self) -> Dict[str, int]:
+        """Текущее число записей по статусам — O(число статусов)."""
+        with self._lock:
+            return {status: len(index) for status, index in self._by_status.items()}
+
+    def transition_totals(self) -> Dict[str, int]:
+        """Сколько раз транзакции переходили в каждый статус с момента старта."""
+        with self._lock:
+            return dict(self._transitions)
+
+    def status_of(self, tx_id: str) -> Optional[str]:
+        with self._lock:
+            record = self._records.get(tx_id)
+            return getattr(record, 'status', None) if record is not None else None
+
+    def get(self, tx_id: str) -> Optional[Dict]:
+        with self._lock:
+            record = self._records.get(tx_id)
+            return record.to_dict() if record is not None else None
+
+    def query(self, status: Optional[str] = None, sender: Optional[str] = None,
+              receiver: Optional[str] = None, received_from: Optional[float] = None,
+              received_to: Optional[float] = None, offset: int = 0,
+              limit: int = 50) -> Tuple[List[Dict], int]:
+        """Страница записей от новых к старым и общее число подходящих.
+
+        Обход идёт по самому короткому из применимых индексов, диапазон
+        received_at переводится в диапазон seq бинарным поиском.
+        """
+        with self._lock:
+            lo, hi = self._seq_range(received_from, received_to)
+            index, rest = self._pick_index(status, sender, receiver)
+            if index is None:
+                return [], 0
+            if not rest:
+                total = index.count_range(lo, hi)
+                seqs = []
+                for seq in index.iter_desc(lo, hi, offset):
+                    if len(seqs) >= limit:
+                        break
+                    seqs.append(seq)
+            else:
+                total, seqs = 0, []
+                for seq in index.iter_desc(lo, hi):
+                    record = self._by_seq[seq]
+                    if all(getattr(record, name, None) == value for name, value in rest):
+                        if offset <= total < offset + limit:
+                            seqs.append(seq)
+                        total += 1
+            page = [self._by_seq[seq].to_dict() for seq in seqs]
+        return page, total
+
+    def page(self, fields: Tuple[str, ...], status: Optional[str] = None, sender: Optional[str] = None,
+             receiver: Optional[str] = None, received_from: Optional[float] = None,
+             received_to: Optional[float] = None, after: Optional[Tuple[float, str]] = None,
+             limit: int = 50, descending: bool = True) -> Tuple[List[Dict], Optional[Tuple[float, str]]]:
+        """Страница с проекцией fields, следующая за курсором after, и курсор следующей страницы.
+
+        Курсор — (received_at, transaction_id) последней выданной записи; None
+        вместо курсора следующей страницы — подходящих записей больше нет.
+        Без фильтров, проверяемых по записи, страница стоит O(log n + limit).
+        """
+        with self._lock:
+            lo, hi = self._seq_range(received_from, received_to)
+            if after is not None:
+                if descending:
+                    hi = min(hi, self._cursor_seq(after, right=False))
+                else:
+                    lo = max(lo, self._cursor_seq(after, right=True))
+            index, rest = self._pick_index(status, sender, receiver)
+            if index is None or lo >= hi:
+                return [], None
+            records = []
+            for seq in index.iter_desc(lo, hi) if descending else index.iter_asc(lo, hi):
+                record = self._by_seq[seq]
+                if all(getattr(record, name, None) == value for name, value in rest):
+                    if len(records) == limit:
+                        last = records[-1]
+                        return [r.project(fields) for r in records], (last.received_at, last.transaction_id)
+                    records.append(record)
+            return [r.project(fields) for r in records], None
+
+    def cursor_of(self, tx_id: str) -> Optional[Tuple[float, str]]:
+        """Курсор page(), указывающий на запись tx_id, — чтобы продолжить offset-выборку курсором."""
+        with self._lock:
+            record = self._records.get(tx_id)
+            return (record.received_at, tx_id) if record is not None else None
+
+    def select(self, fields: Tuple[str, ...], status: Optional[str] = None, sender: Optional[str] = None,
+               receiver: Optional[str] = None, received_from: Optional[float] = None,
+               received_to: Optional[float] = None, limit: int = 10000) -> List[Tuple]:
+        """Только указанные поля подходящих записей, от новых к старым, без сборки словарей."""
+        with self._lock:
+            lo, hi = self._seq_range(received_from, received_to)
+            index, rest = self._pick_index(status, sender, receiver)
+            if index is None:
+                return []
+            rows = []
+            for seq in index.iter_desc(lo, hi):
+                record = self._by_seq[seq]
+                if all(getattr(record, name, None) == value for name, value in rest):
+                    rows.append(tuple(getattr(record, name, None) for name in fields))
+                    if len(rows) >= limit:
+                        break
+            return rows
+
+    def iter_batches(self, status: Optional[str] = None, sender: Optional[str] = None,
+                     receiver: Optional[str] = None, received_from: Optional[float] = None,
+                     received_to: Optional[float] = None,
+                     batch_size: int = 1000) -> Iterator[List[Dict]]:
+        """Записи от старых к новым пачками; блокировка берётся на одну пачку.
+
+        Между пачками обход продолжается с последнего выданного seq, так что
+        параллельные вставки и вытеснение не ломают итерацию.
+        """
+        cursor = None
+        while True:
+            with self._lock:
+                lo, hi = self._seq_range(received_from, received_to)
+                index, rest = self._pick_index(status, sender, receiver)
+                if index is None:
+                    return
+                batch = []
+                for seq in index.iter_asc(lo if cursor is None else max(lo, cursor), hi):
+                    record = self._by_seq[seq]
+                    cursor = seq + 1
+                    if all(getattr(record, name, None) == value for name, value in rest):
+                        batch.append(record.to_dict())
+                        if len(batch) >= batch_size:
+                            break
+            if not batch:
+                return
+            yield batch
+
+    def changes(self, fields: Tuple[str, ...], since: int, until: int, status: Optional[str] = None,
+                sender: Optional[str] = None, receiver: Optional[str] = None,
+                received_from: Optional[float] = None, received_to: Optional[float] = None,
+                limit: int = 1000) -> Tuple[List[Dict], Optional[int]]:
+        """Записи с change_seq в (since, until] по возрастанию change_seq и отметка продолжения.
+
+        Запись попадает в выборку один раз — по последнему изменению. Вместо
+        отметки None — в диапазоне больше ничего нет; иначе это change_seq
+        последней выданной записи, с неё продолжается следующая выборка.
+        """
+        with self._lock:
+            records = []
+            for record in self._changed(since + 1, until + 1):
+                if self._matches(record, status, sender, receiver, received_from, received_to):
+                    if len(records) == limit:
+                        return [r.project(fields) for r in records], records[-1].change_seq
+                    records.append(record)
+            return [r.project(fields) for r in records], None
+
+    def iter_changes(self, since: int, until: int, status: Optional[str] = None,
+                     sender: Optional[str] = None, receiver: Optional[str] = None,
+                     received_from: Optional[float] = None, received_to: Optional[float] = None,
+                     batch_size: int = 1000) -> Iterator[List[Dict]]:
+        """Как iter_batches(), но записи с change_seq в (since, until] по возрастанию change_seq.
+
+        Запись, изменённая во время обхода, получает номер больше until и
+        достанется следующей выборке since=until.
+        """
+        cursor = since + 1
+        while True:
+            with self._lock:
+                batch = []
+                for record in self._changed(cursor, until + 1):
+                    cursor = record.change_seq + 1
+                    if self._matches(record, status, sender, receiver, received_from, received_to):
+                        batch.append(record.to_dict())
+                        if len(batch) >= batch_size:
+                            break
+            if not batch:
+                return
+            yield batch
+
+    def count(self, status: Optional[str] = None) -> int:
+        with self._lock:
+            if status is None:
+                return len(self._records)
+            index = self._by_status.get(status)
+            return len(index) if index is not None else 0
+
+    def evict_expired(self) -> int:
+        with self._lock:
+            return self._evict(time.time())
+
+    def _pick_index(self, status: Optional[str], sender: Optional[str],
+                    receiver: Optional[str]) -> Tuple[Optional[SeqIndex], List[Tuple[str, str]]]:
+        """Самый короткий применимый индекс и фильтры, проверяемые по записи.
+
+        None вместо индекса — по одному из фильтров заведомо нет записей.
+        """
+        filters = []
+        for name, value, indexes, enabled in (
+            ('status', status, self._by_status, True),
+            ('sender_account', sender, self._by_sender, self.index_accounts),
+            ('receiver_account', receiver, self._by_receiver, self.index_accounts),
+        ):
+            if value is None:
+                continue
+            index = indexes.get(value) if enabled else None
+            if enabled and index is None:
+                return None, []
+            filters.append((name, value, index))
+        indexed = [f for f in filters if f[2] is not None]
+        index = min(indexed, key=lambda f: len(f[2]))[2] if indexed else self._all
+        return index, [(name, value) for name, value, idx in filters if idx is not index]
+
+    def _seq_range(self, received_from: Optional[float], received_to: Optional[float]) -> Tuple[int, int]:
+        key = lambda seq: self._by_seq[seq].received_at
+        lo = self._all.bisect_key(received_from, key) if received_from is not None else 0
+        # to включительно: hi — первый seq с received_at > received_to
+        hi = self._all.bisect_key(received_to, key, right=True) if received_to is not None else self._next_seq
+        return lo, hi
+
+    def _cursor_seq(self, cursor: Tuple[float, str], right: bool) -> int:
+        """Граница seq для курсора: сама запись (следующая за ней при right) или её место по received_at.
+
+        Запись могла быть вытеснена или заменена повторным приёмом с тем же id —
+        тогда позиция ищется бинарным поиском по received_at.
+        """
+        received_at, tx_id = cursor
+        record = self._records.get(tx_id)
+        if record is not None and record.received_at == received_at:
+            return record.seq + 1 if right else record.seq
+        return self._all.bisect_key(received_at, lambda seq: self._by_seq[seq].received_at, right=right)
+
+    @staticmethod
+    def _matches(record: TransactionRecord, status: Optional[str], sender: Optional[str],
+                 receiver: Optional[str], received_from: Optional[float],
+                 received_to: Optional[float]) -> bool:
+        """Фильтры выборок по изменениям: индексы упорядочены по seq, а не по change_seq."""
+        return ((status is None or getattr(record, 'status', None) == status)
+                and (sender is None or getattr(record, 'sender_account', None) == sender)
+                and (receiver is None or getattr(record, 'receiver_account', None) == receiver)
+                and (received_from is None or record.received_at >= received_from)
+                and (received_to is None or record.received_at <= received_to))
+
+    def _changed(self, lo: int, hi: int) -> Iterator[TransactionRecord]:
+        """Записи с change_seq в [lo, hi) по возрастанию; перезаписанные номера пропускаются."""
+        log = self._change_log
+        by_change = self._by_change
+        for i in range(bisect_left(log, lo), len(log)):
+            change = log[i]
+            if change >= hi:
+                return
+            record = by_change.get(change)
+            if record is not None:
+                yield record
+
+    def _touch(self, record: TransactionRecord, change: Optional[int] = None) -> int:
+        """Присваивает записи следующий номер изменения (или change из журнала)."""
+        self._forget_change(record)
+        if change is None:
+            self._change_seq += 1
+            change = self._change_seq
+        elif change > self._change_seq:
+            self._change_seq = change
+        record.change_seq = change
+        self._by_change[change] = record
+        log = self._change_log
+        if log is not None:
+            if not log or change > log[-1]:
+                log.append(change)
+            else:
+                # кадры журнала без снимка: номер уже мог быть выдан при повторном применении
+                i = bisect_left(log, change)
+                if i == len(log) or log[i] != change:
+                    log.insert(i, change)
+            if len(log) > 2 * len(self._by_change) + 1024:
+                self._compact_changes()
+        return change
+
+    def _compact_changes(self):
+        # O(размера журнала номеров) раз на столько же изменений
+        by_change = self._by_change
+        self._change_log = [change for change in self._change_log if change in by_change]
+
+    def _register_change(self, record: TransactionRecord):
+        change = getattr(record, 'change_seq', None)
+        if change is not None:
+            self._by_change[change] = record
+            self._change_seq = max(self._change_seq, change)
+
+    def _forget_change(self, record: TransactionRecord):
+        change = getattr(record, 'change_seq', None)
+        if change is not None and self._by_change.get(change) is record:
+            del self._by_change[change]
+
+    def _apply_status(self, record: TransactionRecord, status: str, now: float, count: bool = True):
+        record.set('status', status)
+        stamp = STATUS_TIMESTAMPS.get(status)
+        if stamp is not None and stamp != 'received_at':
+            setattr(record, stamp, now)
+        if count:
+            self._transitions[status] = self._transitions.get(status, 0) + 1
+
+    def _set_status(self, record: TransactionRecord, status: str, now: float, fields: Dict, count: bool = True):
+        old_status = getattr(record, 'status', None)
+        for name, value in fields.items():
+            record.set(name, value)
+        self._apply_status(record, status, now, count)
+        if status != old_status:
+            self._unindex(self._by_status, old_status, record.seq)
+            self._reindex(self._by_status, status, record.seq)
+
+    def _insert(self, record: TransactionRecord):
+        previous = self._records.get(record.transaction_id)
+        if previous is not None:
+            self._remove(previous)
+        self._records[record.transaction_id] = record
+        self._by_seq[record.seq] = record
+        self._all.add(record.seq)
+        self._index(record)
+        self._next_seq = max(self._next_seq, record.seq + 1)
+
+    def _index(self, record: TransactionRecord):
+        self._reindex(self._by_status, getattr(record, 'status', None), record.seq)
+        if self.index_accounts:
+            self._reindex(self._by_sender, getattr(record, 'sender_account', None), record.seq)
+            self._reindex(self._by_receiver, getattr(record, 'receiver_account', None), record.seq)
+
+    def _remove(self, record: TransactionRecord):
+        del self._records[record.transaction_id]
+        del self._by_seq[record.seq]
+        self._all.discard(record.seq)
+        self._forget_change(record)
+        self._unindex(self._by_status, getattr(record, 'status', None), record.seq)
+        if self.index_accounts:
+            self._unindex(self._by_sender, getattr(record, 'sender_account', None), record.seq)
+            self._unindex(self._by_receiver, getattr(record, 'receiver_account', None), record.seq)
+
+    @staticmethod
+    def _reindex(indexes: Dict[str, SeqIndex], key, seq: int):
+        if key is None:
+            return
+        index = indexes.get(key)
+        if index is None:
+            index = indexes[key] = SeqIndex()
+        index.add(seq)
+
+    @staticmethod
+    def _unindex(indexes: Dict[str, SeqIndex], key, seq: int):
+        index = indexes.get(key)
+        if index is None:
+            return
+        index.discard(seq)
+        if not len(index):
+            del indexes[key]
+
+    def _evict(self, now: float) -> int:
+        # от старых к новым, но только по индексам конечных статусов: не оценённые
+        # в них не попадают (иначе transition() воркера не найдёт запись), и их
+        # число не влияет на стоимость — каждая запись вытесняется за O(статусов + log n)
+        cutoff = now - self.ttl_seconds
+        excess = len(self._records) - self.max_size
+        evicted = 0
+        while True:
+            oldest = min((index.first() for status, index in self._by_status.items()
+                          if status not in PENDING_STATUSES), default=None)
+            if oldest is None:
+                break
+            record = self._by_seq[oldest]
+            if evicted >= excess and record.received_at >= cutoff:
+                break
+            self._remove(record)
+            evicted += 1
+        self.pending_over_limit = max(0, len(self._records) - self.max_size)
+        self.evicted_count += evicted
+        return evicted
@@ -0,0 +1,135 @@
+"""Автомасштабирование воркеров processing_queue.
+
+WorkerSupervisor держит от min_workers до max_workers потоков-воркеров и раз
+в interval секунд сравнивает глубину очереди с темпом её разбора. Если при
+текущем темпе очередь не разобрать за target_drain_seconds, пул растёт
+пропорционально отставанию; если очередь пуста idle_intervals проверок подряд,
+пул сокращается на один воркер. Лишний воркер не прерывается посреди пачки:
+он получает сигнал остановки и выходит после текущей пачки.
+"""
+import logging
+import math
+import threading
+import time
+from typing import Callable, Dict, List
+
+logger = logging.getLogger()
+
+
+class WorkerSupervisor:
+    """target(stop_event) — цикл воркера, который выходит после stop_event.set()."""
+
+    def __init__(self, target: Callable[[threading.Event], None], depth: Callable[[], int],
+                 completed: Callable[[], int], min_workers: int, max_workers: int,
+                 interval: float = 1.0, target_drain_seconds: float = 2.0, idle_intervals: int = 5):
+        if min_workers < 1 or max_workers < min_workers:
+            raise ValueError("worker bounds must satisfy 1 <= min_workers <= max_workers")
+        self.target = target
+        self.depth = depth
+        self.completed = completed
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.target_drain_seconds = target_drain_seconds
+        self.idle_intervals = idle_intervals
+        self.scale_ups = 0
+        self.scale_downs = 0
+        self.drain_rate = 0.0
+        self._workers: List[tuple] = []
+        self._idle_checks = 0
+        self._next_id = 1
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return len(self._workers)
+
+    def start(self):
+        with self._lock:
+            for _ in range(self.min_workers):
+                self._spawn()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="WorkerSupervisor")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            for _, stop_event in self._workers:
+                stop_event.set()
+
+    def join(self, timeout: float) -> int:
+        """Ждёт выхода воркеров после stop() не дольше timeout; возвращает, сколько ещё работает."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            threads = [t for t, _ in self._workers]
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        return sum(t.is_alive() for t in threads)
+
+    def desired_size(self, workers: int, depth: int, drain_rate: float) -> int:
+        """Сколько воркеров нужно при данной глубине очереди и темпе разбора (транзакций/с)."""
+        if depth == 0:
+            self._idle_checks += 1
+            if self._idle_checks >= self.idle_intervals:
+                self._idle_checks = 0
+                return max(self.min_workers, workers - 1)
+            return workers
+        self._idle_checks = 0
+        if drain_rate <= 0:
+            # очередь стоит: либо воркеры заняты долгими пачками, либо их мало
+            return min(self.max_workers, workers + 1)
+        eta = depth / drain_rate
+        if eta <= self.target_drain_seconds:
+            return workers
+        return min(self.max_workers, max(workers + 1, math.ceil(workers * eta / self.target_drain_seconds)))
+
+    def snapshot(self) -> Dict:
+        return {
+            "workers": self.size,
+            "min_workers": self.min_workers,
+            "max_workers": self.max_workers,
+            "drain_rate": round(self.drain_rate, 2),
+            "scale_ups": self.scale_ups,
+            "scale_downs": self.scale_downs,
+        }
+
+    def _run(self):
+        last_completed, last_time = self.completed(), time.monotonic()
+        while not self._stop.wait(self.interval):
+            now, completed = time.monotonic(), self.completed()
+            self.drain_rate = (completed - last_completed) / max(now - last_time, 1e-6)
+            last_completed, last_time = completed, now
+            try:
+                self._resize(self.depth())
+            except Exception as e:
+                logger.error(f"Worker autoscaling failed: {str(e)}",
+                             extra={'component': 'supervisor', 'correlation_id': 'system'})
+
+    def _resize(self, depth: int):
+        with self._lock:
+            # воркеры, вышедшие сами (например, по processor.running), не считаются
+            self._workers = [(t, e) for t, e in self._workers if t.is_alive()]
+            workers = len(self._workers)
+            desired = self.desired_size(workers, depth, self.drain_rate)
+            for _ in range(desired - workers):
+                self._spawn()
+            for _ in range(workers - desired):
+                self._workers.pop()[1].set()
+        if desired != workers:
+            if desired > workers:
+                self.scale_ups += 1
+            else:
+                self.scale_downs += 1
+            logger.info(f"Scaled workers {workers} -> {desired} (queue depth {depth}, "
+                        f"drain rate {self.drain_rate:.1f}/s)",
+                        extra={'component': 'supervisor', 'correlation_id': 'system'})
+
+    def _spawn(self):
+        stop_event = threading.Event()
+        t = threading.Thread(target=self.target, args=(stop_event,), daemon=True, name=f"Worker-{self._next_id}")
+        self._next_id += 1
+        t.start()
+        self._workers.append((t, stop_event))